@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the queue used by the Recorder classes to hand the raw
+chunks from the driver callback over to a consumer thread.
+
+The queue has a single producer (the driver callback) and a single consumer.
+All the slots are preallocated, so putting a chunk only copies its bytes and
+never allocates. The producer only advances the write counter and the consumer
+only advances the read counter, so neither side needs a lock. If the consumer
+falls behind and the queue is full, the new chunk is dropped and counted
+as an overrun, instead of blocking the driver callback.
+
+Example:
+    | >>>q = ChunkQueue(8, 1024*2, dtype = np.int16)
+    | >>>q.put(in_data)            # In the driver callback
+    | True
+    | >>>data = q.get(timeout = 0.1) # In the consumer thread
+"""
+import threading
+
+import numpy as np
+
+class ChunkQueue(object):
+    """
+    Preallocated single-producer/single-consumer queue of raw chunks
+
+    Attributes
+    ----------
+    num_slots: int
+        Maximum number of chunks held by the queue
+    slot_size: int
+        Maximum number of raw samples in one chunk
+    dtype: numpy dtype
+        Data type of the raw samples
+    overruns: int
+        Number of chunks dropped because the queue was full
+    """
+    def __init__(self,num_slots,slot_size,dtype = np.int16):
+        """
+        Allocate the slots
+
+        Parameters
+        ----------
+        num_slots: int
+            Maximum number of chunks held by the queue
+        slot_size: int
+            Maximum number of raw samples in one chunk
+            (i.e. chunk size x channels)
+        dtype: numpy dtype
+            Data type of the raw samples
+        """
+        self.num_slots = int(num_slots)
+        self.slot_size = int(slot_size)
+        self.dtype = np.dtype(dtype)
+        self._slots = np.zeros((self.num_slots,self.slot_size),dtype = self.dtype)
+        self._lengths = np.zeros(self.num_slots,dtype = np.int64)
+        self._head = 0
+        self._tail = 0
+        self._ready = threading.Event()
+        self.overruns = 0
+
+#---------------- PRODUCER METHODS -----------------------------------
+    def put(self,data):
+        """
+        Copy a raw chunk into the next free slot. Never blocks.
+
+        Parameters
+        ----------
+        data: bytes or Numpy Array
+            Raw chunk, in the data type of the queue
+
+        Returns
+        ----------
+        bool
+            True if the chunk is queued, False if it is dropped
+        """
+        samples = np.frombuffer(data,dtype = self.dtype)
+        if (self._tail - self._head >= self.num_slots or
+            samples.shape[0] > self.slot_size):
+            self.overruns += 1
+            return False
+
+        slot = self._tail % self.num_slots
+        self._slots[slot,:samples.shape[0]] = samples
+        self._lengths[slot] = samples.shape[0]
+        # Publish the chunk only once it is copied
+        self._tail += 1
+        self._ready.set()
+        return True
+
+#---------------- CONSUMER METHODS -----------------------------------
+    def get(self,timeout = None):
+        """
+        Take the oldest chunk from the queue
+
+        Parameters
+        ----------
+        timeout: float
+            Time in seconds to wait for a chunk if the queue is empty.
+            None to wait indefinitely
+
+        Returns
+        ----------
+        data: Numpy Array
+            Copy of the raw chunk, or None if no chunk arrived in time
+        """
+        if self._head == self._tail:
+            # Clear before checking again, so a put() in between is not missed
+            self._ready.clear()
+            if self._head == self._tail:
+                self._ready.wait(timeout)
+            if self._head == self._tail:
+                return None
+
+        slot = self._head % self.num_slots
+        data = self._slots[slot,:self._lengths[slot]].copy()
+        # Free the slot only once it is copied
+        self._head += 1
+        return data
+
+    def wake(self):
+        """
+        Wake up the consumer if it is waiting in get()
+        """
+        self._ready.set()
+
+    def __len__(self):
+        """
+        Number of chunks waiting in the queue
+        """
+        return self._tail - self._head
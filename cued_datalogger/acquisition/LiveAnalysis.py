@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the class to compute the quantities displayed by the
+live plots of the acquisition window, for all the channels at once.
+
+The window and weightage applied before the DFT only depend on the length of
+the buffer, so they are computed once and cached. Every update is then a
+single batched rfft over all the channels, plus a few vectorised reductions
+for the levels, over the new samples only, and the zero crossings, for the
+held channels only.
+
+Example:
+    | >>>la = LiveAnalysis()
+    | >>>la.analyse(buffer_data, chunk_size = 1024)
+    | >>>la.rms, la.peaks, la.spectrum, la.zero_crossings
+"""
+import numpy as np
+from numpy.fft import rfft
+
+class LiveAnalysis(object):
+    """
+    Batched analysis of the streamed buffer
+
+    Attributes
+    ----------
+    rms: Numpy Array
+        RMS level of the newest samples of each channel
+    peaks: Numpy Array
+        Peak level of the newest samples of each channel
+    spectrum: Numpy Array
+        Square root of the DFT magnitude of each channel,
+        with dimension of (frequencies x channels)
+    zero_crossings: Numpy Array
+        Index of the first rising zero crossing of each held channel,
+        0 if there is none or the channel is not held
+    """
+    def __init__(self):
+        self._windows = {}
+        self.rms = np.zeros(0)
+        self.peaks = np.zeros(0)
+        self.spectrum = np.zeros((0,0))
+        self.zero_crossings = np.zeros(0,dtype = np.int64)
+
+    def get_window(self,length):
+        """
+        Get the window multiplied by the weightage for a buffer length,
+        computing it only once
+
+        Parameters
+        ----------
+        length: int
+            Number of samples in the buffer
+
+        Returns
+        ----------
+        window: Numpy Array
+            Column vector, to broadcast over the channels
+        """
+        window = self._windows.get(length)
+        if window is None:
+            # The weightage grows exponentially to the end of the buffer,
+            # so the newest data dominates the spectrum
+            weightage = np.exp(2 * np.arange(length) / max(length - 1,1))
+            window = (np.hanning(length) * weightage).astype(np.float32)
+            window = window.reshape((length,1))
+            self._windows[length] = window
+        return window
+
+    def clear_cache(self):
+        """
+        Forget the cached windows, e.g. when the buffer size changes
+        """
+        self._windows = {}
+
+    def analyse(self,data,chunk_size = None,held = None):
+        """
+        Compute the levels, spectra and zero crossings of all the channels
+
+        Parameters
+        ----------
+        data: Numpy Array
+            Buffer data with dimension of (samples x channels)
+        chunk_size: int
+            Number of the most recent samples used for the levels, e.g. the
+            samples that are new since the last analysis. If 0, the levels
+            are kept. Defaults to the whole buffer
+        held: Numpy Array
+            Boolean mask of the channels to find the zero crossing of.
+            Defaults to all the channels
+        """
+        length,channels = data.shape
+        if chunk_size is None:
+            chunk_size = length
+        chunk_size = min(chunk_size,length)
+
+        # Levels of the newest samples
+        if chunk_size or not self.rms.shape == (channels,):
+            currentdata = data[length-chunk_size:,:]
+            currentdata = currentdata - np.mean(currentdata,axis = 0)
+            self.rms = np.sqrt(np.mean(currentdata ** 2,axis = 0))
+            self.peaks = np.amax(np.abs(currentdata),axis = 0)
+
+        # First rising crossing of the mean of each held channel
+        if held is None:
+            held = np.ones(channels,dtype = bool)
+        self.zero_crossings = np.zeros(channels,dtype = np.int64)
+        if held.any():
+            held_data = data[:,held]
+            rising = np.diff(np.sign(held_data - np.mean(held_data,axis = 0)),axis = 0) > 0
+            self.zero_crossings[held] = np.where(rising.any(axis = 0),
+                                                 rising.argmax(axis = 0) + 1, 0)
+
+        # DFT of all the channels at once
+        fft_data = rfft(data * self.get_window(length),axis = 0)
+        self.spectrum = np.sqrt(np.abs(fft_data))
@@ -65,14 +65,17 @@ class Recorder(RecorderParent):
     """
 #---------------- INITIALISATION METHODS -----------------------------------
     def __init__(self,channels = 1,rate = 30000.0, chunk_size = 1000,
-                 num_chunk = 4,device_name = None):
+                 num_chunk = 4,device_name = None,storage_dtype = np.float64,
+                 threaded = False):
         """
         Re-implemented from RecorderParent
         """
 
         super().__init__(channels = channels,rate = rate,
-             chunk_size = chunk_size,num_chunk = num_chunk)
+             chunk_size = chunk_size,num_chunk = num_chunk,
+             storage_dtype = storage_dtype,threaded = threaded)
         print('You are using National Instrument for recording')
+        self.scale_factor = 10.0/2**15
 
         self.device_name = None
         self.set_device_by_name(device_name);
@@ -199,20 +202,11 @@ class Recorder(RecorderParent):
         return channelname
 
 #---------------- STREAMING METHODS -----------------------------------
-    # Convert data obtained into a proper array
-    def audiodata_to_array(self,data):
-        """
-        Re-implemented from RecorderParent
-        """
-        return data.reshape((-1,self.channels))/(2**15) *10.0
-
     # Callback function for audio streaming
     def stream_audio_callback(self):
         """
         Callback function for audio streaming.
-        First, it writes data to the circular buffer,
-        then record data if it is recording,
-        finally check for any trigger.
+        Reads the data from the task, then hands it to receive_chunk().
 
         Returns 0 as part of the callback format.
         More info can be found in PyDAQmx documentation on Task class
@@ -222,16 +216,9 @@ class Recorder(RecorderParent):
         self.audio_stream.ReadBinaryI16(self.chunk_size,10.0,pdaq.DAQmx_Val_GroupByScanNumber,
                            in_data,self.chunk_size*self.channels,pdaq.byref(read),None)
 
-        data_array = self.audiodata_to_array(in_data)
-        self.write_buffer(data_array)
+        self.receive_chunk(in_data)
         #self.rEmitter.newdata.emit()
 
-        if self.recording:
-            self.record_data(data_array)
-         # Trigger check
-        if self.trigger:
-            self._trigger_check_threshold(data_array)
-
         return 0
 
     def stream_init(self, playback = False):
@@ -240,6 +227,7 @@ class Recorder(RecorderParent):
         """
         if self.audio_stream == None:
             try:
+                self.consumer_start()
                 self.audio_stream = Task()
                 self.audio_stream.stream_audio_callback = self.stream_audio_callback
                 self.audio_stream.CreateAIVoltageChan(self.set_channels(),"",
@@ -259,6 +247,7 @@ class Recorder(RecorderParent):
                 print(v)
                 print(traceback.format_tb(tb))
                 self.audio_stream = None
+                self.consumer_stop()
 
                 return False
 
@@ -299,4 +288,5 @@ class Recorder(RecorderParent):
         if self.audio_stream:
             self.audio_stream.StopTask()
             self.audio_stream.ClearTask()
-            self.audio_stream = None
\ No newline at end of file
+            self.audio_stream = None
+            self.consumer_stop()
\ No newline at end of file
@@ -21,7 +21,10 @@ class RecEmitter(QObject):
         Emits when trigger threshold is reached
     newdata: pyqtsignal
         Emits when new data is received (not used)
+    chunksdropped: pyqtsignal(int)
+        Emits the total number of dropped chunks when more chunks are dropped
     """
     recorddone = pyqtSignal()
     triggered = pyqtSignal()
-    newdata = pyqtSignal()
\ No newline at end of file
+    newdata = pyqtSignal()
+    chunksdropped = pyqtSignal(int)
\ No newline at end of file
@@ -23,6 +23,11 @@ Attributes
 from abc import ABCMeta, abstractmethod
 import numpy as np
 import copy as cp
+import threading
+
+from cued_datalogger.acquisition.RingBuffer import RingBuffer
+from cued_datalogger.acquisition.ChunkQueue import ChunkQueue
+from cued_datalogger.acquisition.StreamFile import StreamWriter
 
 try:
     from cued_datalogger.acquisition.RecEmitter import RecEmitter
@@ -49,12 +54,23 @@ class RecorderParent(object):
         Number of chunks to store in circular buffer
     recording: bool
         Indicate whether to record
+    filename: str
+        File to stream the recordings to. None to record into memory
+    scale_factor: float
+        Factor to convert the raw integer samples into physical values
+    threaded: bool
+        Indicate whether the chunks are processed by a consumer thread
+        instead of the driver callback
+    queue_slots: int
+        Number of chunks the queue to the consumer thread can hold
+    input_overflows: int
+        Number of input overflows reported by the driver
     """
     __metaclass__ = ABCMeta
     
 #---------------- INITIALISATION METHODS -----------------------------------    
     def __init__(self,channels = 1,rate = 44100, chunk_size = 1024,
-                 num_chunk = 4):
+                 num_chunk = 4,storage_dtype = np.float64,threaded = False):
         """
         Initialise a ciruclar buffer, array and trigger for recording
         
@@ -68,12 +84,26 @@ class RecorderParent(object):
             Number of samples to get from each channel in one chunk
         num_chunk: int
             Number of chunks to store in circular buffer
+        storage_dtype: numpy dtype
+            Data type of the buffer and recordings. See storage_dtype
+        threaded: bool
+            Whether the driver callback only queues the raw chunks, leaving
+            the processing to a consumer thread
         """
         self.channels = channels
         self.rate = rate
+        self.scale_factor = 1/2**15
+        self._storage_dtype = np.dtype(storage_dtype)
         self.chunk_size = chunk_size
         self.num_chunk = num_chunk;
         self.audio_stream = None #: The audio object
+        self.filename = None
+        self.stream_writer = None
+        self.threaded = threaded
+        self.queue_slots = 16
+        self.chunk_queue = None
+        self.consumer_thread = None
+        self.input_overflows = 0
         
         self.allocate_buffer()
         self.show_stream_settings()
@@ -89,10 +119,9 @@ class RecorderParent(object):
         """
         Set up the circular buffer
         """
-        self.buffer = np.zeros(shape = (self.num_chunk,
-                                        self.chunk_size,
-                                        self.channels))
-        self.next_chunk = 0;
+        self.ring_buffer = RingBuffer(self.num_chunk * self.chunk_size,
+                                      channels = self.channels,
+                                      dtype = self.storage_dtype)
 
 #---------------- DESTRUCTOR METHODS -----------------------------------     
     def __del__(self):
@@ -115,6 +144,15 @@ class RecorderParent(object):
         print('Number of chunks: %i' % self.num_chunk)
         
     def set_filename(self,filename):
+        """
+        Set the file to stream the recordings to.
+        Recordings are kept in memory if it is None.
+        
+        Parameters
+        ----------
+        filename: str
+            Path to the stream file
+        """
         self.filename = filename
         
     @abstractmethod
@@ -142,41 +180,200 @@ class RecorderParent(object):
     def audiodata_to_array(self,data):
         """
         Convert audio data obtained into a proper array
+        If the samples are stored as integers, the raw data is kept as it is,
+        otherwise it is scaled with scale_factor
         
         Parameters
         -----------
         data: Numpy Array
             Audio data 
         """
-        return data.reshape((-1,self.channels))/ 2**15
+        data = data.reshape((-1,self.channels))
+        if self.storage_dtype.kind in 'iu':
+            return data.astype(self.storage_dtype,copy = False)
+        else:
+            return data * self.scale_factor
+
+    def scale_data(self,data,dtype = np.float32,copy = False,order = 'K',
+                   out = None):
+        """
+        Convert data taken from the buffer or a recording into physical values.
+        Data stored as floats is already scaled, and is returned as it is.
+        
+        Parameters
+        -----------
+        data: Numpy Array
+            Data from the buffer or a recording
+        dtype: numpy dtype
+            Data type of the scaled data, if the data needs scaling
+        copy: bool
+            Whether to always return a new array
+        order: str
+            Memory layout of the scaled data, or of the copy.
+            e.g. 'C' with the transpose of the data gives each channel
+            contiguous, in the same pass as the scaling
+        out: Numpy Array
+            Preallocated array of the same shape as the data to write the
+            scaled data into, instead of allocating a new one
+            
+        Returns
+        ----------
+        Scaled data: Numpy Array
+        """
+        if out is not None:
+            if self.storage_dtype.kind in 'iu':
+                return np.multiply(data,self.scale_factor,out = out)
+            out[...] = data
+            return out
+        if self.storage_dtype.kind in 'iu':
+            return np.multiply(data,self.scale_factor,dtype = dtype,order = order)
+        elif copy:
+            return np.array(data,order = order)
+        else:
+            return data
     
 #---------------- BUFFER METHODS -----------------------------------
     def write_buffer(self,data):
         """
-        Write the data obtained into buffer and move to the next chunk
+        Write the data obtained into the circular buffer
         
         Parameters
         -----------
         data: Numpy Array
             Audio data 
         """
-        self.buffer[self.next_chunk,:,:] = data
-        self.next_chunk = (self.next_chunk + 1) % self.num_chunk
+        self.ring_buffer.write(data)
      
-    def get_buffer(self):
+    def get_buffer(self,copy = False):
         """
-        Convert the buffer data as a 2D array by stitching the chunks together
+        Get the whole circular buffer as a 2D array. See RingBuffer.latest
+        
+        Parameters
+        ----------
+        copy: bool
+            Whether to copy the data, checked against the samples overwritten
+            by the stream during the copy. Otherwise the view keeps changing
         
         Returns
         ----------
         Buffer data: Numpy Array
-            with dimension of(chunk_size * num_chunk) x channels
+            Read-only view (or copy) with dimension of
+            (chunk_size * num_chunk) x channels
             The newest data on the most right 
         """
-        return np.concatenate((self.buffer[self.next_chunk:],self.buffer[:self.next_chunk]),axis = 0) \
-                 .reshape((self.buffer.shape[0] * self.buffer.shape[1],
-                           self.buffer.shape[2]))
+        return self.ring_buffer.latest(copy = copy)
+
+    def get_buffer_since(self,sequence,copy = False):
+        """
+        Get the buffer data written after a given sequence number.
+        See RingBuffer.read_since
+        
+        Parameters
+        ----------
+        sequence: int
+            Sequence number obtained from a previous read
+        copy: bool
+            Whether to copy the data, dropping the samples overwritten
+            by the stream during the copy. Otherwise the view keeps changing
+            
+        Returns
+        ----------
+        data: Numpy Array
+            Read-only view (or copy) of the new data
+        sequence: int
+            Sequence number to pass to the next read
+        """
+        return self.ring_buffer.read_since(sequence,copy = copy)
+
+#---------------- CALLBACK METHODS -----------------------------------
+    def receive_chunk(self,in_data):
+        """
+        Handle a raw chunk from the driver callback.
+        If threaded, the chunk is only copied into the queue to the
+        consumer thread, otherwise it is processed straight away
+        
+        Parameters
+        -----------
+        in_data: bytes or Numpy Array
+            Raw int16 chunk from the driver
+        """
+        if self.chunk_queue:
+            self.chunk_queue.put(in_data)
+        else:
+            self.process_chunk(self.audiodata_to_array(in_data))
+
+    def process_chunk(self,data_array):
+        """
+        First, write the chunk to the circular buffer,
+        then record it if it is recording,
+        finally check for any trigger.
         
+        Parameters
+        -----------
+        data_array: Numpy Array
+            Chunk converted by audiodata_to_array
+        """
+        self.write_buffer(data_array)
+
+        if self.recording:
+            self.record_data(data_array)
+        # Trigger check
+        if self.trigger:
+            self._trigger_check_threshold(data_array)
+
+    def consumer_start(self):
+        """
+        Set up the chunk queue and start the consumer thread, if threaded.
+        To be called before the stream is opened
+        """
+        self.consumer_stop()
+        self.input_overflows = 0
+        if not self.threaded:
+            return
+        self.chunk_queue = ChunkQueue(self.queue_slots,
+                                      self.chunk_size * self.channels,
+                                      dtype = np.int16)
+        self.consumer_thread = threading.Thread(target = self._consume_chunks,
+                                                args = (self.chunk_queue,),
+                                                daemon = True)
+        self.consumer_thread.start()
+
+    def consumer_stop(self):
+        """
+        Stop the consumer thread, if running.
+        To be called after the stream is closed
+        """
+        queue = self.chunk_queue
+        self.chunk_queue = None
+        if self.consumer_thread:
+            queue.wake()
+            self.consumer_thread.join()
+            self.consumer_thread = None
+
+    def _consume_chunks(self,queue):
+        """
+        Consumer thread: convert and process the queued chunks,
+        and report any dropped chunks
+        
+        Parameters
+        -----------
+        queue: ChunkQueue
+            Queue to take the chunks from. The thread stops once it is
+            no longer the recorder's queue and is empty
+        """
+        reported = 0
+        while self.chunk_queue is queue or len(queue):
+            in_data = queue.get(timeout = 0.1)
+            if in_data is not None:
+                self.process_chunk(self.audiodata_to_array(in_data))
+
+            dropped = self.dropped_chunks
+            if dropped > reported:
+                print('%i chunks dropped' % dropped)
+                reported = dropped
+                if self.rEmitter:
+                    self.rEmitter.chunksdropped.emit(dropped)
+
 #---------------- RECORDING METHODS -----------------------------------
     def open_recorder(self):
         """
@@ -218,6 +415,27 @@ class RecorderParent(object):
             
         self.next_rec_chunk = 0
         
+        if self.filename:
+            # Preallocate enough space for the pretrigger and
+            # partial posttrigger data as well
+            capacity = self.rec_samples + self.chunk_size + self.pretrig_samples
+            if self.stream_writer:
+                self.stream_writer.discard()
+            try:
+                if self.storage_dtype.kind in 'iu':
+                    calibration_factor = self.scale_factor
+                else:
+                    calibration_factor = 1.0
+                self.stream_writer = StreamWriter(self.filename,capacity,
+                                                  channels = self.channels,
+                                                  rate = self.rate,
+                                                  dtype = self.storage_dtype,
+                                                  calibration_factor = calibration_factor)
+            except Exception as e:
+                print(e)
+                print('Cannot open %s for streaming' % self.filename)
+                return False
+            
         self.initialised_record = True
         
         print('Recording function is ready! Use record_start() to start')
@@ -238,7 +456,7 @@ class RecorderParent(object):
             return False
         
         # Check if the previous recorded data is flushed
-        if self.recorded_data:
+        if self.recorded_data or (self.stream_writer and self.next_rec_chunk):
             print('Please flush your recorded data')
             return False
         
@@ -286,14 +504,19 @@ class RecorderParent(object):
         self.trigger = False
         self.recording = False
         self.recorded_data = []
+        if self.stream_writer:
+            self.stream_writer.discard()
+            self.stream_writer = None
            
     def record_data(self,data):
         """
         Append recorded chunk to recorder_data
         and stop doing so if neccessary amount of chunks is recorded
         """
-        #data = cp.copy(self.buffer[self.next_chunk-1])
-        self.recorded_data.append(data)
+        if self.stream_writer:
+            self.stream_writer.write(data)
+        else:
+            self.recorded_data.append(data)
         # Check to see whether recording is done
         self.next_rec_chunk += 1
         if self.next_rec_chunk == self.total_rec_chunk:
@@ -309,7 +532,17 @@ class RecorderParent(object):
         ----------
         flushed_data: numpy array
             2D numpy array (similar to get_buffer) 
+            If streaming to a file, a numpy memmap of the file
         """
+        if self.stream_writer:
+            # The pretrigger and posttrigger data are already at the
+            # start of the file
+            flushed_data = self.stream_writer.close(self.pretrig_data.shape[0] +
+                                                    self.actual_rec_samples)
+            self.stream_writer = None
+            print('Data flushed to %s' % self.filename)
+            return flushed_data
+        
         if self.recorded_data:
             data =  np.array(self.recorded_data);
             flushed_data = data.reshape((self.rec_samples,self.channels))
@@ -390,13 +623,13 @@ class RecorderParent(object):
             return False
         
         if not self.trigger:
+            self.pretrig_samples = pretrig
             if not self.record_init(samples = posttrig):
                 return False
             self.trigger = True
             self.trigger_threshold = threshold
             self.trigger_channel = channel
-            self.pretrig_samples = pretrig
-            self.ref_level = np.mean(self.buffer[self.next_chunk,:,self.trigger_channel])
+            self.ref_level = self.scale_data(np.mean(self.ring_buffer.latest(self.chunk_size)[:,self.trigger_channel]))
             print('Reference level: %.2f' % self.ref_level)
             print('Trigger Set!')
             return True
@@ -417,7 +650,7 @@ class RecorderParent(object):
         trig_data = data[:,self.trigger_channel]
         norm_data = abs(trig_data - np.mean(trig_data))#- self.ref_level
         
-        maximum = np.amax(norm_data)
+        maximum = self.scale_data(np.amax(norm_data))
         
         if maximum > self.trigger_threshold:
             print('Triggered!')
@@ -425,9 +658,15 @@ class RecorderParent(object):
             self.recording = True
             self.trigger = False
             try:
-                self.part_posttrig_data =  cp.copy(self.buffer[self.next_chunk-1, pos:,:])
-                temp = np.vstack((self.buffer[self.next_chunk-2,:,:],self.buffer[self.next_chunk-1,:pos,:]))
-                self.pretrig_data = temp[temp.shape[0]-self.pretrig_samples:,:]
+                # The chunk has already been written to the buffer, so the
+                # pretrigger data is found just before the trigger position
+                n_post = data.shape[0] - pos
+                temp = cp.copy(self.ring_buffer.latest(n_post + self.pretrig_samples))
+                self.part_posttrig_data = temp[temp.shape[0]-n_post:,:]
+                self.pretrig_data = temp[:temp.shape[0]-n_post,:]
+                if self.stream_writer:
+                    self.stream_writer.write(self.pretrig_data)
+                    self.stream_writer.write(self.part_posttrig_data)
             except Exception as e:
                 print(e)
                 print('Cannot get trigger data')
@@ -435,6 +674,24 @@ class RecorderParent(object):
                 self.rEmitter.triggered.emit()
             
 #----------------- DECORATOR METHODS --------------------------------------
+    @property
+    def queue_overruns(self):
+        """
+        int
+            Number of chunks dropped because the consumer thread fell behind
+        """
+        if self.chunk_queue:
+            return self.chunk_queue.overruns
+        return 0
+
+    @property
+    def dropped_chunks(self):
+        """
+        int
+            Total number of chunks lost, by either the driver or the queue
+        """
+        return self.input_overflows + self.queue_overruns
+
     @property
     def num_chunk(self):
         """
@@ -482,6 +739,19 @@ class RecorderParent(object):
             #print(e)
             self._chunk_size = n
 
-            
-                                  
- 
\ No newline at end of file
+    @property
+    def storage_dtype(self):
+        """
+        numpy dtype
+            Data type of the buffer and recordings.
+            Integer types keep the raw samples, which are scaled with 
+            scale_factor only when scale_data() is called.
+            Float types store the samples already scaled.
+            The setter method reallocates the buffer.
+        """
+        return self._storage_dtype
+
+    @storage_dtype.setter
+    def storage_dtype(self, dtype):
+        self._storage_dtype = np.dtype(dtype)
+        self.allocate_buffer()
@@ -0,0 +1,422 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains a Recorder class that runs another Recorder class
+(e.g. myRecorder or NIRecorder) in its own process, so that nothing done in
+this process, such as plotting, analysis or addons holding the GIL, can
+delay the driver callback and drop samples.
+
+The recorder process publishes the stream into a SharedRingBuffer, which
+this process reads directly, with the sample counter as the sequence number,
+so the live data never goes through a pipe. The other methods (stream and
+recording control, devices) are called in the recorder process through a
+pipe, and the signals of the recorder are forwarded back and emitted by the
+rEmitter of this process.
+
+Example:
+    | >>>import cued_datalogger.acquisition.myRecorder as mR
+    | >>>from cued_datalogger.acquisition import RecorderProcess
+    | >>>recorder = RecorderProcess.Recorder(mR, channels = 2)
+    | >>>recorder.stream_init()
+    | True
+    | >>>data, seq = recorder.get_buffer_since(0)
+    | >>>recorder.close()
+
+Attributes
+----------
+SYNCED_ATTRIBUTES: list
+    Attributes of the recorder in the recorder process that are copied to
+    this process after each call
+"""
+import traceback
+import importlib
+import multiprocessing
+import threading
+
+import numpy as np
+
+from cued_datalogger.acquisition.RecorderParent import RecorderParent
+from cued_datalogger.acquisition.RingBuffer import SharedRingBuffer
+from cued_datalogger.acquisition.StreamFile import read_stream_file
+from cued_datalogger.api.executor import SharedArray
+
+SYNCED_ATTRIBUTES = ['device_name','rate','scale_factor','max_value',
+                     'recording','trigger','initialised_record']
+
+#---------------- RECORDER PROCESS -----------------------------------
+class _ForwardedSignal(object):
+    """
+    Stands in for a signal of RecEmitter in the recorder process,
+    sending the emitted values through a pipe instead
+    """
+    def __init__(self,name,connection,lock):
+        self.name = name
+        self.connection = connection
+        self.lock = lock
+
+    def emit(self,*args):
+        with self.lock:
+            self.connection.send((self.name,args))
+
+class _ForwardingEmitter(object):
+    """
+    Stands in for RecEmitter in the recorder process
+    """
+    def __init__(self,connection):
+        lock = threading.Lock()
+        for name in ['recorddone','triggered','newdata','chunksdropped']:
+            setattr(self,name,_ForwardedSignal(name,connection,lock))
+
+def _recorder_state(recorder):
+    return {name: getattr(recorder,name) for name in SYNCED_ATTRIBUTES
+            if hasattr(recorder,name)}
+
+def _configure(recorder,settings,buffer_descriptor):
+    """
+    Apply the settings of the controlling process, and write the stream
+    into its shared ring buffer
+    """
+    for name in ['rate','channels','chunk_size','num_chunk']:
+        setattr(recorder,name,settings[name])
+    recorder.set_filename(settings['filename'])
+    old_buffer = recorder.ring_buffer
+    recorder.ring_buffer = SharedRingBuffer.attach(buffer_descriptor)
+    if isinstance(old_buffer,SharedRingBuffer):
+        old_buffer.close()
+
+def _flush_record_data(recorder):
+    """
+    Flush the recording and hand it to the controlling process: the
+    name of the stream file, or the samples in shared memory
+    """
+    data = recorder.flush_record_data()
+    if data is None:
+        return None
+    if isinstance(data,np.memmap):
+        return ('stream',data.filename)
+    shared = SharedArray.copy(data)
+    descriptor = shared.descriptor()
+    # The controlling process frees it once it has copied the samples
+    shared.close()
+    return ('shared',descriptor)
+
+_SERVED_FUNCTIONS = {'configure': _configure,
+                     'flush_record_data': _flush_record_data}
+
+def _serve(module_name,settings,commands,events):
+    """
+    Main function of the recorder process: create the recorder, then call
+    its methods as requested through *commands* until it is closed
+
+    Parameters
+    ----------
+    module_name: str
+        Module containing the Recorder class to run
+    settings: dict
+        Keyword arguments of the Recorder class
+    commands: multiprocessing Connection
+        Receives (method, args, kwargs) and sends back
+        ('ok', result, state) or ('error', exception, state)
+    events: multiprocessing Connection
+        Sends the (signal name, args) emitted by the recorder
+    """
+    try:
+        recorder = importlib.import_module(module_name).Recorder(**settings)
+        recorder.rEmitter = _ForwardingEmitter(events)
+    except Exception as e:
+        traceback.print_exc()
+        commands.send(('error',e,{}))
+        return
+    commands.send(('ok',None,_recorder_state(recorder)))
+
+    while True:
+        try:
+            method,args,kwargs = commands.recv()
+        except EOFError:
+            # The controlling process has gone
+            method,args,kwargs = 'close',(),{}
+        try:
+            if method in _SERVED_FUNCTIONS:
+                result = _SERVED_FUNCTIONS[method](recorder,*args,**kwargs)
+            else:
+                result = getattr(recorder,method)(*args,**kwargs)
+            reply = ('ok',result,_recorder_state(recorder))
+        except Exception as e:
+            traceback.print_exc()
+            reply = ('error',e,_recorder_state(recorder))
+        if method == 'close':
+            if isinstance(recorder.ring_buffer,SharedRingBuffer):
+                recorder.ring_buffer.close()
+        try:
+            commands.send(reply)
+        except (BrokenPipeError,OSError):
+            break
+        if method == 'close':
+            break
+
+#---------------- CONTROLLING PROCESS -----------------------------------
+class Recorder(RecorderParent):
+    """
+    Runs a Recorder class in its own process, and reads its stream through
+    shared memory
+
+    Attributes
+    ----------
+    recorder_module: str
+        Name of the module containing the Recorder class that is run
+    device_name: str
+        Name of the device used by the recorder process
+    max_value: float
+        Maximum value of recorded data
+    process: multiprocessing Process
+        The recorder process. None once closed
+    """
+
+#---------------- INITIALISATION METHODS -----------------------------------
+    def __init__(self,recorder_module,channels = 1,rate = 44100,
+                 chunk_size = 1024,num_chunk = 4,device_name = None,
+                 storage_dtype = np.float64,threaded = False):
+        """
+        Start the recorder process, and set up the shared buffer
+
+        Parameters
+        ----------
+        recorder_module: module or str
+            Module containing the Recorder class to run, e.g. myRecorder
+        Other parameters: see the Recorder class to run
+        """
+        if not isinstance(recorder_module,str):
+            recorder_module = recorder_module.__name__
+        self.recorder_module = recorder_module
+        self.device_name = device_name
+        self.max_value = 1
+        self.process = None
+        self._commands = None
+        self._lock = threading.Lock()
+        self.ring_buffer = None
+
+        super().__init__(channels = channels,rate = rate,
+             chunk_size = chunk_size,num_chunk = num_chunk,
+             storage_dtype = storage_dtype,threaded = threaded)
+
+        print('You are using a separate process for recording')
+        self.open_recorder()
+        self.process_start()
+
+    def process_start(self):
+        """
+        Start the recorder process, and the thread forwarding its signals
+        """
+        settings = {'channels': self.channels,
+                    'rate': self.rate,
+                    'chunk_size': self.chunk_size,
+                    'num_chunk': self.num_chunk,
+                    'device_name': self.device_name,
+                    'storage_dtype': self.storage_dtype,
+                    'threaded': self.threaded}
+        # Forking a process with running Qt threads is not safe
+        context = multiprocessing.get_context('spawn')
+        self._commands,remote_commands = context.Pipe()
+        events,remote_events = context.Pipe(duplex = False)
+        self.process = context.Process(target = _serve,
+                                       args = (self.recorder_module,settings,
+                                               remote_commands,remote_events),
+                                       daemon = True)
+        self.process.start()
+        remote_commands.close()
+        remote_events.close()
+
+        threading.Thread(target = self._forward_signals,args = (events,),
+                         daemon = True).start()
+        # Wait for the recorder to be created
+        self._reply()
+
+    def allocate_buffer(self):
+        """
+        Re-implemented from RecorderParent. Set up the circular buffer in
+        shared memory. The recorder process writes to it from the next
+        stream_init()
+        """
+        old_buffer = self.ring_buffer
+        self.ring_buffer = SharedRingBuffer(self.num_chunk * self.chunk_size,
+                                            channels = self.channels,
+                                            dtype = self.storage_dtype)
+        if old_buffer is not None:
+            old_buffer.close()
+
+#---------------- DESTRUCTOR METHODS -----------------------------------
+    def close(self):
+        """
+         Re-implemented from RecorderParent. Stop the recorder process
+         and free the shared buffer too.
+        """
+        if self.process is not None:
+            self._call('close')
+            self.process.join(timeout = 5)
+            self._commands.close()
+            self.process = None
+        if self.ring_buffer is not None:
+            self.ring_buffer.close()
+            self.ring_buffer = None
+
+#---------------- RECORDER PROCESS METHODS -----------------------------------
+    def _call(self,method,*args,**kwargs):
+        """
+        Call a method of the recorder in the recorder process
+
+        Returns
+        ----------
+        The value returned by the method, or None if the recorder process
+        is not running. Exceptions raised by the method are raised again
+        """
+        if self.process is None:
+            print('The recorder process is not running')
+            return None
+        with self._lock:
+            try:
+                self._commands.send((method,args,kwargs))
+            except (BrokenPipeError,OSError):
+                print('The recorder process has stopped')
+                return None
+            return self._reply()
+
+    def _reply(self):
+        try:
+            status,result,state = self._commands.recv()
+        except (EOFError,OSError):
+            print('The recorder process has stopped')
+            return None
+        for name,value in state.items():
+            setattr(self,name,value)
+        if status == 'error':
+            raise result
+        return result
+
+    def _forward_signals(self,events):
+        """
+        Thread emitting the signals forwarded from the recorder process
+        """
+        while True:
+            try:
+                name,args = events.recv()
+            except (EOFError,OSError):
+                break
+            if name == 'recorddone':
+                self.recording = False
+            elif name == 'triggered':
+                self.recording = True
+                self.trigger = False
+            elif name == 'chunksdropped':
+                # The total number of chunks dropped in the recorder process
+                self.input_overflows = args[0]
+            if self.rEmitter:
+                getattr(self.rEmitter,name).emit(*args)
+        events.close()
+
+#---------------- DEVICE SETTINGS METHODS -----------------------------------
+    def set_filename(self,filename):
+        """
+        Re-implemented from RecorderParent
+        """
+        super().set_filename(filename)
+        self._call('set_filename',filename)
+
+    def set_device_by_name(self,name):
+        """
+        Re-implemented from RecorderParent
+        """
+        self._call('set_device_by_name',name)
+
+    def available_devices(self):
+        """
+        Re-implemented from RecorderParent
+        """
+        devices = self._call('available_devices')
+        if devices is None:
+            return ([],[])
+        return devices
+
+    def current_device_info(self):
+        """
+        Re-implemented from RecorderParent
+        """
+        self._call('current_device_info')
+
+#---------------- RECORDING METHODS -----------------------------------
+    def record_init(self,samples = None,duration = 3):
+        """
+        Re-implemented from RecorderParent
+        """
+        return self._call('record_init',samples = samples,duration = duration)
+
+    def record_start(self):
+        """
+        Re-implemented from RecorderParent
+        """
+        return self._call('record_start')
+
+    def record_cancel(self):
+        """
+        Re-implemented from RecorderParent
+        """
+        self._call('record_cancel')
+
+    def flush_record_data(self):
+        """
+        Re-implemented from RecorderParent. The samples are copied out of
+        shared memory, or memory-mapped if they were streamed to a file
+        """
+        flushed = self._call('flush_record_data')
+        if flushed is None:
+            return None
+        kind,location = flushed
+        if kind == 'stream':
+            return read_stream_file(location)[0]
+        shared = SharedArray.attach(location)
+        data = np.array(shared.array)
+        shared.unlink()
+        return data
+
+    def trigger_start(self,duration = 3, threshold = 0.09, channel = 0,
+                      pretrig = 200,posttrig = 5000):
+        """
+        Re-implemented from RecorderParent
+        """
+        return self._call('trigger_start',duration = duration,
+                          threshold = threshold,channel = channel,
+                          pretrig = pretrig,posttrig = posttrig)
+
+#---------------- STREAMING METHODS -----------------------------------
+    def stream_init(self, playback = False):
+        """
+        Re-implemented from RecorderParent. Send the current settings and
+        the shared buffer to the recorder process first
+        """
+        if (self.ring_buffer.capacity != self.num_chunk * self.chunk_size or
+                self.ring_buffer.channels != self.channels):
+            self.allocate_buffer()
+        settings = {'rate': self.rate,
+                    'channels': self.channels,
+                    'chunk_size': self.chunk_size,
+                    'num_chunk': self.num_chunk,
+                    'filename': self.filename}
+        self._call('configure',settings,self.ring_buffer.descriptor())
+        return bool(self._call('stream_init',playback = playback))
+
+    def stream_start(self):
+        """
+        Re-implemented from RecorderParent.
+        """
+        self._call('stream_start')
+
+    def stream_stop(self):
+        """
+        Re-implemented from RecorderParent.
+        """
+        self._call('stream_stop')
+
+    def stream_close(self):
+        """
+        Re-implemented from RecorderParent.
+        """
+        if self.process is not None:
+            self._call('stream_close')
@@ -18,7 +18,7 @@ TRACE_DURATION: float
 from PyQt5.QtGui import QColor
 from PyQt5.QtCore import Qt, pyqtSignal
 
-from cued_datalogger.api.pyqtgraph_extensions import CustomPlotWidget
+from cued_datalogger.api.pyqtgraph_extensions import CustomPlotWidget, DecimatedPlotDataItem
 
 import pyqtgraph as pg
 import numpy as np
@@ -48,9 +48,13 @@ class LiveGraph(pg.PlotWidget):
         Contains the current colour of each plot
     plot_visible: list of bool
         Contains the visibility of each plot
+    decimate: bool
+        Whether the lines only draw the min/max envelope of their data
+        See DecimatedPlotDataItem
     """
     #plotLineClicked = pyqtSignal()
     plotColourChanged = pyqtSignal(object)
+    decimate = False
     def __init__(self,*args,**kwargs):
         """
         Reimplemented PlotWidget
@@ -78,7 +82,11 @@ class LiveGraph(pg.PlotWidget):
         PlotDataItem
             The plot line, effectively
         """
-        line = self.plotItem.plot(*arg, **kwargs)
+        if self.decimate:
+            line = DecimatedPlotDataItem(*arg, **kwargs)
+            self.plotItem.addItem(line)
+        else:
+            line = self.plotItem.plot(*arg, **kwargs)
         line.curve.setClickable(True,width = 4)
         self.plotlines.append(line)
         return line
@@ -233,6 +241,7 @@ class TimeLiveGraph(LiveGraph):
     sig_hold: list of bool
         Contains whether the signal is being held
     """
+    decimate = True
     def __init__(self, *args,**kwargs):
         """
         Reimplemented from LiveGraph.
@@ -376,6 +385,37 @@ class LevelsLiveGraph(LiveGraph):
 
         self.peak_plots[num].setPen(self.level_colourmap.map(self.peak_trace[num]))
 
+    def set_channel_peaks(self,maximums):
+        """
+        Set the value of the peak plots of all channels at once.
+        Only the peak plots which change are redrawn
+
+        Parameters
+        ----------
+        maximums: Numpy Array
+            Instantaneous maximum value of each channel
+        """
+        maximums = np.asarray(maximums)
+        old_trace = self.peak_trace.copy()
+
+        # Decay the peaks which have been held long enough
+        decaying = self.trace_counter>self.trace_countlimit
+        self.peak_trace[decaying] = np.maximum(self.peak_trace[decaying]*
+                                               np.exp(-self.peak_decays[decaying]),0)
+        self.peak_decays[decaying] += TRACE_DECAY
+        self.trace_counter += 1
+
+        # Hold any new peaks
+        new_peaks = self.peak_trace<maximums
+        self.peak_trace[new_peaks] = maximums[new_peaks]
+        self.peak_decays[new_peaks] = 0
+        self.trace_counter[new_peaks] = 0
+
+        for num in np.flatnonzero(self.peak_trace != old_trace):
+            self.peak_plots[num].setData(x = [self.peak_trace[num],self.peak_trace[num]],
+                           y = [(num-0.3), (num+0.3)])
+            self.peak_plots[num].setPen(self.level_colourmap.map(self.peak_trace[num]))
+
     def set_channel_levels(self,value,maximum):
         """
         Set the value of the levels plots
@@ -21,7 +21,7 @@ from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QPushButton,
                              QStatusBar, QLabel, QLineEdit, QFormLayout,
                              QGroupBox, QRadioButton, QComboBox, QScrollArea,
                              QGridLayout, QCheckBox, QButtonGroup,
-                             QStackedWidget)
+                             QStackedWidget, QFileDialog)
 from PyQt5.QtGui import QValidator,QIntValidator,QDoubleValidator,QPainter
 from PyQt5.QtCore import Qt, pyqtSignal
 from PyQt5.Qt import QStyleOption,QStyle
@@ -31,6 +31,7 @@ import pyqtgraph as pg
 import functools as fct
 
 import cued_datalogger.acquisition.myRecorder as mR
+import cued_datalogger.acquisition.ReplayRecorder as RR
 try:
     import cued_datalogger.acquisition.NIRecorder as NIR
     NI_drivers = True
@@ -475,7 +476,7 @@ class DevConfigUI(BaseWidget):
         Emits the configuration of the recorder is set
     typebtngroup: QButtonGroup
         Contains the buttons to select source of audio stream
-        Either SoundCard or NI
+        SoundCard, NI or Replay
     config_button: QPushButton
         Confirm the settings and set up the new recorder
     rec: Recorder object
@@ -502,8 +503,10 @@ class DevConfigUI(BaseWidget):
         typelbox = QHBoxLayout(self.typegroup)
         pyaudio_button = QRadioButton('SoundCard',self.typegroup)
         NI_button = QRadioButton('NI',self.typegroup)
+        replay_button = QRadioButton('Replay',self.typegroup)
         typelbox.addWidget(pyaudio_button)
         typelbox.addWidget(NI_button)
+        typelbox.addWidget(replay_button)
         pyaudio_button.setChecked(True)
         # Set that to the layout of the group
         self.typegroup.setLayout(typelbox)
@@ -512,6 +515,7 @@ class DevConfigUI(BaseWidget):
         self.typebtngroup = QButtonGroup(self)
         self.typebtngroup.addButton(pyaudio_button)
         self.typebtngroup.addButton(NI_button)
+        self.typebtngroup.addButton(replay_button)
 
         config_form.addRow(self.typegroup)
 
@@ -563,6 +567,8 @@ class DevConfigUI(BaseWidget):
                 rb[0].setChecked(True)
             elif type(self.rec) == NIR.Recorder:
                 rb[1].setChecked(True)
+            elif type(self.rec) == RR.Recorder:
+                rb[2].setChecked(True)
                 
             info = [self.rec.rate,self.rec.channels,
                 self.rec.chunk_size,self.rec.num_chunk]
@@ -574,7 +580,7 @@ class DevConfigUI(BaseWidget):
     def display_sources(self):
         """
         Display the available sources from the type of recorder
-        Either SoundCard(myRecorder) or NI(NIRecorder)
+        SoundCard(myRecorder), NI(NIRecorder) or Replay(ReplayRecorder)
         """
         # Check which type of recorder is selected
         rb = self.typegroup.findChildren(QRadioButton)
@@ -582,6 +588,8 @@ class DevConfigUI(BaseWidget):
             selR = mR.Recorder()
         elif rb[1].isChecked():
             selR = NIR.Recorder()
+        elif rb[2].isChecked():
+            selR = RR.Recorder()
         else:
             return
 
@@ -610,7 +618,7 @@ class DevConfigUI(BaseWidget):
     def read_device_config(self):
         """
         Display the available sources from the type of recorder
-        Either SoundCard(myRecorder) or NI(NIRecorder)
+        SoundCard(myRecorder), NI(NIRecorder) or Replay(ReplayRecorder)
 
         Returns
         ----------
@@ -637,6 +645,8 @@ class DevConfigUI(BaseWidget):
             recType = mR
         elif recType[1]:
             recType = NIR
+        elif recType[2]:
+            recType = RR
         return(recType, configs)
 
 #-----------------------------STATUS WIDGET-------------------------------
@@ -687,6 +697,17 @@ class StatusUI(BaseWidget):
         """
         self.statusbar.showMessage('Triggered! Recording...')
 
+    def dropped_message(self,num_dropped):
+        """
+        Display a message when chunks of the stream are dropped
+
+        Parameters
+        ----------
+        num_dropped: int
+            Total number of chunks dropped
+        """
+        self.statusbar.showMessage('%i chunks dropped!' % num_dropped, 3000)
+
 #-----------------------------RECORDING WIDGET-------------------------------
 class RecUI(BaseWidget):
     """
@@ -698,7 +719,7 @@ class RecUI(BaseWidget):
             * Triggering
         * Additional widgets for specific recording mode:
             * Normal: None
-            * Average transfer function: Buttons to undo or clear past autospectrum and crossspectrum
+            * Average transfer function: Buttons to undo, clear, save or load past autospectrum and crossspectrum
 
     Attributes
     ----------
@@ -710,6 +731,12 @@ class RecUI(BaseWidget):
         Emits when undo last transfer function button is pressed
     clearTfAvg: pyqtsignal
         Emits when clear past transfer functions button is pressed
+    saveTfAvg: pyqtsignal
+        Emits the file to save the past transfer functions to
+    loadTfAvg: pyqtsignal
+        Emits the file to load the past transfer functions from
+    forgettingFactorChanged: pyqtsignal
+        Emits the forgetting factor of the transfer function average
     switch_rec_box: QComboBox
         Switch recording options
     rec_boxes: List of Widgets
@@ -719,12 +746,23 @@ class RecUI(BaseWidget):
         Contains the additional settings
     input_chan_box: QComboBox
         Additional settings to put input channel for average transfer function calculation
+    segment_length_box: QComboBox
+        Additional settings to average the spectra over segments of each recording
+        for average transfer function calculation
+    forgetting_box: QLineEdit
+        Additional settings for the forgetting factor of the average
+        transfer function, 1 for a linear average
+    stream_file_box: QLineEdit
+        File to stream the recording to. Empty to record into memory
     """
     startRecording = pyqtSignal()
     cancelRecording = pyqtSignal()
 
     undoLastTfAvg = pyqtSignal()
     clearTfAvg = pyqtSignal()
+    saveTfAvg = pyqtSignal(str)
+    loadTfAvg = pyqtSignal(str)
+    forgettingFactorChanged = pyqtSignal(float)
 
     def initUI(self):
         """
@@ -773,6 +811,17 @@ class RecUI(BaseWidget):
         self.rec_boxes[2].editingFinished.connect(lambda: set_input_limits(self.rec_boxes[2],-1,self.rec.chunk_size,int))
         self.rec_boxes[2].textEdited.connect(self.toggle_trigger)
 
+        # Add the file streaming setting
+        stream_file_layout = QHBoxLayout()
+        self.stream_file_box = QLineEdit(self)
+        self.stream_file_box.setPlaceholderText('Record into memory')
+        stream_file_layout.addWidget(self.stream_file_box)
+        stream_file_btn = QPushButton('...',self)
+        stream_file_btn.setMaximumWidth(30)
+        stream_file_btn.clicked.connect(self.select_stream_file)
+        stream_file_layout.addWidget(stream_file_btn)
+        global_settings_layout.addRow(QLabel('Stream to',self),stream_file_layout)
+
         self.normal_rec = QWidget(self)
         normal_rec_layout = QVBoxLayout(self.normal_rec)
         normal_rec_layout.addWidget(QLabel('No Additional Options',self))
@@ -784,6 +833,14 @@ class RecUI(BaseWidget):
         tfavg_settings = QFormLayout(self.tfavg_rec)
         self.input_chan_box = QComboBox(self)
         tfavg_settings.addRow(QLabel('Input',self),self.input_chan_box)
+        self.segment_length_box = QComboBox(self)
+        self.segment_length_box.addItems(['Whole record'] + [str(2**n) for n in range(8,17)])
+        tfavg_settings.addRow(QLabel('Segment',self),self.segment_length_box)
+        self.forgetting_box = QLineEdit(self)
+        self.forgetting_box.setText('1.0')
+        self.forgetting_box.setValidator(QDoubleValidator(0.01,1,3))
+        self.forgetting_box.editingFinished.connect(self.forgetting_factor_changed)
+        tfavg_settings.addRow(QLabel('Forgetting',self),self.forgetting_box)
         avg_layout = QHBoxLayout()
         #self.avg_input_box = QLineEdit(self)
         self.avg_count_box = QLabel('Count: 0',self)
@@ -800,6 +857,14 @@ class RecUI(BaseWidget):
         self.clear_log_btn.clicked.connect(self.clearTfAvg.emit)
         tflog_btn_layout.addWidget(self.clear_log_btn)
         tfavg_rec_layout.addLayout(tflog_btn_layout)
+        tfsave_btn_layout = QHBoxLayout()
+        self.save_log_btn = QPushButton('Save',self)
+        self.save_log_btn.clicked.connect(self.select_tfavg_save_file)
+        tfsave_btn_layout.addWidget(self.save_log_btn)
+        self.load_log_btn = QPushButton('Load',self)
+        self.load_log_btn.clicked.connect(self.select_tfavg_load_file)
+        tfsave_btn_layout.addWidget(self.load_log_btn)
+        tfavg_rec_layout.addLayout(tfsave_btn_layout)
 
         self.spec_settings_widget.addWidget(self.tfavg_rec)
 
@@ -860,6 +925,84 @@ class RecUI(BaseWidget):
         """
         return self.input_chan_box.currentIndex()
 
+    def get_segment_length(self):
+        """
+        Returns
+        ----------
+        int
+            Number of samples in each averaged segment, or None to use
+            the whole recording
+        """
+        if self.segment_length_box.currentIndex() == 0:
+            return None
+        else:
+            return int(self.segment_length_box.currentText())
+
+    def get_forgetting_factor(self):
+        """
+        Returns
+        ----------
+        float
+            Forgetting factor of the average transfer function,
+            1 for a linear average
+        """
+        try:
+            return min(max(float(self.forgetting_box.text()),0.01),1.0)
+        except ValueError:
+            return 1.0
+
+    def set_forgetting_factor(self,factor):
+        """
+        Display the forgetting factor of the average transfer function
+        """
+        self.forgetting_box.setText(str(factor))
+
+    def forgetting_factor_changed(self):
+        """
+        Emit the new forgetting factor of the average transfer function
+        """
+        self.forgettingFactorChanged.emit(self.get_forgetting_factor())
+
+    def get_stream_filename(self):
+        """
+        Returns
+        ----------
+        str
+            File to stream the recording to, or None to record into memory
+        """
+        filename = self.stream_file_box.text().strip()
+        if filename:
+            return filename
+        else:
+            return None
+
+    def select_stream_file(self):
+        """
+        Choose the file to stream the recording to
+        """
+        url = QFileDialog.getSaveFileName(self, "Stream recording to", "",
+                                          "Stream Files (*.dat)")[0]
+        if url:
+            self.stream_file_box.setText(url)
+
+    def select_tfavg_save_file(self):
+        """
+        Choose the file to save the past transfer functions to
+        """
+        url = QFileDialog.getSaveFileName(self, "Save averages", "",
+                                          "Numpy Files (*.npz)")[0]
+        if url:
+            self.saveTfAvg.emit(url)
+
+    def select_tfavg_load_file(self):
+        """
+        Choose the file to load the past transfer functions from
+        """
+        url = QFileDialog.getOpenFileName(self, "Load averages", "",
+                                          "Numpy Files (*.npz)")[0]
+        if url:
+            self.loadTfAvg.emit(url)
+
     def get_record_config(self, *arg):
         """
         Returns
@@ -0,0 +1,538 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains a Recorder class that needs no hardware: it streams
+deterministic synthetic signals, or replays the samples of a file, through
+the same callback as the soundcard recorder. It is meant for testing the
+acquisition without a device, and for load testing.
+
+The stream can be paced in real time, at a multiple of real time, or as
+fast as the recorder can process the chunks. In real time, chunks that
+cannot be delivered on time are dropped and counted as input overflows, as
+a driver would, so the largest number of channels and sampling rate that
+can be sustained is the largest one streaming without dropped chunks
+(see measure_throughput).
+
+Replayed files are looped. They can be:
+    * a DataLogger .mat file. The time series ('indata') is replayed if
+      there is one, otherwise a time series is made from the spectra
+      ('yspec') with an inverse FFT, e.g. tests/transfer_function_grid.mat
+    * a stream file written by a recorder (see StreamFile)
+    * a .npy file of (samples x channels)
+If the recorder has more channels than the file, the channels of the file
+are repeated. Files with a known sampling rate are streamed at that rate,
+whatever the rate of the recorder was set to.
+
+Example:
+    | >>>from cued_datalogger.acquisition import ReplayRecorder
+    | >>>recorder = ReplayRecorder.Recorder(channels = 128, rate = 48000,
+    | ...                                   speed = 0)
+    | >>>recorder.stream_init()
+    | True
+    | >>>recorder.throughput()
+    | 1521304.4
+    | >>>recorder.close()
+
+Attributes
+----------
+SYNTHETIC: str
+    Name of the device streaming synthetic signals
+REPLAY_FILES: list
+    Files listed as devices by available_devices, in addition to SYNTHETIC
+SYNTHETIC_PERIOD: float
+    Approximate duration (s) after which the synthetic signals repeat
+INPUT_OVERFLOW: int
+    Status flag passed to the callback when chunks were dropped, same value
+    as in PortAudio
+CONTINUE: int
+    Returned by the callback to keep streaming, same value as in PortAudio
+"""
+import os
+import sys,traceback
+import threading
+import time
+
+import numpy as np
+import scipy.io as sio
+
+from cued_datalogger.acquisition.RecorderParent import RecorderParent
+from cued_datalogger.acquisition.StreamFile import read_stream_file
+
+SYNTHETIC = 'Synthetic'
+REPLAY_FILES = []
+SYNTHETIC_PERIOD = 1
+INPUT_OVERFLOW = 2
+CONTINUE = 0
+
+#---------------- SOURCE FUNCTIONS -----------------------------------
+def to_raw_samples(data,normalise = False):
+    """
+    Convert samples to the raw int16 samples given by a driver
+
+    Parameters
+    ----------
+    data: Numpy Array
+        Samples with dimension of (samples x channels). Integer samples are
+        taken as raw samples, floating point samples as physical values
+        with the scale factor of the recorders (1/2**15)
+    normalise: bool
+        Whether to scale floating point samples to half of the full range.
+        They are always scaled down if they would not fit
+
+    Returns
+    ----------
+    raw samples: Numpy Array
+        int16 samples with dimension of (samples x channels)
+    """
+    data = np.asarray(data)
+    if data.ndim == 1:
+        data = data.reshape((-1,1))
+    if data.dtype.kind in 'iu':
+        return np.clip(data,-2**15,2**15-1).astype(np.int16)
+
+    data = np.nan_to_num(np.real(data))
+    peak = np.max(np.abs(data)) if data.size else 0
+    if peak and (normalise or peak > 1):
+        data = data * (0.5 / peak if normalise else 1 / peak)
+    return np.clip(np.round(data * 2**15),-2**15,2**15-1).astype(np.int16)
+
+def read_replay_file(filename):
+    """
+    Read the samples to replay from a file
+
+    Parameters
+    ----------
+    filename: str
+        Path to a DataLogger .mat file, a .npy file or a stream file
+
+    Returns
+    ----------
+    raw samples: Numpy Array
+        int16 samples with dimension of (samples x channels)
+    rate: int or None
+        Sampling rate of the file, if known
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.mat':
+        contents = sio.loadmat(filename)
+        rate = int(contents['freq'][0][0]) if 'freq' in contents else None
+        if 'indata' in contents:
+            return to_raw_samples(contents['indata']),rate
+        if 'yspec' in contents:
+            # Each column is the spectrum of a channel
+            return to_raw_samples(np.fft.irfft(contents['yspec'],axis = 0),
+                                  normalise = True),rate
+        raise ValueError('{} contains no time series or spectrum'.format(filename))
+    elif extension == '.npy':
+        return to_raw_samples(np.load(filename,mmap_mode = 'r')),None
+    else:
+        data,header = read_stream_file(filename)
+        return to_raw_samples(data),int(header['rate'])
+
+def synthetic_samples(num_samples,channels,rate,seed = 0):
+    """
+    Generate deterministic test signals: for each channel, a sine with a
+    frequency chosen at random, plus some white noise.
+    The frequencies are whole numbers of cycles over num_samples, so the
+    signals can be looped without discontinuity
+
+    Parameters
+    ----------
+    num_samples: int
+        Number of samples of each channel
+    channels: int
+        Number of channels
+    rate: int
+        Sampling rate
+    seed: int
+        Seed of the random frequencies, phases and noise
+
+    Returns
+    ----------
+    raw samples: Numpy Array
+        int16 samples with dimension of (samples x channels)
+    """
+    rng = np.random.default_rng(seed)
+    cycles = rng.integers(1,max(num_samples // 4,2),size = channels)
+    phases = rng.uniform(0,2*np.pi,size = channels)
+    samples = np.empty((num_samples,channels),dtype = np.int16)
+    t = np.arange(num_samples) / num_samples
+    # One channel at a time, to keep the floating point copies small
+    for i in range(channels):
+        signal = 0.5 * np.sin(2*np.pi*cycles[i]*t + phases[i])
+        signal += rng.normal(scale = 0.02,size = num_samples)
+        samples[:,i] = np.round(signal * 2**15)
+    return samples
+
+class Recorder(RecorderParent):
+    """
+    Streams synthetic signals or replays a file, without any hardware
+
+    Attributes
+    ----------
+    device_name: str
+        SYNTHETIC, or the path of the replayed file
+    max_value: float
+        Maximum value of recorded data
+    speed: float
+        Pace of the stream, as a multiple of real time.
+        0 streams as fast as the chunks are processed
+    seed: int
+        Seed of the synthetic signals
+    file_data: Numpy Array
+        Raw samples of the replayed file, None for synthetic signals
+    file_rate: int
+        Sampling rate of the replayed file, if known. The stream adopts it
+    frames_delivered: int
+        Number of samples per channel delivered since the stream started
+    """
+
+#---------------- INITIALISATION METHODS -----------------------------------
+    def __init__(self,channels = 1,rate = 44100, chunk_size = 1024,
+                 num_chunk = 4,device_name = None,storage_dtype = np.float64,
+                 threaded = False,speed = 1,seed = 0):
+        """
+         Re-implemented from RecorderParent
+
+        Parameters
+        ----------
+        device_name: str
+            SYNTHETIC (default), or the path of a file to replay
+        speed: float
+            Pace of the stream, as a multiple of real time.
+            0 streams as fast as the chunks are processed
+        seed: int
+            Seed of the synthetic signals
+        """
+        super().__init__(channels = channels,rate = rate,
+             chunk_size = chunk_size,num_chunk = num_chunk,
+             storage_dtype = storage_dtype,threaded = threaded)
+
+        print('You are using replayed data for recording')
+        self.speed = speed
+        self.seed = seed
+        self.device_name = None
+        self.file_data = None
+        self.file_rate = None
+        self.frames_delivered = 0
+        self._source = None
+        self._running = threading.Event()
+        self._closing = False
+        self._active_time = 0
+        self._resumed_at = None
+
+        self.open_recorder()
+        if device_name is None:
+            device_name = SYNTHETIC
+        self.set_device_by_name(str(device_name))
+
+        self.trigger_init()
+
+        self.max_value = 1;
+
+#---------------- DEVICE SETTING METHODS -----------------------------------
+    def set_device_by_name(self, name):
+        """
+        Set the file to replay, or SYNTHETIC.
+        Revert to SYNTHETIC if the file cannot be read
+
+        Parameters
+        ----------
+        name: str
+            SYNTHETIC, or the path of the file
+        """
+        self.file_data = None
+        self.file_rate = None
+        if name and not name == SYNTHETIC and os.path.isfile(name):
+            try:
+                self.file_data,self.file_rate = read_replay_file(name)
+                self.device_name = name
+                print("Selected device: %s" % self.device_name)
+                return
+            except:
+                t,v,tb = sys.exc_info()
+                print(t)
+                print(v)
+                print(traceback.format_tb(tb))
+                self.file_data = None
+                self.file_rate = None
+        if not name == SYNTHETIC:
+            print('Device not found, reverting to default')
+        self.device_name = SYNTHETIC
+        print("Selected device: %s" % self.device_name)
+
+    def available_devices(self):
+        """
+        List SYNTHETIC, the files of REPLAY_FILES and the replayed file
+
+        Returns
+        ----------
+        names: List
+            Name of the devices
+        index: List
+            Index of the devices
+        """
+        names = [SYNTHETIC] + [name for name in REPLAY_FILES
+                               if os.path.isfile(name)]
+        if not self.device_name in names and not self.device_name is None:
+            names.append(self.device_name)
+        return(names,list(range(len(names))))
+
+    def current_device_info(self):
+        """
+        Display the current selected device info
+        """
+        if self.file_data is None:
+            print('%s: %i channels, seed %i' % (SYNTHETIC,self.channels,self.seed))
+        else:
+            print('%s: %i samples, %i channels, rate %s' % (self.device_name,
+                  self.file_data.shape[0],self.file_data.shape[1],self.file_rate))
+
+    def adopt_file_rate(self):
+        """
+        Set the rate to the sampling rate of the replayed file, if it is
+        known, so that the file is not streamed at the wrong pitch and pace
+        """
+        if self.file_data is None or not self.file_rate:
+            return
+        if not self.file_rate == self.rate:
+            print('Streaming %s at its sampling rate of %i Hz instead of %i Hz'
+                  % (self.device_name,self.file_rate,self.rate))
+            self.rate = self.file_rate
+
+    def _prepare_source(self):
+        """
+        Lay out one period of the stream as contiguous raw chunks, so that
+        delivering a chunk does not copy anything.
+        The period is a whole number of chunks, looping the file or the
+        synthetic signals over it
+
+        Returns
+        ----------
+        source: Numpy Array
+            int16 samples with dimension of (chunks x chunk_size x channels)
+        """
+        if self.file_data is None:
+            num_samples = max(int(round(SYNTHETIC_PERIOD * self.rate / self.chunk_size)),1) * self.chunk_size
+            source = synthetic_samples(num_samples,self.channels,self.rate,
+                                       seed = self.seed)
+        else:
+            file_samples,file_channels = self.file_data.shape
+            num_chunks = max(-(-file_samples // self.chunk_size),1)
+            rows = np.arange(num_chunks * self.chunk_size) % max(file_samples,1)
+            columns = np.arange(self.channels) % file_channels
+            if file_samples:
+                source = self.file_data[np.ix_(rows,columns)]
+            else:
+                source = np.zeros((rows.shape[0],self.channels),dtype = np.int16)
+        return np.ascontiguousarray(source).reshape((-1,self.chunk_size,self.channels))
+
+#---------------- DATA METHODS -----------------------------------
+    # Convert data obtained into a proper array
+    def audiodata_to_array(self,data):
+        """
+        Re-implemented from RecorderParent
+        """
+        return super().audiodata_to_array(np.frombuffer(data, dtype = np.int16))
+
+    def stream_time(self):
+        """
+        Time (s) spent streaming, excluding the pauses
+
+        Returns
+        ----------
+        float
+        """
+        if self._resumed_at is None:
+            return self._active_time
+        return self._active_time + time.perf_counter() - self._resumed_at
+
+    def throughput(self):
+        """
+        Number of samples per channel delivered per second of streaming.
+        The stream is sustained if it is at least the rate (times the speed),
+        without dropped chunks
+
+        Returns
+        ----------
+        float
+        """
+        elapsed = self.stream_time()
+        if not elapsed:
+            return 0.0
+        return self.frames_delivered / elapsed
+
+#---------------- STREAMING METHODS -----------------------------------
+    def stream_audio_callback(self,in_data, frame_count, time_info, status):
+        """
+        Callback function for audio streaming, with the same format as the
+        soundcard recorder.
+        Counts any input overflow, then hands the data to receive_chunk().
+        """
+        if status & INPUT_OVERFLOW:
+            self.input_overflows += 1
+        self.receive_chunk(in_data)
+
+        return(in_data,CONTINUE)
+
+    def _stream_chunks(self,source):
+        """
+        Streaming thread: deliver the chunks of source in a loop to the
+        callback, at the pace given by speed
+
+        Parameters
+        ----------
+        source: Numpy Array
+            See _prepare_source
+        """
+        num_chunks = source.shape[0]
+        position = 0
+        status = 0
+        next_time = None
+        while True:
+            if not self._running.is_set():
+                self._running.wait()
+                next_time = None
+            if self._closing:
+                break
+
+            if self.speed:
+                chunk_period = self.chunk_size / (self.rate * self.speed)
+                now = time.perf_counter()
+                if next_time is None:
+                    next_time = now
+                next_time += chunk_period
+                delay = next_time - now
+                if delay > 0:
+                    time.sleep(delay)
+                elif delay < -chunk_period:
+                    # Too late: drop the chunks that are due, as a driver would
+                    missed = int(-delay / chunk_period)
+                    position += missed
+                    next_time += missed * chunk_period
+                    status = INPUT_OVERFLOW
+            elif self.chunk_queue:
+                # Do not outrun the consumer thread
+                while (len(self.chunk_queue) >= self.chunk_queue.num_slots
+                       and not self._closing):
+                    time.sleep(0)
+
+            chunk = source[position % num_chunks]
+            self.stream_audio_callback(chunk,self.chunk_size,
+                {'input_buffer_adc_time': self.frames_delivered / self.rate},
+                status)
+            self.frames_delivered += self.chunk_size
+            position += 1
+            status = 0
+
+    def stream_init(self, playback = False):
+        """
+        Re-implemented from RecorderParent.
+        Playback is not supported
+        """
+        if self.audio_stream == None:
+            try:
+                self.adopt_file_rate()
+                source = self._prepare_source()
+                self.consumer_start()
+                self.frames_delivered = 0
+                self._active_time = 0
+                self._resumed_at = None
+                self._closing = False
+                self._running.clear()
+                self.audio_stream = threading.Thread(target = self._stream_chunks,
+                                                     args = (source,),
+                                                     daemon = True)
+                self.audio_stream.start()
+                self.stream_start()
+                return True
+
+            except:
+                t,v,tb = sys.exc_info()
+                print(t)
+                print(v)
+                print(traceback.format_tb(tb))
+                self.audio_stream = None
+                self.consumer_stop()
+                return False
+        else:
+            return False
+
+    # Start the streaming
+    def stream_start(self):
+        """
+        Re-implemented from RecorderParent.
+        """
+        if self.audio_stream:
+            if not self._running.is_set():
+                self._resumed_at = time.perf_counter()
+                self._running.set()
+            else:
+                print('stream already started')
+        else:
+            print('No audio stream is set up')
+
+    # Stop the streaming
+    def stream_stop(self):
+        """
+        Re-implemented from RecorderParent.
+        """
+        if self.audio_stream:
+            if self._running.is_set():
+                self._running.clear()
+                self._active_time = self.stream_time()
+                self._resumed_at = None
+            else:
+                print('stream already stopped')
+        else:
+            print('No audio stream is set up')
+
+    # Close the stream, probably needed if any parameter of the stream is changed
+    def stream_close(self):
+        """
+        Re-implemented from RecorderParent.
+        """
+        if self.audio_stream:
+            if self._running.is_set():
+                self.stream_stop()
+            self._closing = True
+            self._running.set()
+            self.audio_stream.join()
+            self._running.clear()
+            self.audio_stream = None
+            self.consumer_stop()
+
+#---------------- BENCHMARK FUNCTIONS -----------------------------------
+def measure_throughput(channels,rate = 44100,chunk_size = 1024,duration = 2,
+                       device_name = SYNTHETIC,storage_dtype = np.float64,
+                       threaded = False):
+    """
+    Stream as fast as possible for a while, and measure how many samples per
+    channel the recorder processes per second
+
+    Parameters
+    ----------
+    channels: int
+        Number of channels
+    duration: float
+        Time (s) to stream for
+    Other parameters: see Recorder
+
+    Returns
+    ----------
+    realtime_factor: float
+        Throughput divided by the rate (the rate of the replayed file, if
+        known). The stream can be sustained in real time if it is
+        comfortably above 1
+    """
+    recorder = Recorder(channels = channels,rate = rate,
+                        chunk_size = chunk_size,device_name = device_name,
+                        storage_dtype = storage_dtype,threaded = threaded,
+                        speed = 0)
+    try:
+        if not recorder.stream_init():
+            return 0.0
+        time.sleep(duration)
+        recorder.stream_stop()
+        return recorder.throughput() / recorder.rate
+    finally:
+        recorder.close()
@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the circular buffer used by the Recorder classes to
+store the most recent streamed data.
+
+The buffer is mirrored: every sample is written twice, once in each half of
+a backing array of twice the capacity. Any run of the most recent samples is
+therefore always contiguous in memory, so it can be handed out as a view
+without stitching the chunks back together.
+
+The buffer is written by a single writer (the audio callback) and can be read
+by any number of readers. The writer only publishes the new sample count after
+the data is in place, so readers never need a lock to get consistent data.
+The writer keeps going while a reader holds a view, though, so readers that
+keep the samples should ask for a copy: the counter of the write in progress
+is read again after copying (as in a seqlock), and the samples the writer has
+overwritten in the meantime are discarded.
+
+Example:
+    | >>>rb = RingBuffer(4096, channels = 2)
+    | >>>rb.write(np.ones((1024,2)))
+    | >>>rb.sequence
+    | 1024
+    | >>>data, seq = rb.read_since(0, copy = True)
+
+SharedRingBuffer keeps the buffer in shared memory, so that a recorder in
+another process can write it (see RecorderProcess).
+"""
+from multiprocessing import shared_memory
+
+import numpy as np
+
+class RingBuffer(object):
+    """
+    Preallocated, mirrored circular buffer with a monotonic sample counter
+
+    Attributes
+    ----------
+    capacity: int
+        Maximum number of samples (per channel) held by the buffer
+    channels: int
+        Number of channels
+    dtype: numpy dtype
+        Data type of the stored samples
+    """
+    # Number of times latest() copies the samples again if the writer
+    # overwrote some of them during the copy
+    COPY_ATTEMPTS = 3
+
+    def __init__(self,capacity,channels = 1,dtype = np.float64):
+        """
+        Allocate the backing array
+
+        Parameters
+        ----------
+        capacity: int
+            Maximum number of samples (per channel) held by the buffer
+        channels: int
+            Number of channels
+        dtype: numpy dtype
+            Data type of the stored samples
+        """
+        self.capacity = int(capacity)
+        self.channels = int(channels)
+        self.dtype = np.dtype(dtype)
+        self._data = np.zeros(shape = (2*self.capacity,self.channels),
+                              dtype = self.dtype)
+        self._sequence = 0
+        self._writing = 0
+
+#---------------- WRITER METHODS -----------------------------------
+    def write(self,data):
+        """
+        Write a block of samples to the buffer and publish them to the readers
+
+        Parameters
+        ----------
+        data: Numpy Array
+            Samples with dimension of (samples x channels)
+        """
+        n = data.shape[0]
+        sequence = self._sequence
+        if n > self.capacity:
+            # Only the most recent samples fit anyway
+            sequence += n - self.capacity
+            data = data[n - self.capacity:]
+            n = self.capacity
+
+        # Tell the readers which samples are about to be overwritten
+        self._writing = sequence + n
+        start = sequence % self.capacity
+        end = start + n
+        cap = self.capacity
+        self._data[start:end] = data
+        if end <= cap:
+            self._data[start+cap:end+cap] = data
+        else:
+            split = cap - start
+            self._data[start+cap:] = data[:split]
+            self._data[:end-cap] = data[split:]
+        # Publish the samples only once they are written
+        self._sequence = sequence + n
+
+    def reset(self):
+        """
+        Clear the buffer and restart the sample counter
+        """
+        self._data[:] = 0
+        self._sequence = 0
+        self._writing = 0
+
+#---------------- READER METHODS -----------------------------------
+    @property
+    def sequence(self):
+        """
+        int
+            Total number of samples written since the buffer was created.
+            Use it as a sequence number with read_since()
+        """
+        return self._sequence
+
+    def latest(self,num_samples = None,copy = False):
+        """
+        Get the most recent samples
+
+        Parameters
+        ----------
+        num_samples: int
+            Number of samples to get. Defaults to the full capacity
+        copy: bool
+            Whether to copy the samples out of the buffer. The copy is made
+            again if the writer overwrote some of them meanwhile, and only
+            the samples still valid are given if that keeps happening
+
+        Returns
+        ----------
+        Buffer data: Numpy Array
+            Read-only view (or copy) with dimension of num_samples x channels
+            The newest data on the most right
+        """
+        if num_samples is None:
+            num_samples = self.capacity
+        num_samples = max(0,min(int(num_samples),self.capacity))
+        for attempt in range(self.COPY_ATTEMPTS):
+            current = self._sequence
+            end = current % self.capacity + self.capacity
+            view = self._data[end-num_samples:end]
+            if not copy:
+                view.flags.writeable = False
+                return view
+            data = self._copy_valid(view,current - num_samples)
+            if data.shape[0] == num_samples:
+                break
+        return data
+
+    def read_since(self,sequence,copy = False):
+        """
+        Get the samples written after a given sequence number
+
+        Parameters
+        ----------
+        sequence: int
+            Sequence number obtained from a previous read
+        copy: bool
+            Whether to copy the samples out of the buffer. The samples the
+            writer overwrote during the copy are discarded
+
+        Returns
+        ----------
+        data: Numpy Array
+            Read-only view (or copy) of the new samples. If the reader has
+            fallen behind by more than the capacity, only the most recent
+            samples are given
+        sequence: int
+            Sequence number to pass to the next read
+        """
+        current = self._sequence
+        n_new = max(0,current - int(sequence))
+        end = current % self.capacity + self.capacity
+        n_new = min(n_new,self.capacity)
+        view = self._data[end-n_new:end]
+        if copy:
+            return self._copy_valid(view,current - n_new), current
+        view.flags.writeable = False
+        return view, current
+
+    def _copy_valid(self,view,first):
+        """
+        Copy a view of the buffer, then drop the samples that the writer
+        overwrote while they were being copied
+
+        Parameters
+        ----------
+        view: Numpy Array
+            View of the buffer
+        first: int
+            Sequence number of the oldest sample of the view
+
+        Returns
+        ----------
+        data: Numpy Array
+            Copy of the samples still valid after the copy, newest on the
+            most right
+        """
+        data = view.copy()
+        # Only read the counter after the copy: the write in progress may
+        # have overwritten the oldest samples
+        lapped = self._writing - self.capacity - first
+        if lapped > 0:
+            data = data[min(lapped,data.shape[0]):]
+        return data
+
+    def __len__(self):
+        """
+        Number of valid samples currently held
+        """
+        return min(self._sequence,self.capacity)
+
+class SharedRingBuffer(RingBuffer):
+    """
+    RingBuffer kept in shared memory, so that it can be written by a
+    recorder in one process and read by any number of other processes
+
+    The sample counter is stored in the shared memory as well, just before
+    the samples. It is only updated once the new samples are in place, so
+    it doubles as the sequence number the readers synchronise on. The
+    counter of the write in progress is stored next to it, so that readers
+    in other processes can check their copies too.
+
+    Attributes
+    ----------
+    name: str
+        Name of the shared memory, used to attach to the buffer from
+        another process
+    """
+    # Bytes reserved before the samples for the sample counters
+    HEADER_SIZE = 64
+
+    def __init__(self,capacity,channels = 1,dtype = np.float64,name = None):
+        """
+        Allocate the buffer in a new block of shared memory,
+        or attach to the existing buffer called name
+
+        Parameters
+        ----------
+        capacity: int
+            Maximum number of samples (per channel) held by the buffer
+        channels: int
+            Number of channels
+        dtype: numpy dtype
+            Data type of the stored samples
+        name: str
+            Name of the shared memory of an existing buffer
+        """
+        self.capacity = int(capacity)
+        self.channels = int(channels)
+        self.dtype = np.dtype(dtype)
+        if name is None:
+            size = (self.HEADER_SIZE +
+                    2*self.capacity*self.channels*self.dtype.itemsize)
+            self._shm = shared_memory.SharedMemory(create = True,size = size)
+            self._owner = True
+        else:
+            self._shm = shared_memory.SharedMemory(name = name)
+            self._owner = False
+        self.name = self._shm.name
+        self._counter = np.ndarray((2,),dtype = np.int64,buffer = self._shm.buf)
+        self._data = np.ndarray((2*self.capacity,self.channels),
+                                dtype = self.dtype,buffer = self._shm.buf,
+                                offset = self.HEADER_SIZE)
+        if self._owner:
+            self.reset()
+
+    @classmethod
+    def attach(cls,descriptor):
+        """
+        Attach to a buffer created in another process
+
+        Parameters
+        ----------
+        descriptor: tuple
+            Obtained from descriptor() in the process that created the buffer
+        """
+        name,capacity,channels,dtype = descriptor
+        return cls(capacity,channels = channels,dtype = dtype,name = name)
+
+    def descriptor(self):
+        """
+        Get what another process needs to attach to the buffer
+
+        Returns
+        ----------
+        tuple
+            (name, capacity, channels, dtype), picklable
+        """
+        return (self.name,self.capacity,self.channels,self.dtype.str)
+
+    @property
+    def _sequence(self):
+        return int(self._counter[0])
+
+    @_sequence.setter
+    def _sequence(self,value):
+        self._counter[0] = value
+
+    @property
+    def _writing(self):
+        return int(self._counter[1])
+
+    @_writing.setter
+    def _writing(self,value):
+        self._counter[1] = value
+
+    def close(self):
+        """
+        Unmap the buffer from this process. The process that created the
+        buffer also frees the shared memory
+        """
+        if self._shm is None:
+            return
+        self._counter = None
+        self._data = None
+        try:
+            self._shm.close()
+        except BufferError:
+            # Views of the buffer are still in use, leave it mapped
+            pass
+        if self._owner:
+            self._shm.unlink()
+        self._shm = None
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the classes to stream recordings straight to disk,
+so that the length of a recording is not limited by the available memory.
+
+A stream file is a small fixed-size header followed by the raw samples,
+stored as a (samples x channels) array. The file is preallocated to the
+maximum length of the recording and memory-mapped, and the chunks are
+written to it from a background thread, so the audio callback never waits
+on the disk.
+
+Example:
+    | >>>writer = StreamWriter('rec.dat', 44100*3600, channels = 2, rate = 44100)
+    | >>>writer.write(chunk)
+    | ...
+    | >>>data = writer.close()
+    | >>>data, header = read_stream_file('rec.dat')
+
+Attributes
+----------
+HEADER_FORMAT: str
+    struct format of the header
+HEADER_SIZE: int
+    Size of the header in bytes. The samples start at this offset
+"""
+import os
+import struct
+import threading
+import queue
+
+import numpy as np
+
+STREAM_MAGIC = b'CUEDDLG1'
+HEADER_FORMAT = '<8sIIdd8sQ'
+HEADER_SIZE = 64
+
+def write_stream_header(f,channels,rate,dtype,calibration_factor,num_samples):
+    """
+    Write the header of a stream file
+
+    Parameters
+    ----------
+    f: file object
+        File opened in binary mode
+    channels: int
+        Number of channels
+    rate: float
+        Sampling rate
+    dtype: numpy dtype
+        Data type of the samples
+    calibration_factor: float
+        Factor to multiply the samples by to get the physical values
+    num_samples: int
+        Number of valid samples (per channel) in the file
+    """
+    header = struct.pack(HEADER_FORMAT,STREAM_MAGIC,1,int(channels),
+                         float(rate),float(calibration_factor),
+                         np.dtype(dtype).str.encode('ascii'),int(num_samples))
+    f.seek(0)
+    f.write(header.ljust(HEADER_SIZE,b'\0'))
+
+def read_stream_header(filename):
+    """
+    Read the header of a stream file
+
+    Parameters
+    ----------
+    filename: str
+        Path to the stream file
+
+    Returns
+    ----------
+    header: dict
+        Contains 'channels', 'rate', 'dtype', 'calibration_factor'
+        and 'num_samples'
+    """
+    with open(filename,'rb') as f:
+        raw = f.read(struct.calcsize(HEADER_FORMAT))
+    (magic,version,channels,rate,
+     calibration_factor,dtype,num_samples) = struct.unpack(HEADER_FORMAT,raw)
+    if not magic == STREAM_MAGIC:
+        raise ValueError('{} is not a stream file'.format(filename))
+    return {'channels': channels,
+            'rate': rate,
+            'dtype': np.dtype(dtype.rstrip(b'\0').decode('ascii')),
+            'calibration_factor': calibration_factor,
+            'num_samples': num_samples}
+
+def read_stream_file(filename,mode = 'r'):
+    """
+    Open a stream file as a memory-mapped array
+
+    Parameters
+    ----------
+    filename: str
+        Path to the stream file
+    mode: str
+        Memory-map mode, see numpy.memmap
+
+    Returns
+    ----------
+    data: numpy memmap
+        Samples with dimension of (samples x channels)
+    header: dict
+        See read_stream_header
+    """
+    header = read_stream_header(filename)
+    if not header['num_samples']:
+        return np.zeros((0,header['channels']),dtype = header['dtype']), header
+    data = np.memmap(filename,dtype = header['dtype'],mode = mode,
+                     offset = HEADER_SIZE,
+                     shape = (header['num_samples'],header['channels']))
+    return data, header
+
+class StreamWriter(object):
+    """
+    Writes chunks of samples to a preallocated, memory-mapped stream file
+    using a background thread
+
+    Attributes
+    ----------
+    filename: str
+        Path to the stream file
+    capacity: int
+        Maximum number of samples (per channel) the file can hold
+    num_samples: int
+        Number of samples (per channel) written so far
+    """
+    def __init__(self,filename,capacity,channels = 1,rate = 44100,
+                 dtype = np.float64,calibration_factor = 1.0):
+        """
+        Preallocate the file and start the writer thread
+
+        Parameters
+        ----------
+        filename: str
+            Path to the stream file. It is overwritten if it exists
+        capacity: int
+            Maximum number of samples (per channel) the file can hold
+        channels: int
+            Number of channels
+        rate: float
+            Sampling rate
+        dtype: numpy dtype
+            Data type of the samples
+        calibration_factor: float
+            Factor to multiply the samples by to get the physical values
+        """
+        self.filename = filename
+        self.capacity = max(1,int(capacity))
+        self.channels = channels
+        self.rate = rate
+        self.dtype = np.dtype(dtype)
+        self.calibration_factor = calibration_factor
+        self.num_samples = 0
+
+        with open(self.filename,'wb') as f:
+            write_stream_header(f,channels,rate,self.dtype,calibration_factor,0)
+            f.truncate(HEADER_SIZE + self.capacity*self.channels*self.dtype.itemsize)
+        self._map = np.memmap(self.filename,dtype = self.dtype,mode = 'r+',
+                              offset = HEADER_SIZE,
+                              shape = (self.capacity,self.channels))
+
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target = self._run,daemon = True)
+        self._thread.start()
+
+    def write(self,data):
+        """
+        Queue a block of samples to be written to the file.
+        Does not block, so it can be called from the audio callback.
+
+        Parameters
+        ----------
+        data: Numpy Array
+            Samples with dimension of (samples x channels).
+            It must not be modified afterwards
+        """
+        if data.shape[0]:
+            self._queue.put(data)
+
+    def _run(self):
+        """
+        Writer thread: copy the queued blocks into the memory-mapped file
+        """
+        while True:
+            data = self._queue.get()
+            if data is None:
+                break
+            n = min(data.shape[0],self.capacity - self.num_samples)
+            if n < data.shape[0]:
+                print('Stream file is full, discarding %i samples' % (data.shape[0]-n))
+            self._map[self.num_samples:self.num_samples+n] = data[:n]
+            self.num_samples += n
+
+    def close(self,num_samples = None):
+        """
+        Finish writing, trim the file and reopen it read-only
+
+        Parameters
+        ----------
+        num_samples: int
+            Number of samples (per channel) to keep. Defaults to all the
+            samples written
+
+        Returns
+        ----------
+        data: numpy memmap
+            The recorded samples with dimension of (samples x channels)
+        """
+        self._stop()
+        if num_samples is not None:
+            self.num_samples = min(self.num_samples,int(num_samples))
+        with open(self.filename,'r+b') as f:
+            write_stream_header(f,self.channels,self.rate,self.dtype,
+                                self.calibration_factor,self.num_samples)
+            f.truncate(HEADER_SIZE + self.num_samples*self.channels*self.dtype.itemsize)
+        return read_stream_file(self.filename)[0]
+
+    def discard(self):
+        """
+        Stop writing and delete the file
+        """
+        self._stop()
+        try:
+            os.remove(self.filename)
+        except OSError as e:
+            print(e)
+
+    def _stop(self):
+        """
+        Wait for the queued blocks to be written and release the memory map
+        """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            self._map.flush()
+            del self._map
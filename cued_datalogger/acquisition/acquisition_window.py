@@ -31,6 +31,16 @@ WIDTH: Int
     Width of the application window
 HEIGHT: Int
     Height of the application window
+STORAGE_DTYPE: numpy dtype
+    Data type of the samples kept by the recorder. The raw integer samples
+    are only scaled when they are plotted or sent out for analysis
+THREADED: bool
+    Indicates whether the recorder processes the chunks in a consumer thread,
+    so the driver callback only copies the raw data
+ISOLATED: bool
+    Indicates whether the recorder runs in its own process and streams
+    through shared memory (see RecorderProcess), so that the plotting and
+    analysis in this process cannot delay the driver callback
 """
 import sys,traceback
 from PyQt5.QtWidgets import (QWidget,QHBoxLayout,QMainWindow,QPushButton,
@@ -48,8 +58,11 @@ from cued_datalogger.acquisition.RecordingUIs import (ChanToggleUI,ChanConfigUI,
                                                  StatusUI,RecUI)
 from cued_datalogger.acquisition.RecordingGraph import TimeLiveGraph,FreqLiveGraph,LevelsLiveGraph
 from cued_datalogger.acquisition.ChanMetaWin import ChanMetaWin
+from cued_datalogger.acquisition.LiveAnalysis import LiveAnalysis
+from cued_datalogger.acquisition.RingBuffer import RingBuffer
 
 import cued_datalogger.acquisition.myRecorder as mR
+import cued_datalogger.acquisition.RecorderProcess as RP
 try:
     import cued_datalogger.acquisition.NIRecorder as NIR
     NI_drivers = True
@@ -59,8 +72,7 @@ except NotImplementedError:
 except ImportError:
     print("ImportError: Seems like you don't have pyDAQmx modules")
     NI_drivers = False
-from cued_datalogger.analysis.frequency_domain import (compute_transfer_function,
-                                                   calculate_auto_spectrum, calculate_cross_spectrum)
+from cued_datalogger.analysis.spectral_averaging import welch_spectra, SpectralAccumulator
 
 from cued_datalogger.api.channel import ChannelSet
 from cued_datalogger.api.toolbox import Toolbox, MasterToolbox
@@ -69,6 +81,9 @@ from cued_datalogger.api.toolbox import Toolbox, MasterToolbox
 PLAYBACK = False    # Whether to playback the stream
 WIDTH = 900         # Window width
 HEIGHT = 600        # Window height
+STORAGE_DTYPE = np.int16    # Raw sample type of the buffer and recordings
+THREADED = True     # Whether to process the chunks off the driver callback
+ISOLATED = False    # Whether to run the recorder in its own process
 
 #++++++++++++++++++++++++ The AcquisitionWindow Class +++++++++++++++++++++++++++
 class AcquisitionWindow(QMainWindow):
@@ -121,19 +136,19 @@ class AcquisitionWindow(QMainWindow):
 
         # Set recorder object
         self.playing = False
-        self.rec = recType.Recorder(rate = configs[1],
-                                    channels = configs[2],
-                                    chunk_size = configs[3],
-                                    num_chunk = configs[4],
-                                    device_name = configs[0])
+        self.rec = self.create_recorder(recType,
+                                        rate = configs[1],
+                                        channels = configs[2],
+                                        chunk_size = configs[3],
+                                        num_chunk = configs[4],
+                                        device_name = configs[0])
         # Set up the TimeSeries and FreqSeries
         self.timedata = None
         self.freqdata = None
+        self.live_analysis = LiveAnalysis()
 
-        # Set up tallies for the average transfer function calculation
-        self.autospec_in_tally = []
-        self.autospec_out_tally = []
-        self.crossspec_tally = []
+        # Set up the running average for the average transfer function calculation
+        self.tf_accumulator = SpectralAccumulator()
 
         try:
             # Construct UI
@@ -262,6 +277,9 @@ class AcquisitionWindow(QMainWindow):
         self.chanconfig_UI.sigTimeOffsetChanged.connect(self.timeplot.set_offset)
         self.chanconfig_UI.sigFreqOffsetChanged.connect(self.freqplot.set_offset)
         self.chanconfig_UI.sigHoldChanged.connect(self.timeplot.set_sig_hold)
+        self.chanconfig_UI.sigTimeOffsetChanged.connect(self.request_redraw)
+        self.chanconfig_UI.sigFreqOffsetChanged.connect(self.request_redraw)
+        self.chanconfig_UI.sigHoldChanged.connect(self.request_redraw)
         self.chanconfig_UI.sigColourChanged.connect(self.timeplot.set_plot_colour)
         self.chanconfig_UI.sigColourChanged.connect(self.freqplot.set_plot_colour)
         self.chanconfig_UI.sigColourChanged.connect(self.levelsplot.set_plot_colour)
@@ -282,6 +300,9 @@ class AcquisitionWindow(QMainWindow):
         self.RecUI.cancelRecording.connect(self.cancel_recording)
         self.RecUI.undoLastTfAvg.connect(self.undo_tf_tally)
         self.RecUI.clearTfAvg.connect(self.remove_tf_tally)
+        self.RecUI.saveTfAvg.connect(self.save_tf_tally)
+        self.RecUI.loadTfAvg.connect(self.load_tf_tally)
+        self.RecUI.forgettingFactorChanged.connect(self.set_tf_forgetting_factor)
     #---------------------------RESETTING METHODS---------------------------
         self.ResetMetaData()
         self.ResetChanBtns()
@@ -363,37 +384,44 @@ class AcquisitionWindow(QMainWindow):
         """
         Callback to update the time domain and frequency domain plot
         """
-        # Get the buffer
-        data = self.rec.get_buffer()
-
-        # Take the last chunk for the levels plot
-        currentdata = data[len(data)-self.rec.chunk_size:,:]
-        currentdata -= np.mean(currentdata)
-        rms = np.sqrt(np.mean(currentdata ** 2,axis = 0))
-        maxs = np.amax(abs(currentdata),axis = 0)
-        self.levelsplot.set_channel_levels(rms,maxs)
+        # Skip the update if no new data has arrived since the last one,
+        # unless the plot settings have changed
+        # The stream keeps writing while the samples are read, so copy them
+        newdata, self.buffer_seq = self.rec.get_buffer_since(self.buffer_seq,
+                                                             copy = True)
+        if not newdata.shape[0] and not self.redraw_needed:
+            return
+        self.redraw_needed = False
+
+        # Scale only the new samples into the buffer of physical values
+        if newdata.shape[0]:
+            scaled = self.rec.scale_data(newdata,out = self.scaled_chunk[:newdata.shape[0]])
+            self.display_buffer.write(scaled)
+        data = self.display_buffer.latest()
+
+        # Compute the levels of the new samples, the spectra, and the zero
+        # crossings of the held channels, for all channels at once
+        held = np.array([hold == Qt.Checked for hold in self.timeplot.sig_hold[:data.shape[1]]],
+                        dtype = bool)
+        la = self.live_analysis
+        la.analyse(data,newdata.shape[0],held = held)
+        self.levelsplot.set_channel_levels(la.rms,la.peaks)
+        self.levelsplot.set_channel_peaks(la.peaks)
+
+        # Update each plot item's data
+        for i in range(data.shape[1]):
+            # Start from the zero crossing if the signal is held
+            zc = la.zero_crossings[i]
 
-        # Prepare the window and weightage for FFT plot
-        window = np.hanning(data.shape[0])
-        weightage = np.exp(2* self.timedata / self.timedata[-1])
+            self.timeplot.update_line(i,x = self.timedata[:data.shape[0]-zc] ,y = data[zc:,i])
+            self.freqplot.update_line(i,x = self.freqdata ,y = la.spectrum[:,i])
 
-        # Update each plot item's data + level peaks
-        for i in range(data.shape[1]):
-            plotdata = data[:,i].reshape((len(data[:,i]),))
-
-            # Check for zero crossing if needed
-            zc = 0
-            if self.timeplot.sig_hold[i] == Qt.Checked:
-                avg = np.mean(plotdata);
-                zero_crossings = np.where(np.diff(np.sign(plotdata-avg))>0)[0]
-                if zero_crossings.shape[0]:
-                    zc = zero_crossings[0]+1
-
-            self.timeplot.update_line(i,x = self.timedata[:len(plotdata)-zc] ,y = plotdata[zc:])
-            fft_data = rfft(plotdata* window * weightage)
-            psd_data = abs(fft_data)** 0.5
-            self.freqplot.update_line(i,x = self.freqdata ,y = psd_data)
-            self.levelsplot.set_peaks(i,maxs[i])
+    def request_redraw(self,*args):
+        """
+        Callback to redraw the plots on the next update, even if no new data
+        has arrived (e.g. when the stream is paused)
+        """
+        self.redraw_needed = True
 
     #-------------------------STATUS BAR WIDGET--------------------------------
     def toggle_rec(self,stop = None):
@@ -425,9 +453,11 @@ class AcquisitionWindow(QMainWindow):
         """
         Callback to take the current buffer data and send it out to parent window
         """
-        snapshot = self.rec.get_buffer()
-        for i in range(snapshot.shape[1]):
-            self.live_chanset.set_channel_data(i,'time_series',snapshot[:,i])
+        # Copy the buffer, as it will be overwritten by the stream
+        snapshot = self.rec.scale_data(self.rec.get_buffer(copy = True),
+                                       dtype = np.float64)
+        self.live_chanset.set_channel_block(tuple(range(snapshot.shape[1])),
+                                            'time_series',snapshot,axis = 1)
 
         self.live_chanset.set_channel_metadata( tuple(range(snapshot.shape[1])),
                                                    {'sample_rate':self.rec.rate})
@@ -454,6 +484,7 @@ class AcquisitionWindow(QMainWindow):
         """
         success = False
         rec_configs = self.RecUI.get_record_config()
+        self.rec.set_filename(self.RecUI.get_stream_filename())
         if rec_configs[2]>=0:
             # Set up the trigger if specified
             if self.rec.trigger_start(posttrig = rec_configs[0],
@@ -475,6 +506,7 @@ class AcquisitionWindow(QMainWindow):
                 btn.setDisabled(True)
             self.RecUI.switch_rec_box.setDisabled(True)
             self.RecUI.spec_settings_widget.setDisabled(True)
+            self.RecUI.stream_file_box.setDisabled(True)
             # Enable the cancel buttons
             self.RecUI.cancelbtn.setEnabled(True)
 
@@ -493,12 +525,17 @@ class AcquisitionWindow(QMainWindow):
 
         # Get the recorded data and compute DFT
         data = self.rec.flush_record_data()
-        ft_datas = np.zeros((int(data.shape[0]/2)+1,data.shape[1]),dtype = np.complex)
-        for i in range(data.shape[1]):
-            self.live_chanset.set_channel_data(i,'time_series',data[:,i])
-            ft = rfft(data[:,i])
-            self.live_chanset.add_channel_dataset(i,'spectrum',ft)
-            ft_datas[:,i] = ft
+        all_chans = tuple(range(data.shape[1]))
+        # Store all the channels in one (channels x samples) array, scaled
+        # and transposed in one pass. The array is handed over to the parent
+        # window as it is. A streamed recording is copied out of the stream
+        # file too, as the next recording to the same file overwrites it
+        self.live_chanset.set_channel_block(all_chans,'time_series',
+                                            self.rec.scale_data(data.T,dtype = np.float64,
+                                                                copy = True,order = 'C'))
+        self.live_chanset.set_channel_block(all_chans,'spectrum',
+                                            rfft(self.live_chanset.channel_block(all_chans,'time_series'),
+                                                 axis = 1))
 
         self.live_chanset.set_channel_metadata( tuple(range(data.shape[1])),
                                                    {'sample_rate':self.rec.rate})
@@ -507,48 +544,59 @@ class AcquisitionWindow(QMainWindow):
         rec_mode = self.RecUI.get_recording_mode()
         if rec_mode == 'Normal':
             # Send data normally
-            self.live_chanset.add_channel_dataset(tuple(range(data.shape[1])), 'frequency', [])
-            self.live_chanset.add_channel_dataset(tuple(range(data.shape[1])),'transfer_function',[])
-            self.live_chanset.add_channel_dataset(tuple(range(data.shape[1])),'coherence',[])
+            self.live_chanset.add_channel_dataset(all_chans, 'frequency', [])
+            self.live_chanset.add_channel_dataset(all_chans,'transfer_function',[])
+            self.live_chanset.add_channel_dataset(all_chans,'coherence',[])
             self.save_transfer_function()
         elif rec_mode == 'TF Avg.':
             # Compute the auto- and crossspectrum for average transfer function
-            # while store them in the tally
+            # and add them to the running average
             chans = list(range(self.rec.channels))
             in_chan = self.RecUI.get_input_channel()
             chans.remove(in_chan)
-            input_chan_data = ft_datas[:,in_chan]
+
+            # Average over segments of the recording, if specified.
+            # The whole recording is used unwindowed, e.g. for impact tests
+            segment_length = self.RecUI.get_segment_length()
+            if self.rec.storage_dtype.kind in 'iu':
+                calibration_factor = self.rec.scale_factor
+            else:
+                calibration_factor = 1
+            spectra = welch_spectra(data,input_channel = in_chan,
+                                    segment_length = segment_length,
+                                    window = 'hann' if segment_length else 'rectangular',
+                                    sample_rate = self.rec.rate,
+                                    calibration_factor = calibration_factor)
+            autospec_in = spectra.auto_spectra[:,in_chan]
+            autospec_out = spectra.auto_spectra[:,chans]
+            crossspec = spectra.cross_spectra[:,chans]
 
             # Check for incorrect data length with previous recorded data
-            if not len(self.autospec_in_tally)==0:
-                if not input_chan_data.shape[0] == self.autospec_in_tally[-1].shape[0]:
-                    print('Data shape does not match, you may have fiddle the settings')
-                    print('Please either clear the past data, or revert the settings')
-                    self.stats_UI.statusbar.clearMessage()
-                    self.RecUI.spec_settings_widget.setEnabled(True)
-                    self.RecUI.switch_rec_box.setEnabled(True)
-                    return
-
-            self.autospec_in_tally.append(calculate_auto_spectrum(input_chan_data))
-
-            autospec_out = np.zeros((ft_datas.shape[0],ft_datas.shape[1] - 1),dtype = np.complex)
-            crossspec = np.zeros(autospec_out.shape,dtype = np.complex)
-            for i,chan in enumerate(chans):
-                autospec_out[:,i] = calculate_auto_spectrum(ft_datas[:,chan])
-                crossspec[:,i] = calculate_cross_spectrum(input_chan_data,ft_datas[:,chan])
-
-            self.autospec_out_tally.append(autospec_out)
-            self.crossspec_tally.append(crossspec)
-            auto_in_sum = np.array(self.autospec_in_tally).sum(axis = 0)
-            auto_out_sum = np.array(self.autospec_out_tally).sum(axis = 0)
-            cross_sum = np.array(self.crossspec_tally).sum(axis = 0)
+            try:
+                self.tf_accumulator.add(autospec_in,autospec_out,crossspec)
+            except ValueError:
+                print('Data shape does not match, you may have fiddle the settings')
+                print('Please either clear the past data, or revert the settings')
+                self.stats_UI.statusbar.clearMessage()
+                self.RecUI.spec_settings_widget.setEnabled(True)
+                self.RecUI.switch_rec_box.setEnabled(True)
+                self.RecUI.stream_file_box.setEnabled(True)
+                return
+
+            if segment_length:
+                # Keep the spectra at the same resolution as the transfer functions
+                amplitude_spectra = spectra.amplitude_spectra()
+                self.live_chanset.set_channel_block(all_chans,'spectrum',
+                                                    amplitude_spectra,axis = 1)
+
+            tf_avg = self.tf_accumulator.transfer_function()
+            cor = self.tf_accumulator.coherence()
             for i,chan in enumerate(chans):
-                tf_avg,cor = compute_transfer_function(auto_in_sum,auto_out_sum[:,i],cross_sum[:,i])
-                self.live_chanset.add_channel_dataset(chan,'transfer_function',tf_avg)
-                self.live_chanset.add_channel_dataset(chan,'coherence',cor)
+                self.live_chanset.add_channel_dataset(chan,'transfer_function',tf_avg[:,i])
+                self.live_chanset.add_channel_dataset(chan,'coherence',cor[:,i])
 
             # Update the average count and send the data
-            self.RecUI.update_TFavg_count(len(self.autospec_in_tally))
+            self.RecUI.update_TFavg_count(self.tf_accumulator.count)
             self.save_transfer_function()
 
         elif rec_mode == 'TF Grid':
@@ -562,26 +610,57 @@ class AcquisitionWindow(QMainWindow):
         self.stats_UI.statusbar.clearMessage()
         self.RecUI.spec_settings_widget.setEnabled(True)
         self.RecUI.switch_rec_box.setEnabled(True)
+        self.RecUI.stream_file_box.setEnabled(True)
 
     def undo_tf_tally(self):
         """
         Callback to remove the last autospectrum and crossspectrum in the tally
         """
-        if self.autospec_in_tally:
-            self.autospec_in_tally.pop()
-            self.autospec_out_tally.pop()
-            self.crossspec_tally.pop()
-        self.RecUI.update_TFavg_count(len(self.autospec_in_tally))
+        if self.tf_accumulator.count and not self.tf_accumulator.undo():
+            print('Cannot undo more than %i averages' % self.tf_accumulator.max_undo)
+        self.RecUI.update_TFavg_count(self.tf_accumulator.count)
 
     def remove_tf_tally(self):
         """
         Callback to clear the autospectrum and crossspectrum tallies
         """
-        if self.autospec_in_tally:
-            self.autospec_in_tally = []
-            self.autospec_out_tally = []
-            self.crossspec_tally = []
-        self.RecUI.update_TFavg_count(len(self.autospec_in_tally))
+        self.tf_accumulator.clear()
+        self.RecUI.update_TFavg_count(self.tf_accumulator.count)
+
+    def set_tf_forgetting_factor(self,factor):
+        """
+        Callback to set the forgetting factor of the next averages,
+        1 for a linear average
+        """
+        try:
+            self.tf_accumulator.set_forgetting_factor(factor)
+        except ValueError as e:
+            print(e)
+
+    def save_tf_tally(self,filename):
+        """
+        Callback to save the running average of the autospectrum and
+        crossspectrum, to resume the averaging later
+        """
+        try:
+            self.tf_accumulator.save(filename)
+        except Exception as e:
+            print(e)
+            print('Cannot save the averages')
+
+    def load_tf_tally(self,filename):
+        """
+        Callback to resume the running average of the autospectrum and
+        crossspectrum from a saved file
+        """
+        try:
+            self.tf_accumulator = SpectralAccumulator.load(filename)
+        except Exception as e:
+            print(e)
+            print('Cannot load the averages')
+            return
+        self.RecUI.set_forgetting_factor(self.tf_accumulator.forgetting_factor)
+        self.RecUI.update_TFavg_count(self.tf_accumulator.count)
 
     # Cancel the data recording
     def cancel_recording(self):
@@ -593,10 +672,28 @@ class AcquisitionWindow(QMainWindow):
             btn.setEnabled(True)
 
         self.RecUI.switch_rec_box.setEnabled(True)
+        self.RecUI.stream_file_box.setEnabled(True)
         self.RecUI.spec_settings_widget.setEnabled(True)
         self.RecUI.cancelbtn.setDisabled(True)
         self.stats_UI.statusbar.clearMessage()
 
+    def create_recorder(self,recType,**kwargs):
+        """
+        Create a recorder, in its own process if ISOLATED
+
+        Parameters
+        ----------
+        recType: module
+            Module containing the Recorder class, e.g. myRecorder
+        kwargs:
+            Settings of the Recorder, other than the storage type and
+            whether it is threaded
+        """
+        kwargs.update(storage_dtype = STORAGE_DTYPE,threaded = THREADED)
+        if ISOLATED:
+            return RP.Recorder(recType,**kwargs)
+        return recType.Recorder(**kwargs)
+
     #--------------------------- RESET METHODS-------------------------------------
     def ResetRecording(self):
         """
@@ -616,7 +713,7 @@ class AcquisitionWindow(QMainWindow):
             # Get Input from the Device Configuration UI
             Rtype, settings = self.devconfig_UI.read_device_config()
             # Reinitialise the recording object
-            self.rec = Rtype.Recorder()
+            self.rec = self.create_recorder(Rtype)
             # Set the recorder parameters
             dev_name = self.rec.available_devices()[0]
             sel_ind = min(settings[0],len(dev_name)-1)
@@ -693,8 +790,16 @@ class AcquisitionWindow(QMainWindow):
         Reset the time and frequencies plot data
         """
         data = self.rec.get_buffer()
+        self.buffer_seq = 0
+        self.redraw_needed = True
+        # The buffer scaled to physical values for plotting, updated with
+        # the new samples only
+        self.display_buffer = RingBuffer(data.shape[0],channels = data.shape[1],
+                                         dtype = np.float32)
+        self.scaled_chunk = np.empty(data.shape,dtype = np.float32)
         self.timedata = np.arange(data.shape[0]) /self.rec.rate
         self.freqdata = np.arange(int(data.shape[0]/2)+1) /data.shape[0] * self.rec.rate
+        self.live_analysis.clear_cache()
 
     def ResetChanBtns(self):
         """
@@ -747,12 +852,34 @@ class AcquisitionWindow(QMainWindow):
 
     #----------------------- DATA TRANSFER METHODS -------------------------------
 
+    def hand_off_chanset(self):
+        """
+        Give away the ChannelSet with the recorded data, and start a new
+        one with the same channel metadata for the next recording
+
+        The data is not copied: the receiver owns the returned ChannelSet,
+        and later recordings do not modify it
+
+        Returns
+        ----------
+        ChannelSet
+            The ChannelSet with the recorded data
+        """
+        chanset = self.live_chanset
+        self.live_chanset = ChannelSet(len(chanset))
+        for i in range(len(chanset)):
+            metadata = chanset.channel_metadata(i)
+            metadata['tags'] = list(metadata['tags'])
+            self.live_chanset.set_channel_metadata(i,metadata)
+        self.live_chanset.add_channel_dataset(tuple(range(len(chanset))),'time_series')
+        return chanset
+
     def save_time_series(self):
         """
         Transfer time series data to parent window
         """
         print('Saving time series...')
-        self.sig_time_series_data_saved.emit(self.live_chanset)
+        self.sig_time_series_data_saved.emit(self.hand_off_chanset())
         print('Time series saved!')
 
     def save_transfer_function(self):
@@ -760,7 +887,7 @@ class AcquisitionWindow(QMainWindow):
         Transfer transfer function data to parent window
         """
         print('Saving transfer function...')
-        self.sig_transfer_function_data_saved.emit(self.live_chanset)
+        self.sig_transfer_function_data_saved.emit(self.hand_off_chanset())
         print('Transfer function saved!')
 
     #-------------------------- STREAM METHODS ------------------------------------
@@ -783,6 +910,7 @@ class AcquisitionWindow(QMainWindow):
         """
         self.rec.rEmitter.recorddone.connect(self.stop_recording)
         self.rec.rEmitter.triggered.connect(self.stats_UI.trigger_message)
+        self.rec.rEmitter.chunksdropped.connect(self.stats_UI.dropped_message)
         #self.rec.rEmitter.newdata.connect(self.update_line)
         #self.rec.rEmitter.newdata.connect(self.update_chanlvls)
 
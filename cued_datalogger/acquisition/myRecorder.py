@@ -71,13 +71,15 @@ class Recorder(RecorderParent):
 
 #---------------- INITIALISATION METHODS -----------------------------------
     def __init__(self,channels = 1,rate = 44100, chunk_size = 1024,
-                 num_chunk = 4,device_name = None):
+                 num_chunk = 4,device_name = None,storage_dtype = np.float64,
+                 threaded = False):
         """
          Re-implemented from RecorderParent
         """
 
         super().__init__(channels = channels,rate = rate,
-             chunk_size = chunk_size,num_chunk = num_chunk)
+             chunk_size = chunk_size,num_chunk = num_chunk,
+             storage_dtype = storage_dtype,threaded = threaded)
 
         print('You are using pyAudio for recording')
         self.p = None
@@ -192,30 +194,22 @@ class Recorder(RecorderParent):
         """
         Re-implemented from RecorderParent
         """
-        return np.frombuffer(data, dtype = np.int16).reshape((self.chunk_size,self.channels))/ 2**15
+        return super().audiodata_to_array(np.frombuffer(data, dtype = np.int16))
 
 #---------------- STREAMING METHODS -----------------------------------
     def stream_audio_callback(self,in_data, frame_count, time_info, status):
         """
         Callback function for audio streaming.
-        First, it writes data to the circular buffer,
-        then record data if it is recording,
-        finally check for any trigger.
+        Counts any input overflow, then hands the data to receive_chunk().
 
         Inputs and Outputs are part of the callback format.
         More info can be found in PyAudio documentation
         """
-        data_array = self.audiodata_to_array(in_data)
-        self.write_buffer(data_array)
+        if status & pyaudio.paInputOverflow:
+            self.input_overflows += 1
+        self.receive_chunk(in_data)
         #self.rEmitter.newdata.emit()
 
-        if self.recording:
-            self.record_data(data_array)
-
-         # Trigger check
-        if self.trigger:
-            self._trigger_check_threshold(data_array)
-
         return(in_data,pyaudio.paContinue)
 
     # TODO: Check for valid device, channels and all that before initialisation
@@ -225,6 +219,7 @@ class Recorder(RecorderParent):
         """
         if (not self.device_index == None) and (self.audio_stream == None) :
             try:
+                self.consumer_start()
                 self.audio_stream = self.p.open(channels = self.channels,
                                  rate = self.rate,
                                  format = self.format,
@@ -247,6 +242,7 @@ class Recorder(RecorderParent):
                 print(v)
                 print(traceback.format_tb(tb))
                 self.audio_stream = None
+                self.consumer_stop()
                 return False
         else:
             return False
@@ -286,4 +282,5 @@ class Recorder(RecorderParent):
             self.stream_stop()
             self.audio_stream.close()
             self.audio_stream = None
+            self.consumer_stop()
 
@@ -3,7 +3,8 @@ from numpy.fft import rfft,fft
 
 from PyQt5.QtWidgets import (QWidget, QApplication, QTabWidget, QComboBox,
                              QHBoxLayout, QMainWindow, QPushButton,
-                             QVBoxLayout, QAction, QMenu, QSplitter)
+                             QVBoxLayout, QAction, QActionGroup, QMenu,
+                             QSplitter, QProgressBar)
 from PyQt5.Qt import QSizePolicy
 
 import sys
@@ -14,6 +15,7 @@ from cued_datalogger.analysis.sonogram import SonogramDisplayWidget, SonogramToo
 from cued_datalogger.analysis.time_domain import TimeDomainWidget, TimeToolbox
 
 from cued_datalogger.api.addons import AddonManager
+from cued_datalogger.api.executor import AnalysisExecutor
 from cued_datalogger.api.channel import ChannelSet, ChannelSelectWidget, ChannelMetadataWidget
 from cued_datalogger.api.file_import import DataImportWidget
 from cued_datalogger.api.file_export import DataExportWidget
@@ -45,6 +47,31 @@ class ProjectMenu(QMenu):
         self.addActions([newAct,setAct,exitAct])
 
 
+class ExecutorMenu(QMenu):
+    """
+    A drop-down menu to choose how the calculations for each channel are
+    run: in the GUI thread, or in parallel on a pool of threads or
+    processes.
+    """
+    def __init__(self, executor, parent):
+        super().__init__('Parallel', parent)
+        self.executor = executor
+        self.initMenu()
+
+    def initMenu(self):
+        group = QActionGroup(self)
+        for mode, text in (('serial', 'Run serially'),
+                           ('thread', 'Run on a thread pool'),
+                           ('process', 'Run on a process pool')):
+            action = QAction(text, self)
+            action.setCheckable(True)
+            action.setChecked(mode == self.executor.mode)
+            action.triggered.connect(lambda checked, mode=mode:
+                                     self.executor.set_mode(mode))
+            group.addAction(action)
+            self.addAction(action)
+
+
 class AnalysisWindow(QMainWindow):
     """
     The main window for analysing and processing data.
@@ -77,6 +104,10 @@ class AnalysisWindow(QMainWindow):
     global_master_toolbox : :class:`~cued_datalogger.api.toolbox.MasterToolbox`
       The master toolbox containing the :attr:`global_toolbox`.
 
+    executor : :class:`~cued_datalogger.api.executor.AnalysisExecutor`
+      Runs the calculations for each channel in parallel, for all the
+      display widgets.
+
     global_toolbox : :class:`~cued_datalogger.api.toolbox.Toolbox`
       The widget containing global tools and operations. Has five tabs,
       containing: <acquisition window launcher>, :attr:`channel_select_widget`,
@@ -100,9 +131,13 @@ class AnalysisWindow(QMainWindow):
         self.showMaximized()
 
     def _init_ui(self):
+        # Create the executor for the calculations
+        self.executor = AnalysisExecutor('thread', parent=self)
+
         # Add the drop-down menu
         self.menubar = self.menuBar()
         self.menubar.addMenu(ProjectMenu(self))
+        self.menubar.addMenu(ExecutorMenu(self.executor, self))
 
         # # Create the main widget
         self.splitter = QSplitter(self)
@@ -122,6 +157,9 @@ class AnalysisWindow(QMainWindow):
         # Create the global toolbox
         self._init_global_master_toolbox()
 
+        # Show the progress of the calculations
+        self._init_progress()
+
         # Configure
         self.update_channelset()
         self.goto_time_series()
@@ -139,6 +177,9 @@ class AnalysisWindow(QMainWindow):
         self.sonogram_widget = SonogramDisplayWidget()
         self.circle_widget = CircleFitWidget()
 
+        self.freqdomain_widget.set_executor(self.executor)
+        self.sonogram_widget.set_executor(self.executor)
+
         # Create the tabs
         self.display_tabwidget.addTab(self.timedomain_widget, "Time Domain")
         self.display_tabwidget.addTab(self.freqdomain_widget, "Frequency Domain")
@@ -165,6 +206,12 @@ class AnalysisWindow(QMainWindow):
         self.frequency_toolbox.sig_plot_transfer_function.connect(lambda: self.freqdomain_widget.update_plot(True))
         self.frequency_toolbox.sig_plot_type_changed.connect(self.freqdomain_widget.set_plot_type)
         self.frequency_toolbox.sig_show_coherence.connect(self.freqdomain_widget.set_show_coherence)
+        self.frequency_toolbox.sig_segment_length_changed.connect(self.freqdomain_widget.set_segment_length)
+        self.frequency_toolbox.sig_overlap_changed.connect(self.freqdomain_widget.set_overlap)
+        self.frequency_toolbox.sig_window_changed.connect(self.freqdomain_widget.set_window)
+        self.frequency_toolbox.sig_estimator_changed.connect(self.freqdomain_widget.set_estimator)
+        self.frequency_toolbox.sig_zoom_changed.connect(self.freqdomain_widget.set_zoom)
+        self.frequency_toolbox.sig_zoom_points_changed.connect(self.freqdomain_widget.set_zoom_points)
 
         # # Sonogram toolbox
         self.sonogram_toolbox = SonogramToolbox(self.toolbox)
@@ -172,11 +219,13 @@ class AnalysisWindow(QMainWindow):
         self.sonogram_toolbox.sig_num_contours_changed.connect(self.sonogram_widget.update_num_contours)
         self.sonogram_toolbox.sig_window_overlap_fraction_changed.connect(self.sonogram_widget.update_window_overlap_fraction)
         self.sonogram_toolbox.sig_window_width_changed.connect(self.sonogram_widget.update_window_width)
+        self.sonogram_toolbox.sig_zoom_aware_changed.connect(self.sonogram_widget.set_zoom_aware)
 
         # # Circle Fit toolbox
         self.circle_fit_toolbox = CircleFitToolbox(self.toolbox)
         self.circle_fit_toolbox.sig_show_transfer_fn.connect(self.circle_widget.show_transfer_fn)
         self.circle_fit_toolbox.sig_construct_transfer_fn.connect(self.circle_widget.construct_transfer_fn)
+        self.circle_fit_toolbox.sig_identify_modes.connect(self.circle_widget.identify_modes)
 
         self.toolbox.add_toolbox(self.time_toolbox)
         self.toolbox.add_toolbox(self.frequency_toolbox)
@@ -224,6 +273,35 @@ class AnalysisWindow(QMainWindow):
 
         self.global_master_toolbox.add_toolbox(self.global_toolbox)
 
+    def _init_progress(self):
+        """Create the progress bar and cancel button in the status bar,
+        shown while the executor is running."""
+        self.progress_bar = QProgressBar(self)
+        self.cancel_button = QPushButton("Cancel", self)
+        self.cancel_button.clicked.connect(self.executor.cancel)
+        self.statusBar().addPermanentWidget(self.progress_bar)
+        self.statusBar().addPermanentWidget(self.cancel_button)
+        self.on_executor_busy_changed(False)
+
+        self.executor.sig_progress.connect(self.on_executor_progress)
+        self.executor.sig_busy_changed.connect(self.on_executor_busy_changed)
+
+    def on_executor_progress(self, done, total):
+        self.progress_bar.setRange(0, total)
+        self.progress_bar.setValue(done)
+
+    def on_executor_busy_changed(self, busy):
+        self.progress_bar.setVisible(busy)
+        self.cancel_button.setVisible(busy)
+        # Stop anything starting new calculations until they are done
+        self.toolbox.setEnabled(not busy)
+        self.global_master_toolbox.setEnabled(not busy)
+        self.display_tabwidget.tabBar().setEnabled(not busy)
+
+    def closeEvent(self, event):
+        self.executor.shutdown()
+        super().closeEvent(event)
+
     def _update_splitter(self):
         # Get the current sizes of everything
         sizes = self.splitter.sizes()
@@ -251,12 +329,35 @@ class AnalysisWindow(QMainWindow):
             self.acquisition_window.show()
 
     def receive_data(self, received_cs):
-        self.replace_channelset(received_cs)
-
-        if self.cs.channels[0].is_dataset("transfer_function"):
-            self.goto_transfer_function()
+        """Take over the ChannelSet of a recording from the acquisition
+        window, without copying its data, and display it.
+
+        Only the tab that is shown is redrawn, once. The other tabs are
+        redrawn with the new channels when they are next shown."""
+        if not isinstance(received_cs, ChannelSet):
+            print("Failed to receive ChannelSet: {} not a "
+                  "ChannelSet".format(type(received_cs)))
+            return
+        self.cs = received_cs
+
+        # Update the channel lists without redrawing the current tab
+        self.channel_select_widget.blockSignals(True)
+        try:
+            self.update_channelset()
+        finally:
+            self.channel_select_widget.blockSignals(False)
+
+        # The transfer functions are already calculated by the acquisition
+        # window (eg. averaged over several recordings), so only plot them
+        if any(channel.is_dataset("transfer_function")
+               for channel in self.cs.channels):
+            self.frequency_toolbox.blockSignals(True)
+            self.frequency_toolbox.set_plot_transfer_function()
+            self.frequency_toolbox.blockSignals(False)
+            self.freqdomain_widget.plot_transfer_function = True
+            self.show_tab(self.freqdomain_widget)
         else:
-            self.goto_time_series()
+            self.show_tab(self.timedomain_widget)
 
     def auto_change_tab(self):
         current_widget = self.display_tabwidget.currentWidget()
@@ -296,6 +397,15 @@ class AnalysisWindow(QMainWindow):
         self.acquisition_window = None
 
     #---------------------------- Tab methods ---------------------------------
+    def show_tab(self, widget):
+        """Show the tab *widget*, and draw the selected channels on it."""
+        if self.display_tabwidget.currentWidget() is widget:
+            self.set_selected_channels(
+                self.channel_select_widget.selected_channels())
+        else:
+            # Draws the selected channels
+            self.display_tabwidget.setCurrentWidget(widget)
+
     def goto_time_series(self, switch_to_tab=True):
         if switch_to_tab:
             self.display_tabwidget.setCurrentWidget(self.timedomain_widget)
@@ -326,6 +436,8 @@ class AnalysisWindow(QMainWindow):
     def goto_circle_fit(self, switch_to_tab=True):
         if switch_to_tab:
             self.display_tabwidget.setCurrentWidget(self.circle_widget)
+        # Fit the zoomed transfer functions if they are what is plotted
+        self.circle_widget.set_use_zoom(self.freqdomain_widget.zoom)
         self.circle_widget.set_selected_channels(self.channel_select_widget.selected_channels())
 
     #------------------ ChannelSet methods ------------------------------------
@@ -355,6 +467,8 @@ class AnalysisWindow(QMainWindow):
             print("Failed to replace ChannelSet: {} not a ChannelSet".format(type(cs)))
 
     def set_selected_channels(self, channels):
+        if self.display_tabwidget.currentWidget() is self.circle_widget:
+            self.circle_widget.set_use_zoom(self.freqdomain_widget.zoom)
         self.display_tabwidget.currentWidget().set_selected_channels(channels)
         if self.display_tabwidget.currentWidget() is self.sonogram_widget:
             self.sonogram_toolbox.set_selected_channels(channels)
@@ -1,4 +1,4 @@
-import sys, traceback
+import sys, traceback, threading
 if __name__ == '__main__':
     sys.path.append('../../')
 
@@ -7,27 +7,47 @@ from cued_datalogger.api.workspace import Workspace
 from cued_datalogger.api.file_import import import_from_mat
 from cued_datalogger.api.toolbox import Toolbox
 from cued_datalogger.api.numpy_extensions import from_dB, to_dB, sdof_modal_peak
+from cued_datalogger.analysis.lscf import (lscf, stabilisation, select_poles,
+                                           lsfd, pole_frequency_damping,
+                                           POLE_NEW, POLE_STABLE_FREQUENCY,
+                                           POLE_STABLE)
 from cued_datalogger.api.pyqtgraph_extensions import InteractivePlotWidget
 
-from PyQt5.QtCore import Qt, pyqtSignal
+from PyQt5.QtCore import Qt, QObject, pyqtSignal
 from PyQt5 import QtGui
 from PyQt5.QtWidgets import (QApplication, QWidget, QGridLayout, QTableWidget,
-                             QDoubleSpinBox, QCheckBox, QPushButton, QGroupBox,
+                             QDoubleSpinBox, QSpinBox, QCheckBox, QPushButton,
+                             QGroupBox,
                              QVBoxLayout, QHBoxLayout, QLabel, QComboBox,
                              QFileDialog, QTreeWidget, QTreeWidgetItem, QRadioButton)
 
 import numpy as np
-import scipy.optimize as so
 
 from pyqtgraph.Qt import QtCore
 import pyqtgraph as pg
 defaultpen='k'
 
 
+TRANSFER_FUNCTION_TYPES = ['displacement', 'velocity', 'acceleration']
+
+# The factor that converts a receptance peak into each type of transfer
+# function, and the direction of the resonance on the Nyquist plot relative
+# to the phase of the modal constant
+_MOBILITY = {'displacement': lambda w: np.ones_like(w),
+             'velocity': lambda w: 1j*w,
+             'acceleration': lambda w: -w**2}
+_CIRCLE_ROTATION = {'displacement': -1j,
+                    'velocity': 1,
+                    'acceleration': 1j}
+
+
 def fit_circle_to_data(x, y):
     """
     Fit a geometric circle to the data given in x, y.
 
+    The data can be 2d, with each row fitted separately, so that one call
+    fits a circle to every channel.
+
     Parameters
     ----------
     x : ndarray
@@ -35,11 +55,11 @@ def fit_circle_to_data(x, y):
 
     Returns
     -------
-    x0 : float
+    x0 : float or ndarray
         The x-coordinate of the centre of the circle.
-    y0 : float
+    y0 : float or ndarray
         The y-coordinate of the centre of the circle.
-    R0 : float
+    R0 : float or ndarray
         The radius of the circle.
 
     Notes
@@ -54,35 +74,383 @@ def fit_circle_to_data(x, y):
     """
     # Use the method from "Theoretical and Experimental Modal Analysis" p221
     # Set up the matrices
-    xs = np.sum(x)
-    ys = np.sum(y)
-    xx = np.square(x).sum()
-    yy = np.square(y).sum()
-    xy = np.sum(x*y)
-    L = x.size
-    xxx = np.sum(x*np.square(x))
-    yyy = np.sum(y*np.square(y))
-    xyy = np.sum(x*np.square(y))
-    yxx = np.sum(y*np.square(x))
-
-    A = np.asarray([[xx, xy, -xs],
-                    [xy, yy, -ys],
-                    [-xs, -ys, L]])
-
-    B = np.asarray([[-(xxx + xyy)],
-                    [-(yyy + yxx)],
-                    [xx + yy]])
+    x = np.asarray(x)
+    y = np.asarray(y)
+    xs = np.sum(x, axis=-1)
+    ys = np.sum(y, axis=-1)
+    xx = np.square(x).sum(axis=-1)
+    yy = np.square(y).sum(axis=-1)
+    xy = np.sum(x*y, axis=-1)
+    L = np.full_like(xs, x.shape[-1])
+    xxx = np.sum(x*np.square(x), axis=-1)
+    yyy = np.sum(y*np.square(y), axis=-1)
+    xyy = np.sum(x*np.square(y), axis=-1)
+    yxx = np.sum(y*np.square(x), axis=-1)
+
+    A = np.stack([np.stack([xx, xy, -xs], axis=-1),
+                  np.stack([xy, yy, -ys], axis=-1),
+                  np.stack([-xs, -ys, L], axis=-1)], axis=-2)
+
+    B = np.stack([-(xxx + xyy),
+                  -(yyy + yxx),
+                  xx + yy], axis=-1)[..., np.newaxis]
 
     # Solve the equation
-    v = np.linalg.solve(A, B)
+    v = np.linalg.solve(A, B)[..., 0]
 
     # Find the circle parameters
-    x0 = v[0]/-2
-    y0 = v[1]/-2
-    R0 = np.sqrt(v[2] + x0**2 + y0**2)
+    x0 = v[..., 0]/-2
+    y0 = v[..., 1]/-2
+    R0 = np.sqrt(v[..., 2] + x0**2 + y0**2)
     return x0, y0, R0
 
 
+def sdof_peak_with_offset(w, wn, zn, an, phi, circle,
+                          transfer_function_type='displacement'):
+    """
+    Return an SDOF modal peak, offset so that its circle on the Nyquist plot
+    is centred on the geometric circle fitted to the data.
+
+    Parameters
+    ----------
+    w : ndarray
+        An array of omega (angular frequency) values.
+    wn : float
+        The resonant angular frequency.
+    zn : float
+        The damping factor.
+    an : float
+        The magnitude of the modal constant.
+    phi : float
+        The phase (rad) of the modal constant.
+    circle : tuple
+        The (x0, y0, R0) of the geometric circle, from
+        :func:`fit_circle_to_data`.
+    transfer_function_type : str
+        One of ``'displacement'``, ``'velocity'`` or ``'acceleration'``.
+
+    Returns
+    -------
+    ndarray
+        The modal peak.
+    """
+    x0, y0, R0 = circle
+    return x0 + 1j*y0 \
+        - R0*_CIRCLE_ROTATION[transfer_function_type]*np.exp(1j*phi) \
+        + _MOBILITY[transfer_function_type](w)*sdof_modal_peak(w, wn, zn,
+                                                                an, phi)
+
+
+def _sdof_residual(omega, transfer_function, parameters, circle,
+                   transfer_function_type, jacobian=False):
+    """Return the complex residual of the SDOF model with offset for each
+    channel (channels x points), and optionally its Jacobian with respect to
+    the parameters (channels x points x 4)."""
+    wn = parameters[:, 0:1]
+    zn = parameters[:, 1:2]
+    a_real = parameters[:, 2:3]
+    a_imag = parameters[:, 3:4]
+    a = a_real + 1j*a_imag
+    x0, y0, R0 = [np.reshape(c, (-1, 1)) for c in circle]
+    rotation = _CIRCLE_ROTATION[transfer_function_type]
+
+    a_abs_sq = np.maximum(np.abs(a)**2, np.finfo(float).tiny)
+    direction = a / np.sqrt(a_abs_sq)
+    denominator = wn**2 - omega**2 + 2j*zn*wn*omega
+    g = _MOBILITY[transfer_function_type](omega) / denominator
+
+    residual = x0 + 1j*y0 - R0*rotation*direction + a*g - transfer_function
+    if not jacobian:
+        return residual
+
+    J = np.empty(residual.shape + (4,), dtype=residual.dtype)
+    J[..., 0] = -a*g*(2*wn + 2j*zn*omega) / denominator
+    J[..., 1] = -a*g*2j*wn*omega / denominator
+    # The offset depends on the phase of the modal constant
+    J[..., 2] = g + 1j*R0*rotation*a_imag*direction / a_abs_sq
+    J[..., 3] = 1j*g - 1j*R0*rotation*a_real*direction / a_abs_sq
+    return residual, J
+
+
+def sdof_initial_parameters(omega, transfer_function, circle,
+                            transfer_function_type='displacement'):
+    """
+    Return a first guess of the SDOF parameters of each channel, from the
+    peak of the data and the geometric circle.
+
+    Parameters
+    ----------
+    omega : ndarray
+        The angular frequencies of the data, either 1d or one row per channel.
+    transfer_function : ndarray
+        The transfer function of each channel (channels x points).
+    circle : tuple
+        The (x0, y0, R0) of the geometric circle of each channel.
+    transfer_function_type : str
+        One of ``'displacement'``, ``'velocity'`` or ``'acceleration'``.
+
+    Returns
+    -------
+    ndarray
+        The parameters (wn, zn, Re(an), Im(an)) of each channel, with
+        dimension (channels x 4).
+    """
+    transfer_function = np.atleast_2d(transfer_function)
+    omega = np.broadcast_to(omega, transfer_function.shape)
+    rows = np.arange(transfer_function.shape[0])
+    x0, y0, R0 = [np.ravel(c) for c in circle]
+
+    # The resonance is taken to be at the maximum magnitude
+    magnitude = np.abs(transfer_function)
+    i = magnitude.argmax(axis=-1)
+    spacing = np.abs(omega[:, -1] - omega[:, 0]) \
+        / max(transfer_function.shape[1] - 1, 1)
+    wn0 = omega[rows, i]
+    wn0 = np.where(wn0 > 0, wn0, spacing)
+
+    # Damping from the half-power bandwidth
+    half_power = magnitude >= magnitude[rows, i][:, np.newaxis] / np.sqrt(2)
+    zn0 = np.clip(half_power.sum(axis=-1) * spacing / (2*wn0), 1e-4, 0.5)
+
+    # The resonance is the point of the circle opposite the origin of the
+    # peak, so it gives the phase of the modal constant, and the diameter of
+    # the circle gives its magnitude
+    to_resonance = (transfer_function[rows, i] - (x0 + 1j*y0)) \
+        / _CIRCLE_ROTATION[transfer_function_type]
+    phi0 = np.angle(to_resonance)
+    an0 = 4*R0*zn0*wn0**2 \
+        / np.abs(_MOBILITY[transfer_function_type](wn0.astype(complex)))
+
+    return np.column_stack([wn0, zn0, an0*np.cos(phi0), an0*np.sin(phi0)])
+
+
+def sdof_fit(omega, transfer_function, circle,
+             transfer_function_type='displacement', parameters0=None,
+             max_iterations=100, tolerance=1e-10):
+    """
+    Fit an SDOF modal peak with offset to every channel at once, with a
+    Levenberg-Marquardt least squares fit using the analytic Jacobian of
+    the model.
+
+    Parameters
+    ----------
+    omega : ndarray
+        The angular frequencies of the data, either 1d or one row per channel.
+    transfer_function : ndarray
+        The transfer function of each channel (channels x points).
+    circle : tuple
+        The (x0, y0, R0) of the geometric circle of each channel, from
+        :func:`fit_circle_to_data`.
+    transfer_function_type : str
+        One of ``'displacement'``, ``'velocity'`` or ``'acceleration'``.
+    parameters0 : ndarray, optional
+        Parameters to warm start the fit from, eg. the previous fit, with
+        dimension (channels x 4). Each channel starts from whichever of these
+        and :func:`sdof_initial_parameters` fits better. Rows containing NaN
+        are ignored.
+    max_iterations : int
+        The maximum number of iterations.
+    tolerance : float
+        The fit of a channel stops when an iteration reduces its cost by
+        less than this fraction.
+
+    Returns
+    -------
+    parameters : ndarray
+        The fitted parameters (wn, zn, Re(an), Im(an)) of each channel, with
+        dimension (channels x 4).
+    cost : ndarray
+        The sum of the squared residuals of each channel.
+    """
+    if not transfer_function_type in TRANSFER_FUNCTION_TYPES:
+        raise ValueError("'transfer_function_type' must be one of {}"
+                         .format(TRANSFER_FUNCTION_TYPES))
+    transfer_function = np.atleast_2d(transfer_function)
+    omega = np.asarray(omega, dtype=float)
+
+    def cost_of(parameters):
+        residual = _sdof_residual(omega, transfer_function, parameters,
+                                  circle, transfer_function_type)
+        return np.sum(residual.real**2 + residual.imag**2, axis=-1)
+
+    parameters = sdof_initial_parameters(omega, transfer_function, circle,
+                                         transfer_function_type)
+    cost = cost_of(parameters)
+
+    # Warm start the channels that were fitted better before
+    if parameters0 is not None:
+        parameters0 = np.asarray(parameters0, dtype=float)
+        warm = np.isfinite(parameters0).all(axis=1)
+        warm_cost = cost_of(np.where(warm[:, np.newaxis], parameters0,
+                                     parameters))
+        use_warm = warm & (warm_cost < cost)
+        parameters[use_warm] = parameters0[use_warm]
+        cost[use_warm] = warm_cost[use_warm]
+
+    damping = np.full(cost.shape, 1e-3)
+    active = np.isfinite(cost)
+    for iteration in range(max_iterations):
+        if not active.any():
+            break
+        residual, J = _sdof_residual(omega, transfer_function, parameters,
+                                     circle, transfer_function_type,
+                                     jacobian=True)
+        # Normal equations of the real least squares problem
+        JtJ = np.einsum('cnk,cnl->ckl', J.conj(), J).real
+        gradient = np.einsum('cnk,cn->ck', J.conj(), residual).real
+
+        # Marquardt scaling, so the step does not depend on the units
+        diagonal = np.einsum('ckk->ck', JtJ)
+        step = -np.einsum('ckl,cl->ck',
+                          np.linalg.pinv(JtJ + damping[:, np.newaxis, np.newaxis]
+                                         * diagonal[:, np.newaxis, :]
+                                         * np.eye(4)),
+                          gradient)
+
+        new_parameters = parameters + step
+        new_parameters[:, 1] = np.abs(new_parameters[:, 1])
+        new_cost = cost_of(new_parameters)
+
+        better = active & (new_cost < cost)
+        converged = better & (cost - new_cost <= tolerance*cost)
+        parameters[better] = new_parameters[better]
+        cost[better] = new_cost[better]
+
+        damping = np.where(better, damping / 10, damping * 10)
+        active &= ~converged & (damping < 1e10)
+
+    return parameters, cost
+
+
+def sdof_modal_parameters(parameters):
+    """Return the resonant frequency (rad), damping factor, modal amplitude
+    and modal phase (rad) from the *parameters* returned by
+    :func:`sdof_fit`."""
+    parameters = np.atleast_2d(parameters)
+    an = parameters[:, 2] + 1j*parameters[:, 3]
+    return parameters[:, 0], np.abs(parameters[:, 1]), np.abs(an), np.angle(an)
+
+
+def fit_region(groups, peak_number=0, selection=None, region=None):
+    """
+    Fit the geometric circle and the SDOF peak to each group of channels.
+
+    Only uses numpy, so it can run in a worker thread.
+
+    Parameters
+    ----------
+    groups : list
+        A tuple for each group of channels that share a frequency axis:
+        (channel_numbers, omega, transfer_function, transfer_function_type,
+        parameters0). *transfer_function* has dimension (channels x points)
+        and *parameters0* is the warm start for :func:`sdof_fit`.
+    peak_number : int
+        The peak being fitted, passed through to the result.
+    selection : int
+        The selection of channels that *groups* were taken from, passed
+        through to the result.
+    region : tuple
+        The bounds of the region fitted, passed through to the result.
+
+    Returns
+    -------
+    dict
+        The *peak_number*, *selection* and *region*, and a tuple
+        (channel_numbers, circle, parameters) for each group in *groups*.
+        Groups that failed to fit are left out.
+    """
+    results = []
+    for (channel_numbers, omega, transfer_function, transfer_function_type,
+         parameters0) in groups:
+        try:
+            # Recalculate the geometric circle fit of every channel
+            circle = fit_circle_to_data(transfer_function.real,
+                                        transfer_function.imag)
+        except:
+            print("Error in fitting geometric circle.")
+            traceback.print_exc()
+            continue
+
+        # Recalculate the parameters
+        try:
+            parameters, cost = sdof_fit(omega, transfer_function, circle,
+                                        transfer_function_type,
+                                        parameters0=parameters0)
+        except:
+            print("Error in calculating parameters.")
+            traceback.print_exc()
+            continue
+        results.append((channel_numbers, circle, parameters))
+    return {"peak_number": peak_number, "selection": selection,
+            "region": region, "groups": results}
+
+
+class FitScheduler(QObject):
+    """
+    Runs fits in a worker thread, one at a time.
+
+    A request made while a fit is running replaces any request that is still
+    waiting, so only the latest request is fitted next and the intermediate
+    ones are dropped.
+
+    Attributes
+    ----------
+    fit_function : callable
+        The function called with the arguments of each request.
+    completed : int
+        The number of the last fit completed.
+    sig_fit_done : pyqtSignal(object, int)
+        The signal emitted with the return value of *fit_function* and the
+        number of the fit, counting in the order the fits complete. It is
+        emitted from the worker thread, so connected slots run in the thread
+        of their object.
+    """
+    sig_fit_done = pyqtSignal(object, int)
+
+    def __init__(self, fit_function, parent=None):
+        super().__init__(parent)
+        self.fit_function = fit_function
+        self.completed = 0
+        self._pending = None
+        self._running = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def request(self, *args, **kwargs):
+        """Fit with the given arguments as soon as the worker is free."""
+        with self._condition:
+            self._pending = (args, kwargs)
+            self._condition.notify()
+
+    def is_busy(self):
+        """Return whether a fit is running or waiting to run."""
+        with self._condition:
+            return self._running or self._pending is not None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._pending is None:
+                    self._condition.wait()
+                args, kwargs = self._pending
+                self._pending = None
+                self._running = True
+            try:
+                result = self.fit_function(*args, **kwargs)
+            except:
+                print("Error in fitting.")
+                traceback.print_exc()
+                result = None
+            with self._condition:
+                self._running = False
+                if result is not None:
+                    self.completed += 1
+                    number = self.completed
+            if result is not None:
+                self.sig_fit_done.emit(result, number)
+
+
 class CircleFitWidget(QWidget):
     def __init__(self, parent=None):
         super().__init__()
@@ -91,6 +459,20 @@ class CircleFitWidget(QWidget):
         self.transfer_function = np.zeros(1)
         self.channels = []
         self.current_peak = 0
+        # The geometric circle of each channel and the fitted parameters of
+        # each peak, to warm start the next fit
+        self.circles = []
+        self.fit_parameters = {}
+        self.groups = []
+        # Counts the selections of channels, to drop the fits of earlier ones
+        self.selection = 0
+        self.show_constructed_transfer_function = True
+        # Whether to fit the transfer functions computed with the zoom FFT
+        self.use_zoom = False
+
+        # Region changes are fitted in a worker thread
+        self.fit_scheduler = FitScheduler(fit_region, self)
+        self.fit_scheduler.sig_fit_done.connect(self.update_from_fit)
 
         self._init_ui()
 
@@ -105,7 +487,7 @@ class CircleFitWidget(QWidget):
         self.transfer_function_plot = \
             self.transfer_function_plotwidget.getPlotItem()
 
-        self.transfer_function_plotwidget.sig_region_changed.connect(self.update_from_region)
+        self.transfer_function_plotwidget.sig_region_changed.connect(self.schedule_update_from_region)
 
         # # Nyquist plot
         self.nyquist_plotwidget = \
@@ -128,10 +510,8 @@ class CircleFitWidget(QWidget):
         # The item for the raw transfer function
         self.transfer_function_list = []
 
-        # The item for the reconstructed transfer function
-        self.constructed_transfer_function = \
-            pg.PlotDataItem(pen=pg.mkPen(width=3, style=Qt.DashLine))
-        self.transfer_function_plot.addItem(self.constructed_transfer_function)
+        # The items for the reconstructed transfer functions
+        self.constructed_transfer_function_list = []
 
         # The item for the fitted peaks
         self.peaks = []
@@ -142,6 +522,17 @@ class CircleFitWidget(QWidget):
         # The item for the fitted circles
         self.nyquist_plot_peaks_list = []
 
+        # # Stabilisation diagram
+        self.stabilisation_plotwidget = \
+            pg.PlotWidget(parent=self,
+                          title="Stabilisation diagram",
+                          labels={'bottom': ("Frequency", "Hz"),
+                                  'left': ("Model order")})
+        self.stabilisation_plot = self.stabilisation_plotwidget.getPlotItem()
+        self.stabilisation_plot.setXLink(self.transfer_function_plot)
+        self.stabilisation_plot.showGrid(x=True, y=True)
+        self.stabilisation_plotwidget.hide()
+
         # # Table of results
         self.results = CircleFitResults(self)
         self.results.sig_selected_peak_changed.connect(self.set_current_peak)
@@ -152,84 +543,229 @@ class CircleFitWidget(QWidget):
         # # Widget layout
         layout = QGridLayout()
         layout.addWidget(self.transfer_function_plotwidget, 0, 0, 1, 2)
-        layout.addWidget(self.results, 1, 0)
-        layout.addWidget(self.nyquist_plotwidget, 1, 1)
+        layout.addWidget(self.stabilisation_plotwidget, 1, 0, 1, 2)
+        layout.addWidget(self.results, 2, 0)
+        layout.addWidget(self.nyquist_plotwidget, 2, 1)
         self.setLayout(layout)
 
         self.setWindowTitle('Circle fit')
         self.show()
 
     # ----------------------------- Update functions --------------------------
-    def update_from_region(self, region_lower_bound, region_upper_bound):
+    def set_use_zoom(self, use_zoom):
+        """Set whether the transfer functions computed in a band with the
+        zoom FFT are fitted, instead of the full transfer functions. Takes
+        effect when the channels are next selected."""
+        self.use_zoom = use_zoom
+
+    def dataset_id(self, id_):
+        """Return the id of the DataSet fitted for *id_*: the zoomed DataSet
+        if :attr:`use_zoom`."""
+        if self.use_zoom:
+            return "zoom_" + id_
+        return id_
+
+    def build_channel_groups(self):
+        """Group the channels by transfer function type and frequency axis,
+        so that each group can be fitted at once, and keep the stacked
+        transfer functions of each group."""
+        groups = {}
         for i, channel in enumerate(self.channels):
-            self.freq = channel.data("frequency")
-            self.omega = channel.data("omega")
-            self.transfer_function = channel.data("transfer_function")
-            self.transfer_function_type = channel.transfer_function_type
-
-            f_in_region = (self.freq >= region_lower_bound) \
-                              & (self.freq <= region_upper_bound)
-
-            self.omega_reg = np.extract(f_in_region, self.omega)
-            self.transfer_function_reg = np.extract(f_in_region, self.transfer_function)
-
-            try:
-                # Recalculate the geometric circle fit
-                self.x0, self.y0, self.R0 = fit_circle_to_data(self.transfer_function_reg.real,
-                                                               self.transfer_function_reg.imag)
-            except:
-                print("Error in fitting geometric circle.")
-                traceback.print_exc()
-            # Recalculate the parameters
-            try:
-                wn, zn, an, phi = self.sdof_get_parameters()
-
-                # Update the results table
-                self.results.set_omega(self.current_peak, i, wn)
-                self.results.set_damping(self.current_peak, i, zn)
-                self.results.set_amplitude(self.current_peak, i, an)
-                self.results.set_phase_rad(self.current_peak, i, phi)
-
-#                print("Calculated: wn {}, zn {}, an {}, phi {}".format(wn, zn, an, phi))
-
-            except:
-                print("Error in calculating parameters.")
-                traceback.print_exc()
-
-            wn = self.results.get_omega(self.current_peak, i)
-            zn = self.results.get_damping(self.current_peak, i)
-            an = self.results.get_amplitude(self.current_peak, i)
-            phi = self.results.get_phase_rad(self.current_peak, i)
-
-#            print("Plotting: wn {}, zn {}, an {}, phi {}".format(wn, zn, an, phi))
-
-
-            # Update the peak
-            w_fit = np.linspace(self.omega.min(), self.omega.max(), self.omega.size*10)
-            peak = sdof_modal_peak(w_fit, wn, zn, an, phi)
-            self.peaks[i].setData(w_fit / (2*np.pi), to_dB(np.abs(peak)))
-
-            peak_with_residuals = self.sdof_peak_with_offset(self.omega, wn, zn, an, phi)
-            self.nyquist_plot_peaks_list[i].setData(peak_with_residuals.real, peak_with_residuals.imag)
-
-            # Update what is displayed on the nyquist plot
-            self.nyquist_plot_list[i].setData(self.transfer_function_reg.real, self.transfer_function_reg.imag)
+            freq = channel.data(self.dataset_id("frequency"))
+            key = (channel.transfer_function_type, freq.size,
+                   freq[0] if freq.size else None,
+                   freq[-1] if freq.size else None)
+            groups.setdefault(key, []).append(i)
+
+        self.groups = []
+        for channel_numbers in groups.values():
+            channel = self.channels[channel_numbers[0]]
+            omega = channel.data(self.dataset_id("omega"))
+            transfer_function_id = self.dataset_id("transfer_function")
+            transfer_function = \
+                np.array([self.channels[i].data(transfer_function_id)
+                          for i in channel_numbers])
+            self.groups.append({"channel_numbers": channel_numbers,
+                                "freq": channel.data(self.dataset_id("frequency")),
+                                "omega": omega,
+                                "transfer_function": transfer_function,
+                                "transfer_function_type": channel.transfer_function_type,
+                                "w_fit": omega[:0],
+                                "region": None,
+                                "region_slice": slice(0, 0)})
+
+    def channel_groups(self):
+        """Return the indices of the channels grouped by transfer function
+        type and frequency axis, so that each group can be fitted at once."""
+        return [group["channel_numbers"] for group in self.groups]
+
+    def region_slice(self, group, region_lower_bound, region_upper_bound):
+        """Return the slice of the frequency lines of the *group* in the
+        region. The slice, and the high resolution omega of the region for
+        plotting the peaks, are kept until the region changes."""
+        region = (region_lower_bound, region_upper_bound)
+        if group["region"] != region:
+            freq = group["freq"]
+            group["region_slice"] = \
+                slice(np.searchsorted(freq, region_lower_bound, 'left'),
+                      np.searchsorted(freq, region_upper_bound, 'right'))
+            group["region"] = region
+            omega_reg = group["omega"][group["region_slice"]]
+            if omega_reg.size:
+                group["w_fit"] = np.linspace(omega_reg.min(), omega_reg.max(),
+                                             omega_reg.size*10)
+            else:
+                group["w_fit"] = omega_reg
+        return group["region_slice"]
+
+    def region_bounds(self, region_lower_bound=None, region_upper_bound=None):
+        """Return the bounds of the region, by default the region selected
+        on the transfer function plot."""
+        if region_lower_bound is None or region_upper_bound is None:
+            region_lower_bound, region_upper_bound = \
+                self.transfer_function_plotwidget.getRegionBounds()
+        return region_lower_bound, region_upper_bound
+
+    def region_fit_groups(self, region_lower_bound=None,
+                          region_upper_bound=None):
+        """Return the arguments of :func:`fit_region` for the current peak
+        in the region, warm started from the previous fit of the peak."""
+        region_lower_bound, region_upper_bound = \
+            self.region_bounds(region_lower_bound, region_upper_bound)
+
+        previous_fit = self.fit_parameters.get(self.current_peak)
+        if previous_fit is None or previous_fit.shape[0] != len(self.channels):
+            previous_fit = np.full((len(self.channels), 4), np.nan)
+
+        fit_groups = []
+        for group in self.groups:
+            region = self.region_slice(group, region_lower_bound,
+                                       region_upper_bound)
+            omega_reg = group["omega"][region]
+            if omega_reg.size < 4:
+                print("Not enough points in the region to fit a peak.")
+                continue
+
+            # Only warm start from fits of peaks in this region
+            channel_numbers = group["channel_numbers"]
+            warm = previous_fit[channel_numbers]
+            warm[(warm[:, 0] < omega_reg.min())
+                 | (warm[:, 0] > omega_reg.max())] = np.nan
+
+            fit_groups.append((channel_numbers, omega_reg,
+                               group["transfer_function"][:, region],
+                               group["transfer_function_type"], warm))
+        return fit_groups
+
+    def update_from_region(self, region_lower_bound=None,
+                           region_upper_bound=None):
+        """Fit the current peak in every channel to the data in the region,
+        warm starting from the previous fit of the peak."""
+        region = self.region_bounds(region_lower_bound, region_upper_bound)
+        self.update_from_fit(fit_region(self.region_fit_groups(*region),
+                                        self.current_peak, self.selection,
+                                        region))
+
+    def schedule_update_from_region(self, region_lower_bound=None,
+                                    region_upper_bound=None):
+        """Fit the current peak in the region in the worker thread, dropping
+        any region change that has not been fitted yet."""
+        region = self.region_bounds(region_lower_bound, region_upper_bound)
+        self.fit_scheduler.request(self.region_fit_groups(*region),
+                                   self.current_peak, self.selection, region)
+
+    def update_from_fit(self, fit, number=None):
+        """Show the results of :func:`fit_region` in the results table and
+        the plots. *number* is the number of the fit given by the
+        :attr:`fit_scheduler`, if it was fitted in the worker thread."""
+        # Skip results if a newer one has completed, as it is drawn next
+        if number is not None and number < self.fit_scheduler.completed:
+            return
+        # Skip results fitted for channels that are no longer selected
+        if fit.get("selection", self.selection) != self.selection:
+            return
+        peak_number = fit["peak_number"]
+        previous_fit = self.fit_parameters.get(peak_number)
+        if previous_fit is None or previous_fit.shape[0] != len(self.channels):
+            previous_fit = np.full((len(self.channels), 4), np.nan)
+
+        for channel_numbers, circle, parameters in fit["groups"]:
+            previous_fit[channel_numbers] = parameters
+            wn, zn, an, phi = sdof_modal_parameters(parameters)
+
+            # Update the results table
+            for j, i in enumerate(channel_numbers):
+                self.results.set_omega(peak_number, i, wn[j])
+                self.results.set_damping(peak_number, i, zn[j])
+                self.results.set_amplitude(peak_number, i, an[j])
+                self.results.set_phase_rad(peak_number, i, phi[j])
+                self.circles[i] = (circle[0][j], circle[1][j], circle[2][j])
+
+        self.fit_parameters[peak_number] = previous_fit
+        self.update_plots(peak_number, fit.get("region"))
+
+    def update_plots(self, peak_number=None, region_bounds=None):
+        """Plot the peak in every channel in the region with the values in
+        the results table, and the data in the region on the Nyquist plot.
+        The region defaults to the last one fitted."""
+        if peak_number is None:
+            peak_number = self.current_peak
+
+        for group in self.groups:
+            self.freq = group["freq"]
+            self.omega = group["omega"]
+            self.transfer_function_type = group["transfer_function_type"]
+            if region_bounds is None:
+                region = group["region_slice"]
+            else:
+                region = self.region_slice(group, *region_bounds)
+            w_fit = group["w_fit"]
+            for j, i in enumerate(group["channel_numbers"]):
+                if self.circles[i] is None:
+                    continue
+                wn = self.results.get_omega(peak_number, i)
+                zn = self.results.get_damping(peak_number, i)
+                an = self.results.get_amplitude(peak_number, i)
+                phi = self.results.get_phase_rad(peak_number, i)
+
+                # Update the peak
+                peak = sdof_modal_peak(w_fit, wn, zn, an, phi)
+                self.peaks[i].setData(w_fit / (2*np.pi), to_dB(np.abs(peak)))
+
+                peak_with_residuals = \
+                    sdof_peak_with_offset(w_fit, wn, zn, an, phi,
+                                          self.circles[i],
+                                          self.transfer_function_type)
+                self.nyquist_plot_peaks_list[i].setData(peak_with_residuals.real,
+                                                        peak_with_residuals.imag)
+
+                # Update what is displayed on the nyquist plot
+                transfer_function_reg = group["transfer_function"][j, region]
+                self.nyquist_plot_list[i].setData(transfer_function_reg.real,
+                                                  transfer_function_reg.imag)
 
-            self.nyquist_plot.autoRange()
+        self.nyquist_plot.autoRange()
 
     def update_from_table(self):
         for i, channel in enumerate(self.channels):
+            if self.circles[i] is None:
+                continue
+            freq = channel.data(self.dataset_id("frequency"))
+            omega = channel.data(self.dataset_id("omega"))
             wn = self.results.get_omega(self.current_peak, i)
             zn = self.results.get_damping(self.current_peak, i)
             an = self.results.get_amplitude(self.current_peak, i)
             phi = self.results.get_phase_rad(self.current_peak, i)
 
             # Update the peak
-            peak = sdof_modal_peak(self.omega, wn, zn, an, phi)
-            self.peaks[i].setData(self.freq, to_dB(np.abs(peak)))
+            peak = sdof_modal_peak(omega, wn, zn, an, phi)
+            self.peaks[i].setData(freq, to_dB(np.abs(peak)))
 
-            peak_with_residuals = self.sdof_peak_with_offset(self.omega, wn, zn, an, phi)
-            self.nyquist_plot_peaks_list[i].setData(peak_with_residuals.real, peak_with_residuals.imag)
+            peak_with_residuals = \
+                sdof_peak_with_offset(omega, wn, zn, an, phi, self.circles[i],
+                                      channel.transfer_function_type)
+            self.nyquist_plot_peaks_list[i].setData(peak_with_residuals.real,
+                                                    peak_with_residuals.imag)
 
     def refresh_nyquist_plot(self):
         """Clear the nyquist plot and add the items back in."""
@@ -247,7 +783,8 @@ class CircleFitWidget(QWidget):
         """Clear the transfer function plot and add the items back in."""
         self.transfer_function_plotwidget.clear()
 
-        self.transfer_function_plot.addItem(self.constructed_transfer_function)
+        for item in self.constructed_transfer_function_list:
+            self.transfer_function_plot.addItem(item)
 
         for item in self.transfer_function_list:
             self.transfer_function_plot.addItem(item)
@@ -257,92 +794,6 @@ class CircleFitWidget(QWidget):
 
         self.transfer_function_plot.autoRange()
 
-    #------------------------------- Fitting functions ------------------------
-    def sdof_get_parameters(self):
-        """Fit a SDOF peak to the data with a least squares fit, using values
-        from the current peak as a first guess."""
-        # # Find initial parameters for curve fitting
-        # Find where the peak is - the maximum magnitude of the amplitude
-        # within the region
-        i = np.where(np.abs(self.transfer_function_reg) == np.abs(self.transfer_function_reg).max())[0][0]
-        # Take the frequency at the max amplitude as a
-        # first resonant frequency guess
-        wn0 = self.omega_reg[i]
-
-        # First guess of damping factor
-        zn0 = 0.01
-
-        # Method using -3dB points (only works for well separated peaks)
-#        greater_than_3dB = np.abs(self.transfer_function_reg) > np.abs(self.transfer_function_reg.max()) - from_dB(3)
-#        index_greater_than_3dB = np.where(greater_than_3dB)[0]
-#        index_lower_3dB = index_greater_than_3dB[0] - 1
-#        index_upper_3dB = index_greater_than_3dB[-1] + 1
-#        lower_3dB = self.transfer_function_reg[index_lower_3dB]
-#        upper_3dB = self.transfer_function_reg[index_upper_3dB]
-#
-#        bandwidth = self.omega_reg[index_upper_3dB] - self.omega_reg[index_lower_3dB]
-#
-#        zn0 = bandwidth / (2*wn0)
-
-        # First guess of modal amplitude
-        if self.transfer_function_type == 'displacement':
-            an0 = self.transfer_function_reg[i] * 2*zn0*wn0**2
-        if self.transfer_function_type == 'velocity':
-            an0 = self.transfer_function_reg[i] * 2*zn0*wn0
-        if self.transfer_function_type == 'acceleration':
-            an0 = self.transfer_function_reg[i] * 2*zn0
-#        an0 = self.transfer_function_reg[i]
-
-        parameters0 = [wn0, zn0, an0.real, an0.imag]
-
-        result = so.minimize(self.error_function, parameters0, method='nelder-mead', options={'disp':True})
-#        result = \
-#            so.minimize(self.error_function, parameters0, method='SLSQP',
-#                        bounds=[(self.omega_reg.min(), self.omega_reg.max()),
-#                                (0, None),
-#                                (None, None),
-#                                (None, None)], options={'disp':True})
-
-#        an = an_real + 1j*an_imag
-#        phi = np.angle(an)
-        wn, zn, an_real, an_imag = result.x
-        an = an_real + an_imag
-
-        print(wn, np.abs(zn), np.abs(an), np.angle(an))
-        return wn, np.abs(zn), np.abs(an), np.angle(an)
-
-    def error_function(self, parameters):
-        """The error function for least squares fitting."""
-        wn = parameters[0]
-        zn = np.abs(parameters[1])
-        an_real = parameters[2]
-        an_imag = parameters[3]
-        an = an_real + an_imag
-        phi = np.angle(an)
-
-#        if an < 0:
-#            an *= -1
-#            phi = (phi+np.pi) % np.pi
-
-        f = self.sdof_peak_with_offset(self.omega_reg, wn, zn, an, phi)\
-            - self.transfer_function_reg
-#        return np.sum((f*f.conj()).real)
-        return np.sum(f.real**2 + f.imag**2)
-
-    def sdof_peak_with_offset(self, w, wn, zn, an, phi):
-        """An SDOF modal peak fitted to the data using the geometric circle."""
-        if self.transfer_function_type == 'displacement':
-            return self.x0 + 1j*self.y0 - self.R0*np.exp(1j*(phi - np.pi/2))\
-                + sdof_modal_peak(w, wn, zn, an, phi)
-
-        if self.transfer_function_type == 'velocity':
-            return self.x0 + 1j*self.y0 - self.R0*np.exp(1j*phi)\
-                + 1j*w*sdof_modal_peak(w, wn, zn, an, phi)
-
-        if self.transfer_function_type == 'acceleration':
-            return self.x0 + 1j*self.y0 - self.R0*np.exp(1j*(phi + np.pi/2))\
-                -w**2*sdof_modal_peak(w, wn, zn, an, phi)
-
     #------------------------- Interface functions ----------------------------
     def set_selected_channels(self, selected_channels):
         """Update which channels are plotted."""
@@ -351,24 +802,29 @@ class CircleFitWidget(QWidget):
         # Need to check that the dataset exists, then check if there's data in it
         if selected_channels:
             for channel in selected_channels:
-                if channel.is_dataset("transfer_function"):
+                if channel.is_dataset(self.dataset_id("transfer_function")):
                     self.channels.append(channel)
 
         self.results.channels = self.channels
+        self.circles = [None] * len(self.channels)
+        self.fit_parameters = {}
+        self.selection += 1
+        self.build_channel_groups()
 
         # # Populate the plot lists
         self.transfer_function_list = []
         self.nyquist_plot_list = []
         self.peaks = []
         self.nyquist_plot_peaks_list = []
+        self.constructed_transfer_function_list = []
         for channel in self.channels:
-            transfer_function = pg.PlotDataItem(channel.data("frequency"),
-                                                to_dB(np.abs(channel.data("transfer_function"))),
+            transfer_function = pg.PlotDataItem(channel.data(self.dataset_id("frequency")),
+                                                to_dB(np.abs(channel.data(self.dataset_id("transfer_function")))),
                                                 pen=channel.colour)
             self.transfer_function_list.append(transfer_function)
 
-            nyquist_plot = pg.PlotDataItem(channel.data("transfer_function").real,
-                                           channel.data("transfer_function").imag,
+            nyquist_plot = pg.PlotDataItem(channel.data(self.dataset_id("transfer_function")).real,
+                                           channel.data(self.dataset_id("transfer_function")).imag,
                                            pen=None,
                                            symbol='o',
                                            symbolPen=None,
@@ -379,6 +835,12 @@ class CircleFitWidget(QWidget):
             self.peaks.append(pg.PlotDataItem(pen='k'))
             self.nyquist_plot_peaks_list.append(pg.PlotDataItem(pen='k'))
 
+            constructed_transfer_function = \
+                pg.PlotDataItem(pen=pg.mkPen(channel.colour, width=3,
+                                             style=Qt.DashLine))
+            constructed_transfer_function.setVisible(self.show_constructed_transfer_function)
+            self.constructed_transfer_function_list.append(constructed_transfer_function)
+
         self.refresh_transfer_function_plot()
         self.refresh_nyquist_plot()
 
@@ -390,10 +852,139 @@ class CircleFitWidget(QWidget):
 
     def show_transfer_fn(self, visible=True):
         print("Setting transfer function visible to " + str(visible))
-        self.constructed_transfer_fn.setVisible(visible)
+        self.show_constructed_transfer_function = bool(visible)
+        for item in self.constructed_transfer_function_list:
+            item.setVisible(self.show_constructed_transfer_function)
 
     def construct_transfer_fn(self):
-        pass
+        """Plot the transfer function of each channel reconstructed from the
+        parameters of all the peaks in the results."""
+        for i, channel in enumerate(self.channels):
+            freq = channel.data(self.dataset_id("frequency"))
+            omega = channel.data(self.dataset_id("omega"))
+            constructed = np.zeros(omega.size, dtype=complex)
+            for peak_number in range(self.results.num_peaks):
+                if self.results.tree.topLevelItem(peak_number) is None:
+                    continue
+                wn = self.results.get_omega(peak_number, i)
+                zn = self.results.get_damping(peak_number, i)
+                an = self.results.get_amplitude(peak_number, i)
+                phi = self.results.get_phase_rad(peak_number, i)
+                if wn > 0:
+                    constructed += sdof_modal_peak(omega, wn, zn, an, phi)
+
+            if channel.transfer_function_type == 'velocity':
+                constructed *= 1j*omega
+            elif channel.transfer_function_type == 'acceleration':
+                constructed *= -omega**2
+
+            self.constructed_transfer_function_list[i].setData(freq,
+                                                               to_dB(np.abs(constructed)))
+
+    def identify_modes(self, max_order=40, min_stable_orders=5):
+        """Find all the modes in the region with the LSCF method, show the
+        stabilisation diagram, and replace the peaks in the results with the
+        modes that are stable for at least *min_stable_orders* orders."""
+        if not self.channels:
+            return
+        region_lower_bound, region_upper_bound = \
+            self.transfer_function_plotwidget.getRegionBounds()
+
+        # Find the poles from the largest group of channels that share a
+        # frequency axis
+        groups = sorted(self.groups, key=lambda group: len(group["channel_numbers"]),
+                        reverse=True)
+        freq = groups[0]["freq"]
+        if region_upper_bound <= region_lower_bound:
+            region_lower_bound, region_upper_bound = freq.min(), freq.max()
+
+        def in_band(group):
+            region = slice(np.searchsorted(group["freq"], region_lower_bound, 'left'),
+                           np.searchsorted(group["freq"], region_upper_bound, 'right'))
+            omega = group["omega"][region]
+            transfer_function = group["transfer_function"][:, region]
+            # Leave out DC
+            return omega[omega > 0], transfer_function[:, omega > 0]
+
+        try:
+            omega, transfer_function = in_band(groups[0])
+            poles = lscf(omega, transfer_function, max_order)
+            status, count = stabilisation(poles)
+            modes = select_poles(poles, count, min_stable_orders)
+        except:
+            print("Error in identifying the modes.")
+            traceback.print_exc()
+            return
+
+        self.plot_stabilisation_diagram(poles, status, modes)
+        if not modes.size:
+            print("No stable modes found.")
+            return
+
+        # Fit the modal constants of every channel
+        parameters = np.full((modes.size, len(self.channels), 4), np.nan)
+        for group in groups:
+            channel_numbers = group["channel_numbers"]
+            try:
+                omega, transfer_function = in_band(group)
+                wn, zn, an, phi = lsfd(omega, transfer_function, modes,
+                                       group["transfer_function_type"])
+            except:
+                print("Error in fitting the modal constants.")
+                traceback.print_exc()
+                continue
+            parameters[:, channel_numbers, 0] = wn[:, np.newaxis]
+            parameters[:, channel_numbers, 1] = zn[:, np.newaxis]
+            parameters[:, channel_numbers, 2] = (an*np.cos(phi)).T
+            parameters[:, channel_numbers, 3] = (an*np.sin(phi)).T
+
+        # Replace the peaks in the results
+        self.results.blockSignals(True)
+        self.results.clear()
+        self.fit_parameters = {}
+        for peak_number in range(modes.size):
+            self.results.new_peak()
+            wn, zn, an, phi = sdof_modal_parameters(parameters[peak_number])
+            for i in range(len(self.channels)):
+                if np.isfinite(wn[i]):
+                    self.results.set_omega(peak_number, i, wn[i])
+                    self.results.set_damping(peak_number, i, zn[i])
+                    self.results.set_amplitude(peak_number, i, an[i])
+                    self.results.set_phase_rad(peak_number, i, phi[i])
+            self.fit_parameters[peak_number] = parameters[peak_number]
+        self.results.blockSignals(False)
+        self.results.update_peak_average()
+        self.current_peak = modes.size - 1
+
+        self.update_from_table()
+        self.construct_transfer_fn()
+
+    def plot_stabilisation_diagram(self, poles, status, modes=None):
+        """Plot the *poles* at each model order, with symbols showing their
+        *status*, and mark the selected *modes*."""
+        self.stabilisation_plotwidget.clear()
+        symbols = {POLE_NEW: ('x', (150, 150, 150)),
+                   POLE_STABLE_FREQUENCY: ('t', (0, 0, 255)),
+                   POLE_STABLE: ('o', (0, 170, 0))}
+        for pole_status, (symbol, colour) in symbols.items():
+            frequency = []
+            order = []
+            for model_order in poles:
+                wn, zn = pole_frequency_damping(poles[model_order][status[model_order] == pole_status])
+                frequency.append(wn / (2*np.pi))
+                order.append(np.full(wn.size, model_order))
+            if frequency:
+                self.stabilisation_plot.addItem(
+                    pg.ScatterPlotItem(np.concatenate(frequency),
+                                       np.concatenate(order),
+                                       symbol=symbol, size=6, pen=None,
+                                       brush=pg.mkBrush(colour)))
+        if modes is not None:
+            for wn in pole_frequency_damping(modes)[0]:
+                self.stabilisation_plot.addItem(
+                    pg.InfiniteLine(wn / (2*np.pi), pen=pg.mkPen('r',
+                                                                 style=Qt.DashLine)))
+        self.stabilisation_plotwidget.show()
 
     def add_new_peak(self):
         lower, upper = self.transfer_function_plotwidget.getRegionBounds()
@@ -495,8 +1086,13 @@ class CircleFitResults(QGroupBox):
         self.setLayout(layout)
 
     def add_peak(self):
+        """Add a new peak to the tree and emit :attr:`sig_add_new_peak`."""
+        self.new_peak()
+        self.sig_add_new_peak.emit()
+
+    def new_peak(self):
         """Add a top-level item for a new peak to the tree, with children for
-        each channel."""
+        each channel, and return its number."""
         # Create the parent item for the peak
         peak_item = QTreeWidgetItem(self.tree,
                                     ["Peak {}".format(self.num_peaks),
@@ -583,7 +1179,13 @@ class CircleFitResults(QGroupBox):
 
         # Register that we've added another peak
         self.num_peaks += 1
-        self.sig_add_new_peak.emit()
+        return self.num_peaks - 1
+
+    def clear(self):
+        """Remove all the peaks."""
+        self.tree.clear()
+        self.autofit_tree.clear()
+        self.num_peaks = 0
 
     def delete_selected(self):
         """Delete the item that is currently selected."""
@@ -648,6 +1250,10 @@ class CircleFitResults(QGroupBox):
     def update_peak_average(self):
         """Set the parameter values displayed for the peak to the average of
         all the channel values for each parameter."""
+        # Skip while the results are being filled in all at once
+        if self.signalsBlocked():
+            return
+
         for peak_number in range(self.num_peaks):
             # Get the peak item
             peak_item = self.tree.topLevelItem(peak_number)
@@ -919,8 +1525,8 @@ class CircleFitToolbox(Toolbox):
 
     This Toolbox contains the tools for controlling the circle fit. It has
     two tabs: 'Transfer Function', for tools relating to the construction
-    of a transfer function, and 'Autofit Controls', which contains tools
-    for controlling how the circle is fit to the data.
+    of a transfer function, and 'Modal identification', which contains tools
+    for finding all the modes in the region at once.
 
     Attributes
     ----------
@@ -929,10 +1535,14 @@ class CircleFitToolbox(Toolbox):
     sig_show_transfer_fn : pyqtSignal(bool)
       The signal emitted when the visibility of the transfer function is
       changed. Format (visible).
+    sig_identify_modes : pyqtSignal(int, int)
+      The signal emitted when the modes are to be identified. Format
+      (max_order, min_stable_orders).
     """
 
     sig_construct_transfer_fn = pyqtSignal()
     sig_show_transfer_fn = pyqtSignal(bool)
+    sig_identify_modes = pyqtSignal(int, int)
 
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -942,6 +1552,7 @@ class CircleFitToolbox(Toolbox):
 
     def init_ui(self):
         self.init_transfer_function_tab()
+        self.init_modal_identification_tab()
 
     def init_transfer_function_tab(self):
         self.transfer_function_tab = QWidget()
@@ -963,6 +1574,37 @@ class CircleFitToolbox(Toolbox):
 
         self.addTab(self.transfer_function_tab, "Transfer function")
 
+    def init_modal_identification_tab(self):
+        self.modal_identification_tab = QWidget()
+        modal_identification_tab_layout = QGridLayout()
+
+        modal_identification_tab_layout.addWidget(QLabel("Maximum model order"), 0, 0)
+        self.max_order_spinbox = QSpinBox()
+        self.max_order_spinbox.setRange(2, 200)
+        self.max_order_spinbox.setValue(40)
+        modal_identification_tab_layout.addWidget(self.max_order_spinbox, 0, 1)
+
+        modal_identification_tab_layout.addWidget(QLabel("Minimum stable orders"), 1, 0)
+        self.min_stable_orders_spinbox = QSpinBox()
+        self.min_stable_orders_spinbox.setRange(1, 100)
+        self.min_stable_orders_spinbox.setValue(5)
+        modal_identification_tab_layout.addWidget(self.min_stable_orders_spinbox, 1, 1)
+
+        self.identify_modes_btn = QPushButton()
+        self.identify_modes_btn.setText("Identify modes in region")
+        self.identify_modes_btn.clicked.connect(self.identify_modes)
+        modal_identification_tab_layout.addWidget(self.identify_modes_btn, 2, 0, 1, 2)
+
+        self.modal_identification_tab.setLayout(modal_identification_tab_layout)
+        modal_identification_tab_layout.setColumnStretch(2, 1)
+        modal_identification_tab_layout.setRowStretch(3, 1)
+
+        self.addTab(self.modal_identification_tab, "Modal identification")
+
+    def identify_modes(self):
+        self.sig_identify_modes.emit(self.max_order_spinbox.value(),
+                                     self.min_stable_orders_spinbox.value())
+
 
 if __name__ == '__main__':
     CurrentWorkspace = Workspace()
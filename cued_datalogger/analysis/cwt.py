@@ -1,7 +1,27 @@
-import numpy as np
+"""
+Continuous wavelet transform, computed in the frequency domain.
 
-from scipy.signal import ricker, cwt
+The time series is transformed once, and multiplied by the spectra of the
+wavelets at all the scales at once, in blocks of scales, so the cost is one
+inverse FFT per scale instead of one convolution per scale. The wavelet
+spectra are cached. Long time series can be split into overlapping blocks of
+samples, so the size of the FFTs does not grow with the length of the record.
 
+The wavelets and their normalisation follow Torrence and Compo, "A Practical
+Guide to Wavelet Analysis" (1998). The 'ricker' wavelet gives the same values
+as a direct convolution with the Ricker (Mexican hat) wavelet, with widths in
+samples.
+
+Example:
+    | >>>scales = log_scales(2, 512, 200)
+    | >>>result = cwt(time_series, scales, wavelet='morlet')
+    | >>>frequencies = scale_to_frequency(scales, 'morlet') * sample_rate
+"""
+import numpy as np
+from scipy import fft
+from scipy.special import gamma, factorial
+
+from cued_datalogger.api.numpy_extensions import ArrayCache
 from cued_datalogger.api.pyqt_extensions import MatplotlibCanvas
 
 from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QSlider, QLabel, QSpinBox, QHBoxLayout, QGridLayout, QComboBox
@@ -29,10 +49,156 @@ plt.show()
 """
 
 
+WAVELETS = ['morlet', 'ricker', 'paul']
+# The default parameter of each wavelet: the non-dimensional frequency of
+# the Morlet wavelet, the derivative of the Gaussian for the Ricker wavelet
+# (which is the second derivative), and the order of the Paul wavelet
+WAVELET_PARAMETERS = {'morlet': 6, 'ricker': 2, 'paul': 4}
+
+_kernel_cache = ArrayCache(64*2**20)
+
+
+def log_scales(min_scale, max_scale, num_scales):
+    """Return *num_scales* logarithmically spaced scales from *min_scale*
+    to *max_scale*."""
+    return np.geomspace(min_scale, max_scale, num_scales)
+
+
+def scale_to_frequency(scales, wavelet='morlet', param=None):
+    """Return the Fourier frequency corresponding to each of the *scales* of
+    *wavelet*, in cycles per unit of the scales."""
+    if param is None:
+        param = WAVELET_PARAMETERS[wavelet]
+    scales = np.asarray(scales, dtype=np.float64)
+    if wavelet == 'morlet':
+        return (param + np.sqrt(2 + param**2)) / (4*np.pi*scales)
+    elif wavelet == 'ricker':
+        return np.sqrt(param + 0.5) / (2*np.pi*scales)
+    elif wavelet == 'paul':
+        return (2*param + 1) / (4*np.pi*scales)
+    raise ValueError("'wavelet' must be one of {}".format(WAVELETS))
+
+
+def wavelet_spectrum(wavelet, scales, omega, param=None, dt=1):
+    """Return the spectra of *wavelet* at *scales* at the non-negative
+    angular frequencies *omega*, normalised to unit energy, with dimension
+    (scales x frequencies)."""
+    if param is None:
+        param = WAVELET_PARAMETERS[wavelet]
+    s_omega = np.outer(scales, omega)
+    norm = np.sqrt(2*np.pi*np.asarray(scales) / dt).reshape((-1, 1))
+    if wavelet == 'morlet':
+        spectrum = np.pi**-0.25 * np.exp(-(s_omega - param)**2 / 2)
+        spectrum[:, omega <= 0] = 0
+    elif wavelet == 'ricker':
+        # Derivative of Gaussian, real for even derivatives
+        spectrum = (-(1j**param)).real / np.sqrt(gamma(param + 0.5)) * \
+            s_omega**param * np.exp(-s_omega**2 / 2)
+    elif wavelet == 'paul':
+        spectrum = 2**param / np.sqrt(param * factorial(2*param - 1)) * \
+            s_omega**param * np.exp(-s_omega)
+        spectrum[:, omega <= 0] = 0
+    else:
+        raise ValueError("'wavelet' must be one of {}".format(WAVELETS))
+    return spectrum * norm
+
+
+def _cached_wavelet_spectrum(wavelet, scales, n_fft, param, dt):
+    key = (wavelet, scales.tobytes(), n_fft, param, dt)
+    spectrum = _kernel_cache.get(key)
+    if spectrum is None:
+        omega = 2*np.pi*np.arange(n_fft//2 + 1) / (n_fft*dt)
+        spectrum = wavelet_spectrum(wavelet, scales, omega, param,
+                                    dt).astype(np.float32)
+        _kernel_cache.put(key, spectrum)
+    return spectrum
+
+
+def cwt(time_series, scales, wavelet='morlet', param=None, dt=1,
+        block_size=None, out=None, scale_block_size=None):
+    """Compute the continuous wavelet transform of the real *time_series*.
+
+    Parameters
+    ----------
+    time_series : ndarray
+        The real 1d time series.
+    scales : ndarray
+        The scales of the wavelet, in the units of *dt*. See
+        :func:`log_scales`.
+    wavelet : str
+        One of :data:`WAVELETS`.
+    param : float, optional
+        The parameter of the wavelet. See :data:`WAVELET_PARAMETERS`.
+    dt : float
+        The sample period of the time series.
+    block_size : int, optional
+        Split the time series into blocks of *block_size* samples, which
+        overlap by the support of the largest wavelet. Defaults to the whole
+        time series.
+    out : ndarray, optional
+        The array to write the output to, with dimension (scales x samples),
+        eg. a memory-mapped array.
+    scale_block_size : int, optional
+        The number of scales transformed at once. Defaults to about 8M
+        points per block.
+
+    Returns
+    -------
+    ndarray
+        The transform, with dimension (scales x samples). It is complex64
+        for the 'morlet' and 'paul' wavelets and float32 for the 'ricker'
+        wavelet.
+    """
+    if not wavelet in WAVELETS:
+        raise ValueError("'wavelet' must be one of {}".format(WAVELETS))
+    if param is None:
+        param = WAVELET_PARAMETERS[wavelet]
+    time_series = np.asarray(time_series)
+    scales = np.asarray(scales, dtype=np.float64).ravel()
+    num_samples = time_series.size
+    # The even derivatives of Gaussians give a real transform of real data
+    is_real = (wavelet == 'ricker' and param % 2 == 0)
+
+    if out is None:
+        out = np.empty((scales.size, num_samples),
+                       dtype=np.float32 if is_real else np.complex64)
+
+    # Pad by the support of the largest wavelet, to avoid wrapping around
+    pad = int(np.ceil(4 * np.sqrt(2) * scales.max() / dt)) if scales.size else 0
+    if block_size is None or block_size >= num_samples:
+        block_size = num_samples
+    n_fft = fft.next_fast_len(block_size + 2*pad)
+    if scale_block_size is None:
+        scale_block_size = max(2**23 // n_fft, 1)
+
+    for start in range(0, num_samples, block_size):
+        stop = min(start + block_size, num_samples)
+        # Include the samples that the wavelets overlap at each side
+        lo = max(start - pad, 0)
+        hi = min(stop + pad, num_samples)
+        # Single precision is enough for the output, and twice as fast
+        x = fft.rfft(time_series[lo:hi].astype(np.float32), n_fft)
+        for s in range(0, scales.size, scale_block_size):
+            block_scales = scales[s:s+scale_block_size]
+            kernel = _cached_wavelet_spectrum(wavelet, block_scales, n_fft,
+                                              param, dt)
+            product = x * kernel
+            if is_real:
+                result = fft.irfft(product, n_fft, axis=1, workers=-1)
+            else:
+                # Analytic wavelets have no negative frequencies
+                result = fft.ifft(product, n_fft, axis=1, workers=-1)
+            out[s:s+block_scales.size, start:stop] = \
+                result[:, start-lo:stop-lo]
+    return out
+
+
 class CWTPlotWidget(MatplotlibCanvas):
-    """A MatplotlibCanvas widget displaying the CWT plot"""
+    """A MatplotlibCanvas widget displaying the CWT plot.
+    The *widths* of the wavelet are in samples. The CWT is only recalculated
+    when the wavelet or the widths change."""
     
-    def __init__(self, sig, t, widths, wavelet=ricker, plot_type="Colourmap",
+    def __init__(self, sig, t, widths, wavelet='ricker', plot_type="Colourmap",
                  num_contours=5, contour_spacing_dB=5):
         self.sig = sig
         self.t = t
@@ -41,6 +207,7 @@ class CWTPlotWidget(MatplotlibCanvas):
         self.plot_type = plot_type
         self.num_contours = num_contours
         self.contour_spacing_dB = contour_spacing_dB
+        self.cwt_key = None
         
         MatplotlibCanvas.__init__(self, "Continuous Wavelet Transform")
         
@@ -93,6 +260,9 @@ class CWTPlotWidget(MatplotlibCanvas):
         if sender_name == "plot_type_combobox":
             self.plot_type = value
         
+        elif sender_name == "wavelet_combobox":
+            self.wavelet = value.lower()
+        
         elif sender_name == "contour_spacing_spinbox" or sender_name == "contour_spacing_slider":
             self.contour_spacing_dB = value
             
@@ -109,8 +279,16 @@ class CWTPlotWidget(MatplotlibCanvas):
         self.draw_plot()
     
     def calculate_cwt(self):
-        """Recalculate the CWT"""
-        self.cwt_result = cwt(self.sig, self.wavelet, self.widths)
+        """Recalculate the CWT, if the wavelet or the widths have changed.
+        The magnitude is used for the complex wavelets."""
+        key = (self.wavelet, np.asarray(self.widths).tobytes())
+        if key == self.cwt_key:
+            return
+        result = cwt(self.sig, self.widths, self.wavelet)
+        if np.iscomplexobj(result):
+            result = np.abs(result)
+        self.cwt_result = result
+        self.cwt_key = key
 
         self.T, self.W = np.meshgrid(self.t, self.widths)
 
@@ -147,6 +325,17 @@ class CWTWidget(QWidget):
         # Update on change
         self.plot_type_combobox.activated[str].connect(self.cwt_plot.update_attributes)        
         
+        #------------Wavelet controls------------
+        self.wavelet_label = QLabel(self)
+        self.wavelet_label.setText("Wavelet")
+        # Create combobox
+        self.wavelet_combobox = QComboBox(self)
+        self.wavelet_combobox.addItems([w.capitalize() for w in WAVELETS])
+        self.wavelet_combobox.setCurrentText(self.cwt_plot.wavelet.capitalize())
+        self.wavelet_combobox.setObjectName("wavelet_combobox")
+        # Update on change
+        self.wavelet_combobox.activated[str].connect(self.cwt_plot.update_attributes)
+        
         #------------Contour spacing controls------------
         self.contour_spacing_label = QLabel(self)
         self.contour_spacing_label.setText("Contour spacing")
@@ -196,6 +385,8 @@ class CWTWidget(QWidget):
         
         cwt_controls = QGridLayout()
         cwt_controls.addWidget(self.cwt_controls_label, 0, 0)
+        cwt_controls.addWidget(self.wavelet_label, 1, 0)
+        cwt_controls.addWidget(self.wavelet_combobox, 1, 1)
         
         # Plot controls:
         self.plot_controls_label = QLabel(self)
@@ -1,14 +1,20 @@
 from cued_datalogger.api.pyqtgraph_extensions import InteractivePlotWidget
 from cued_datalogger.api.toolbox import Toolbox
-from cued_datalogger.api.numpy_extensions import to_dB
 from cued_datalogger.api.channel import Channel
+from cued_datalogger.api.numpy_extensions import stack_rows
+from cued_datalogger.api.executor import AnalysisExecutor, AnalysisCancelled
+from cued_datalogger.analysis.spectral_averaging import (welch_spectra_columns,
+                                                         transfer_function,
+                                                         coherence,
+                                                         WINDOW_FUNCTIONS,
+                                                         TRANSFER_FUNCTION_ESTIMATORS)
 
 from PyQt5.QtWidgets import (QWidget, QGridLayout, QPushButton, QComboBox,
-                             QCheckBox, QLabel, QGroupBox)
+                             QCheckBox, QLabel, QGroupBox, QSpinBox)
 from PyQt5.QtCore import pyqtSignal
 
 import numpy as np
-from numpy.fft import rfft
+import pyqtgraph as pg
 
 
 class FrequencyDomainWidget(InteractivePlotWidget):
@@ -26,12 +32,37 @@ class FrequencyDomainWidget(InteractivePlotWidget):
         displayed.
     show_coherence : bool
         If `True`, coherence is also plotted on the axes.
+    segment_length : int
+        The number of samples in each segment averaged for the spectra and
+        transfer functions. 0 to use the whole record, which keeps the
+        phase of the spectra. Averaged spectra are amplitude spectra.
+    overlap : float
+        The fraction of a segment shared with the next segment.
+    window : str
+        The window applied to each segment.
+    estimator : str
+        Any of 'H1', 'H2', 'Hv'. The transfer function estimator.
+    zoom : bool
+        If `True`, the spectra and transfer functions are computed and
+        plotted only in the band of the region, with the zoom FFT.
+    zoom_points : int
+        The number of frequencies in the band of the zoom FFT.
+    executor : :class:`~cued_datalogger.api.executor.AnalysisExecutor`
+        Runs the calculations for the channels in parallel.
     """
     def __init__(self, parent=None):
         super().__init__(parent)
 
         self.channels = []
 
+        self.segment_length = 0
+        self.overlap = 0.5
+        self.window = 'hann'
+        self.estimator = 'H1'
+        self.zoom = False
+        self.zoom_points = 1024
+        self.executor = AnalysisExecutor('serial', parent=self)
+
         self.plot_types = ['linear magnitude',
                            'log magnitude',
                            'phase',
@@ -39,6 +70,18 @@ class FrequencyDomainWidget(InteractivePlotWidget):
                            'imaginary part',
                            'nyquist']
         self.current_plot_type = self.plot_types[0]
+        # The derived quantities of the DataSets plotted on the x and y axes
+        # for each plot type, None for frequency
+        self.plot_quantities = {'linear magnitude': (None, 'magnitude'),
+                                'log magnitude': (None, 'dB'),
+                                'phase': (None, 'phase'),
+                                'real part': (None, 'real'),
+                                'imaginary part': (None, 'imag'),
+                                'nyquist': ('real', 'imag')}
+        # The PlotDataItem of each (channel, dataset id) that is plotted,
+        # and the arrays and pen it is showing
+        self.plot_items = {}
+        self.plot_data = {}
 
         self.plot_transfer_function = False
         self.show_coherence = False
@@ -60,6 +103,87 @@ class FrequencyDomainWidget(InteractivePlotWidget):
         self.current_plot_type = plot_type.lower()
         self.update_plot(self.plot_transfer_function)
 
+    def set_segment_length(self, segment_length):
+        """Set the number of samples in each averaged segment. 0 to use
+        the whole record."""
+        self.segment_length = segment_length
+
+    def set_overlap(self, overlap):
+        """Set the fraction of a segment shared with the next segment."""
+        self.overlap = overlap
+
+    def set_window(self, window):
+        """Set the window applied to each segment."""
+        self.window = window.lower()
+
+    def set_estimator(self, estimator):
+        """Set the transfer function estimator: 'H1', 'H2' or 'Hv'."""
+        self.estimator = estimator
+
+    def set_executor(self, executor):
+        """Set the :class:`~cued_datalogger.api.executor.AnalysisExecutor`
+        that runs the calculations."""
+        self.executor = executor
+
+    def set_zoom(self, zoom):
+        """Set whether the spectra and transfer functions are computed in the
+        band of the region, with the zoom FFT, and recompute what is
+        plotted."""
+        self.zoom = zoom
+        if self.zoom:
+            self.calculate_zoom()
+        else:
+            self.update_plot(self.plot_transfer_function)
+
+    def set_zoom_points(self, zoom_points):
+        """Set the number of frequencies in the band of the zoom FFT."""
+        self.zoom_points = zoom_points
+        if self.zoom:
+            self.calculate_zoom()
+
+    def zoom_band(self):
+        """Return the band (Hz) of the zoom FFT, or None if not zoomed."""
+        if not self.zoom:
+            return None
+        lower, upper = self.getRegionBounds()
+        if not upper > lower:
+            print("Cannot zoom: the region is empty.")
+            return None
+        return (max(lower, 0), upper)
+
+    def zoom_segment_length(self, band, num_samples, sample_rate):
+        """Return the segment length for the zoom FFT in *band*.
+
+        The zoom FFT cannot resolve frequencies closer than the line spacing
+        of the segments (sample_rate / segment length), so the segments are
+        lengthened, up to the whole record, until it is no coarser than the
+        spacing of the :attr:`zoom_points`. Warns if the whole record is too
+        short, as the zoomed spectra are then only interpolated."""
+        spacing = (band[1] - band[0]) / max(self.zoom_points - 1, 1)
+        if not spacing > 0:
+            return self.segment_length
+        needed = int(np.ceil(sample_rate / spacing))
+
+        segment_length = self.segment_length
+        if segment_length and segment_length < min(needed, num_samples):
+            segment_length = min(needed, num_samples)
+            print("Zoom FFT: using segments of {} samples for a resolution "
+                  "of {:.3g} Hz.".format(segment_length,
+                                         sample_rate / segment_length))
+        if num_samples < needed:
+            print("Zoom FFT: the record only resolves {:.3g} Hz, coarser "
+                  "than the {:.3g} Hz between the zoom points. The zoomed "
+                  "spectra are interpolated.".format(sample_rate / num_samples,
+                                                     spacing))
+        return segment_length
+
+    def dataset_id(self, id_):
+        """Return the id of the DataSet plotted for *id_*: the zoomed DataSet
+        if zoomed."""
+        if self.zoom:
+            return "zoom_" + id_
+        return id_
+
     def set_show_coherence(self, show_coherence):
         """Set whether the coherence is displayed."""
         self.show_coherence = show_coherence
@@ -67,105 +191,128 @@ class FrequencyDomainWidget(InteractivePlotWidget):
 
     def update_plot(self, plot_transfer_function=False):
         """If *plot_transfer_function*, plot the transfer function. Otherwise,
-        plot the spectrum."""
+        plot the spectrum.
+
+        The plotted quantities are cached by each DataSet, and the plot items
+        of channels that are still plotted are reused."""
         self.plot_transfer_function = plot_transfer_function
 
-        # Clear the plot
-        self.clear()
+        if self.plot_transfer_function:
+            id_ = self.dataset_id("transfer_function")
+        else:
+            id_ = self.dataset_id("spectrum")
+        coherence_id = self.dataset_id("coherence")
+        x_quantity, y_quantity = self.plot_quantities[self.current_plot_type]
 
+        # Find what to plot on each item
+        items = {}
         for channel in self.channels:
-            data = None
-            # Extract the data
-            if self.plot_transfer_function:
-                if channel.is_dataset("transfer_function"):
-                    data = channel.data("transfer_function")
-                else:
-                    print("{}: no 'transfer_function' "
-                          "dataset.".format(channel.name))
-                    continue
-            else:
-                if channel.is_dataset("spectrum"):
-                    data = channel.data("spectrum")
-                else:
-                    print("{}: no 'spectrum' "
-                          "dataset.".format(channel.name))
-                    continue
-
-            if data is not None:
-                # Plot the data
-                if self.current_plot_type == 'linear magnitude':
-                    self.plot(channel.data("frequency"),
-                              np.abs(data),
-                              pen=channel.colour)
-
-                elif self.current_plot_type == 'log magnitude':
-                    self.plot(channel.data("frequency"),
-                              to_dB(np.abs(data)),
-                              pen=channel.colour)
-
-                elif self.current_plot_type == 'phase':
-                    self.plot(channel.data("frequency"),
-                              np.angle(data, deg=True),
-                              pen=channel.colour)
-
-                elif self.current_plot_type == 'real part':
-                    self.plot(channel.data("frequency"),
-                              np.real(data),
-                              pen=channel.colour)
-
-                elif self.current_plot_type == 'imaginary part':
-                    self.plot(channel.data("frequency"),
-                              np.imag(data),
-                              pen=channel.colour)
-
-                elif self.current_plot_type == 'nyquist':
-                    self.plot(np.real(data),
-                              np.imag(data),
-                              pen=channel.colour)
+            if not channel.is_dataset(id_):
+                print("{}: no '{}' dataset.".format(channel.name, id_))
+                continue
+            items[(channel, id_)] = (channel, id_, channel.colour)
 
             if self.plot_transfer_function and self.show_coherence:
-                print("Plotting coherence...")
-                if channel.is_dataset("coherence"):
-                    if self.current_plot_type == 'linear magnitude':
-                        self.plot(channel.data("frequency"),
-                                  np.abs(channel.data("coherence")))
-                    elif self.current_plot_type == 'log magnitude':
-                        self.plot(channel.data("frequency"),
-                                  to_dB(np.abs(channel.data("coherence"))))
-                    elif self.current_plot_type == 'phase':
-                        self.plot(channel.data("frequency"),
-                                  np.angle(channel.data("coherence"), deg=True))
-                    elif self.current_plot_type == 'real part':
-                        self.plot(channel.data("frequency"),
-                                  channel.data("coherence").real)
-                    elif self.current_plot_type == 'imaginary part':
-                        self.plot(channel.data("frequency"),
-                                  channel.data("coherence").imag)
-                    elif self.current_plot_type == 'nyquist':
-                        self.plot(channel.data("coherence").real,
-                                  channel.data("coherence").imag)
-                    print("Done.")
+                if channel.is_dataset(coherence_id):
+                    # The default pen of a PlotDataItem
+                    items[(channel, coherence_id)] = (channel, coherence_id,
+                                                      (200, 200, 200))
                 else:
-                    print("{}: no 'coherence' dataset".format(channel.name))
+                    print("{}: no '{}' dataset".format(channel.name,
+                                                      coherence_id))
+
+        # Remove the items that are no longer plotted
+        for key in list(self.plot_items):
+            if key not in items:
+                self.PlotItem.removeItem(self.plot_items.pop(key))
+                self.plot_data.pop(key, None)
+
+        for key, (channel, dataset_id, pen) in items.items():
+            if x_quantity is None:
+                x = channel.data(self.dataset_id("frequency"))
+            else:
+                x = channel.derived_data(dataset_id, x_quantity)
+            y = channel.derived_data(dataset_id, y_quantity)
+
+            item = self.plot_items.get(key)
+            if item is None:
+                item = pg.PlotDataItem()
+                self.PlotItem.addItem(item)
+                self.plot_items[key] = item
+            # Only replot if the data has changed
+            elif key in self.plot_data and self.plot_data[key][0] is x \
+                    and self.plot_data[key][1] is y \
+                    and np.array_equal(self.plot_data[key][2], pen):
+                continue
+            item.setData(x, y, pen=pen)
+            self.plot_data[key] = (x, y, pen)
+
+        self.PlotWidget.autoRange(padding=0)
+
+    def clear(self):
+        """Clear the plot, and forget the plot items."""
+        super().clear()
+        self.plot_items = {}
+        self.plot_data = {}
+
+    def calculate_zoom(self):
+        """Calculate what is plotted in the band of the region, with the zoom
+        FFT."""
+        if self.plot_transfer_function:
+            self.calculate_transfer_function()
+        else:
+            self.calculate_spectrum()
 
     def calculate_spectrum(self):
         """Calculate the frequency spectrum of all the selected channels."""
         print("Calculating spectrum...")
-        for channel in self.channels:
-            if channel.is_dataset("time_series"):
-                time_series = channel.data("time_series")
-                window = np.hanning(time_series.size)
-                spectrum = rfft(time_series * window)
-
-                channel.add_dataset("spectrum", data=spectrum)
-
+        band = self.zoom_band()
+        try:
+            if band is not None:
+                self.calculate_zoom_spectrum(band)
             else:
-                print("Skipping {}: no 'time_series' "
-                      "dataset.".format(channel.name))
-                continue
+                # Group the channels that can be stacked into one block
+                groups = {}
+                for channel in self.channels:
+                    if channel.is_dataset("time_series"):
+                        key = (channel.data("time_series").size,
+                               channel.sample_rate)
+                        groups.setdefault(key, []).append(channel)
+                    else:
+                        print("Skipping {}: no 'time_series' "
+                              "dataset.".format(channel.name))
+                for channels in groups.values():
+                    self.calculate_block_spectrum(channels)
+        except AnalysisCancelled as error:
+            print(error)
+            return
         print("Done.")
         self.update_plot()
 
+    def calculate_block_spectrum(self, channels):
+        """Calculate the spectrum of *channels*, whose time series have the
+        same length, from their time series stacked into one block. Each
+        block of channels calculated by the :attr:`executor` is transformed
+        with one 2D FFT per block of segments."""
+        # Time series stored as one block are used without copying
+        data = stack_rows([channel.data("time_series")
+                           for channel in channels]).T
+
+        chunks = self.executor.chunks(len(channels))
+        block_spectra = self.executor.map(
+            welch_spectra_columns,
+            [(data, start, stop) for start, stop in chunks],
+            input_channel=None,
+            segment_length=self.segment_length,
+            overlap=self.overlap,
+            window=self.window,
+            sample_rate=channels[0].sample_rate)
+
+        for (start, stop), spectra in zip(chunks, block_spectra):
+            spectrum = spectra.spectrum()
+            for i, channel in enumerate(channels[start:stop]):
+                channel.add_dataset("spectrum", data=spectrum[:, i])
+
     def calculate_transfer_function(self, input_channel=None):
         """Calculate the transfer function, using the channel object given by
         *input_channel* as the input. If no channel specified, treat the first
@@ -180,6 +327,21 @@ class FrequencyDomainWidget(InteractivePlotWidget):
 
         print("Calculating transfer function...")
 
+        if all(channel.is_dataset("time_series") for channel in self.channels):
+            try:
+                self.calculate_averaged_transfer_function(input_channel,
+                                                          self.zoom_band())
+            except AnalysisCancelled as error:
+                print(error)
+                return
+            print("Done.")
+            self.update_plot(plot_transfer_function=True)
+            return
+        elif self.zoom:
+            print("Cannot zoom: not all the channels have a 'time_series' "
+                  "dataset.")
+            return
+
         input_spectrum = input_channel.data("spectrum")
         input_auto_spectrum = calculate_auto_spectrum(input_spectrum)
 
@@ -200,15 +362,14 @@ class FrequencyDomainWidget(InteractivePlotWidget):
                     calculate_cross_spectrum(input_spectrum,
                                                   output_spectrum)
 
-                # Calculate the transfer function
-                transfer_function = output_auto_spectrum / cross_spectrum
+                # Calculate the transfer function and the coherence
+                tf, coh = compute_transfer_function(input_auto_spectrum,
+                                                    output_auto_spectrum,
+                                                    cross_spectrum,
+                                                    self.estimator)
                 # Update the channel
-                channel.add_dataset("transfer_function", data=transfer_function)
-
-                # Calculate the coherence
-                coherence = (cross_spectrum * cross_spectrum.conj() /
-                             input_auto_spectrum * output_auto_spectrum).real
-                channel.add_dataset("coherence", data=coherence)
+                channel.add_dataset("transfer_function", data=tf)
+                channel.add_dataset("coherence", data=coh)
 
             else:
                 print("Skipping {}: no 'spectrum' "
@@ -217,6 +378,82 @@ class FrequencyDomainWidget(InteractivePlotWidget):
         print("Done.")
         self.update_plot(plot_transfer_function=True)
 
+    def calculate_zoom_spectrum(self, band):
+        """Calculate the segment-averaged spectrum of all the selected
+        channels in *band*, with the zoom FFT, in one pass."""
+        channels = [channel for channel in self.channels
+                    if channel.is_dataset("time_series")]
+        for channel in self.channels:
+            if not channel in channels:
+                print("Skipping {}: no 'time_series' "
+                      "dataset.".format(channel.name))
+        if channels:
+            self.calculate_averaged_transfer_function(channels[0], band,
+                                                      channels,
+                                                      spectrum_only=True)
+
+    def calculate_averaged_transfer_function(self, input_channel, band=None,
+                                             channels=None,
+                                             spectrum_only=False):
+        """Calculate the segment-averaged spectrum, transfer function and
+        coherence of *channels* (by default all the selected channels) from
+        their time series, in one pass, using *input_channel* as the input.
+
+        If *band* is given, they are only calculated in the band, with the
+        zoom FFT, and stored in the zoom DataSets. If *spectrum_only*, the
+        transfer function and coherence are not stored.
+
+        The channels are split into blocks that are calculated in parallel by
+        the :attr:`executor`."""
+        if channels is None:
+            channels = self.channels
+        # Truncate the time series to a common length. Time series stored as
+        # one block are used without copying
+        num_samples = min(channel.data("time_series").size
+                          for channel in channels)
+        data = stack_rows([channel.data("time_series")[:num_samples]
+                           for channel in channels]).T
+
+        segment_length = self.segment_length
+        if band is not None:
+            segment_length = self.zoom_segment_length(band, num_samples,
+                                                      input_channel.sample_rate)
+
+        chunks = self.executor.chunks(len(channels))
+        block_spectra = self.executor.map(
+            welch_spectra_columns,
+            [(data, start, stop) for start, stop in chunks],
+            input_channel=channels.index(input_channel),
+            segment_length=segment_length,
+            overlap=self.overlap,
+            window=self.window,
+            sample_rate=input_channel.sample_rate,
+            band=band,
+            num_points=self.zoom_points)
+
+        prefix = "" if band is None else "zoom_"
+        for (start, stop), spectra in zip(chunks, block_spectra):
+            # The first channel of each block is the input channel. A single
+            # whole-record segment keeps the phase of the spectra
+            channel_spectra = spectra.spectrum()[:, 1:]
+            if not spectrum_only:
+                transfer_functions = \
+                    spectra.transfer_function(self.estimator)[:, 1:]
+                coherences = spectra.coherence()[:, 1:]
+            for i, channel in enumerate(channels[start:stop]):
+                if band is not None:
+                    frequency = spectra.frequency()
+                    channel.add_dataset("zoom_frequency", 'Hz', frequency)
+                    channel.add_dataset("zoom_omega", 'rad',
+                                        2*np.pi*frequency)
+                channel.add_dataset(prefix + "spectrum",
+                                    data=channel_spectra[:, i])
+                if not spectrum_only:
+                    channel.add_dataset(prefix + "transfer_function",
+                                        data=transfer_functions[:, i])
+                    channel.add_dataset(prefix + "coherence",
+                                        data=coherences[:, i])
+
 
 def calculate_auto_spectrum(spectrum):
     return spectrum * spectrum.conj()
@@ -224,10 +461,12 @@ def calculate_auto_spectrum(spectrum):
 def calculate_cross_spectrum(input_spectrum, output_spectrum):
     return input_spectrum.conj() * output_spectrum
 
-def compute_transfer_function(autospec_in,autospec_out,crossspec):
-    transfer_func = (autospec_out/crossspec)
-    coherence = ((crossspec * np.conjugate(crossspec))/(autospec_in*autospec_out))
-    return(transfer_func,np.real(coherence))
+def compute_transfer_function(autospec_in,autospec_out,crossspec,estimator='H1'):
+    """Return the transfer function, using *estimator* (any of 'H1', 'H2',
+    'Hv'), and the coherence from the auto- and cross-spectra."""
+    transfer_func = transfer_function(autospec_in, autospec_out, crossspec,
+                                      estimator)
+    return(transfer_func,coherence(autospec_in, autospec_out, crossspec))
 
 
 class FrequencyToolbox(Toolbox):
@@ -238,6 +477,12 @@ class FrequencyToolbox(Toolbox):
     sig_plot_frequency_spectrum = pyqtSignal()
     sig_show_coherence = pyqtSignal(bool)
     sig_calculate_transfer_function = pyqtSignal()
+    sig_segment_length_changed = pyqtSignal(int)
+    sig_overlap_changed = pyqtSignal(float)
+    sig_window_changed = pyqtSignal(str)
+    sig_estimator_changed = pyqtSignal(str)
+    sig_zoom_changed = pyqtSignal(bool)
+    sig_zoom_points_changed = pyqtSignal(int)
 
     def __init__(self, parent=None):
         super().__init__(parent=parent)
@@ -296,9 +541,60 @@ class FrequencyToolbox(Toolbox):
         self.convert_to_transfer_function_button.clicked.connect(self.set_plot_transfer_function)
         transfer_function_groupbox_layout.addWidget(self.convert_to_transfer_function_button, 1, 0)
 
+        transfer_function_groupbox_layout.addWidget(QLabel("Estimator:"), 2, 0)
+        self.estimator_combobox = QComboBox(self)
+        self.estimator_combobox.addItems(TRANSFER_FUNCTION_ESTIMATORS)
+        self.estimator_combobox.currentIndexChanged[str].connect(self.sig_estimator_changed.emit)
+        transfer_function_groupbox_layout.addWidget(self.estimator_combobox, 3, 0)
+
         transfer_function_groupbox.setLayout(transfer_function_groupbox_layout)
         convert_tab_layout.addWidget(transfer_function_groupbox, 0, 0)
 
+        averaging_groupbox = QGroupBox("Spectral averaging")
+        averaging_groupbox_layout = QGridLayout()
+
+        averaging_groupbox_layout.addWidget(QLabel("Segment length:"), 0, 0)
+        self.segment_length_combobox = QComboBox(self)
+        self.segment_length_combobox.addItems(['Whole record'] +
+                                              [str(2**n) for n in range(8, 17)])
+        self.segment_length_combobox.setCurrentText('Whole record')
+        self.segment_length_combobox.currentIndexChanged[str].connect(self.on_segment_length_changed)
+        averaging_groupbox_layout.addWidget(self.segment_length_combobox, 0, 1)
+
+        averaging_groupbox_layout.addWidget(QLabel("Overlap (%):"), 1, 0)
+        self.overlap_spinbox = QSpinBox(self)
+        self.overlap_spinbox.setRange(0, 95)
+        self.overlap_spinbox.setValue(50)
+        self.overlap_spinbox.valueChanged.connect(lambda value: self.sig_overlap_changed.emit(value/100))
+        averaging_groupbox_layout.addWidget(self.overlap_spinbox, 1, 1)
+
+        averaging_groupbox_layout.addWidget(QLabel("Window:"), 2, 0)
+        self.window_combobox = QComboBox(self)
+        self.window_combobox.addItems([window.capitalize() for window in WINDOW_FUNCTIONS])
+        self.window_combobox.currentIndexChanged[str].connect(self.sig_window_changed.emit)
+        averaging_groupbox_layout.addWidget(self.window_combobox, 2, 1)
+
+        averaging_groupbox.setLayout(averaging_groupbox_layout)
+        convert_tab_layout.addWidget(averaging_groupbox, 1, 0)
+
+        zoom_groupbox = QGroupBox("Zoom FFT")
+        zoom_groupbox_layout = QGridLayout()
+
+        self.zoom_checkbox = QCheckBox("Zoom to region", self)
+        self.zoom_checkbox.toggled.connect(self.sig_zoom_changed.emit)
+        zoom_groupbox_layout.addWidget(self.zoom_checkbox, 0, 0, 1, 2)
+
+        zoom_groupbox_layout.addWidget(QLabel("Points:"), 1, 0)
+        self.zoom_points_spinbox = QSpinBox(self)
+        self.zoom_points_spinbox.setRange(16, 65536)
+        self.zoom_points_spinbox.setValue(1024)
+        self.zoom_points_spinbox.setKeyboardTracking(False)
+        self.zoom_points_spinbox.valueChanged.connect(self.sig_zoom_points_changed.emit)
+        zoom_groupbox_layout.addWidget(self.zoom_points_spinbox, 1, 1)
+
+        zoom_groupbox.setLayout(zoom_groupbox_layout)
+        convert_tab_layout.addWidget(zoom_groupbox, 2, 0)
+
         modal_fitting_groupbox = QGroupBox("Modal fitting")
         modal_fitting_groupbox_layout = QGridLayout()
 
@@ -307,13 +603,19 @@ class FrequencyToolbox(Toolbox):
         modal_fitting_groupbox_layout.addWidget(self.circle_fit_btn, 1, 0)
 
         modal_fitting_groupbox.setLayout(modal_fitting_groupbox_layout)
-        convert_tab_layout.addWidget(modal_fitting_groupbox, 1, 0)
+        convert_tab_layout.addWidget(modal_fitting_groupbox, 3, 0)
 
-        convert_tab_layout.setRowStretch(2, 1)
+        convert_tab_layout.setRowStretch(4, 1)
         self.convert_tab.setLayout(convert_tab_layout)
 
         self.addTab(self.convert_tab, "Conversion")
 
+    def on_segment_length_changed(self, segment_length):
+        if segment_length == 'Whole record':
+            self.sig_segment_length_changed.emit(0)
+        else:
+            self.sig_segment_length_changed.emit(int(segment_length))
+
     def set_plot_transfer_function(self):
         print("Plotting transfer function...")
         self.current_plot_combobox.setCurrentIndex(1)
@@ -0,0 +1,277 @@
+"""
+Modal identification with the least-squares complex frequency-domain (LSCF)
+method.
+
+A common-denominator rational fraction model is fitted to the transfer
+functions of all the channels at once, at every model order up to a maximum,
+which gives the poles for the stabilisation diagram. The modal constants of
+the stable poles are then found for all the channels with one linear least
+squares fit (LSFD).
+
+The normal equations of the LSCF method are block Toeplitz, so they are built
+from sums of the data over the frequency lines at each lag, computed for
+blocks of channels with one matrix product. The cost is linear in the number
+of frequency lines and in the number of channels.
+
+The modal parameters follow the same conventions as
+:func:`~cued_datalogger.api.numpy_extensions.sdof_modal_peak` and the circle
+fit, so that each mode is the peak given by
+
+.. math:: \\frac{a_n e^{i\\phi}}{\\omega_n^2 - \\omega^2 + 2i\\zeta_n\\omega_n\\omega}
+
+multiplied by :math:`i\\omega` for velocity and :math:`-\\omega^2` for
+acceleration transfer functions.
+
+Example:
+    | >>>poles = lscf(omega, transfer_functions, max_order=40)
+    | >>>status, count = stabilisation(poles)
+    | >>>modes = select_poles(poles, count, min_stable_orders=5)
+    | >>>wn, zn, an, phi = lsfd(omega, transfer_functions, modes)
+
+References
+----------
+.. [1]  Peeters, B., Van der Auweraer, H. et al, The PolyMAX frequency-domain
+   method: a new standard for modal parameter estimation?, Shock and
+   Vibration 11, p395, 2004.
+"""
+import numpy as np
+
+# The status of each pole in the stabilisation diagram
+POLE_NEW = 0
+POLE_STABLE_FREQUENCY = 1
+POLE_STABLE = 2
+
+_MOBILITY = {'displacement': lambda w: np.ones_like(w),
+             'velocity': lambda w: 1j*w,
+             'acceleration': lambda w: -w**2}
+
+
+def _lag_sums(omega, transfer_function, sample_time, max_order,
+              block_size=None):
+    """Return the sums over the frequency lines of Omega^lag, |H|^2
+    Omega^lag, and H Omega^lag for each channel, for lags from -max_order to
+    max_order, where Omega = exp(-i omega sample_time)."""
+    lags = np.arange(-max_order, max_order + 1)
+    basis = np.exp(-1j * np.outer(omega, lags) * sample_time)
+
+    if block_size is None:
+        block_size = max(2**22 // max(omega.size, 1), 1)
+
+    num_channels = transfer_function.shape[0]
+    h_sums = np.empty((num_channels, lags.size), dtype=complex)
+    for start in range(0, num_channels, block_size):
+        h_sums[start:start+block_size] = \
+            transfer_function[start:start+block_size] @ basis
+    power = np.sum(np.abs(transfer_function)**2, axis=0)
+
+    return basis.sum(axis=0), power @ basis, h_sums
+
+
+def _toeplitz(lag_sums, order, max_order):
+    """Return the real Toeplitz matrices (... x order+1 x order+1) with
+    element [j, l] equal to the real part of the sum at lag l - j."""
+    index = np.arange(order + 1)
+    lag_index = index[np.newaxis, :] - index[:, np.newaxis] + max_order
+    return lag_sums[..., lag_index].real
+
+
+def lscf(omega, transfer_function, max_order=40, min_order=1,
+         block_size=None):
+    """
+    Estimate the poles of the transfer functions at every model order, with
+    the LSCF method.
+
+    Parameters
+    ----------
+    omega : ndarray
+        The angular frequencies of the frequency lines in the band.
+    transfer_function : ndarray
+        The transfer function of each channel in the band, with dimension
+        (channels x frequency lines).
+    max_order : int
+        The highest order of the common denominator.
+    min_order : int
+        The lowest order of the common denominator.
+    block_size : int, optional
+        The number of channels whose sums are computed at once.
+
+    Returns
+    -------
+    dict
+        The poles (complex, rad/s) found at each model order, keyed by order.
+        Only stable poles with positive frequency in the band are kept.
+    """
+    omega = np.asarray(omega, dtype=float)
+    transfer_function = np.atleast_2d(transfer_function)
+    if omega.size < 2*max_order:
+        raise ValueError("Not enough frequency lines for a model of order {}"
+                         .format(max_order))
+
+    # Weight the channels equally
+    rms = np.sqrt(np.mean(np.abs(transfer_function)**2, axis=1))
+    transfer_function = transfer_function / np.where(rms > 0, rms, 1)[:, None]
+
+    # The band is mapped onto the unit circle
+    sample_time = np.pi / omega.max()
+    basis_sums, power_sums, h_sums = _lag_sums(omega, transfer_function,
+                                               sample_time, max_order,
+                                               block_size)
+
+    poles = {}
+    for order in range(max(min_order, 1), max_order + 1):
+        R = _toeplitz(basis_sums, order, max_order)
+        S = -_toeplitz(h_sums, order, max_order)
+        T = _toeplitz(power_sums, order, max_order)
+
+        # Eliminate the numerators of all the channels
+        M = T - np.einsum('cjk,ckl->jl', S.transpose(0, 2, 1),
+                        np.linalg.solve(R, S))
+
+        # Fix the highest coefficient of the denominator
+        try:
+            a = np.linalg.solve(M[:-1, :-1], -M[:-1, -1])
+        except np.linalg.LinAlgError:
+            continue
+        if not np.all(np.isfinite(a)):
+            continue
+        roots = np.roots(np.append(a, 1)[::-1]).astype(complex)
+        roots = roots[roots != 0]
+
+        s = -np.log(roots) / sample_time
+        keep = (s.imag > 0) & (s.real < 0) & (s.imag <= omega.max()) \
+            & (s.imag >= omega.min())
+        poles[order] = s[keep][np.argsort(s[keep].imag)]
+    return poles
+
+
+def pole_frequency_damping(poles):
+    """Return the undamped natural frequency (rad/s) and the damping ratio
+    of the *poles*."""
+    wn = np.abs(poles)
+    return wn, -poles.real / np.where(wn > 0, wn, 1)
+
+
+def stabilisation(poles, frequency_tolerance=0.01, damping_tolerance=0.05):
+    """
+    Classify the poles of each order by comparing them with the poles of the
+    order below, for the stabilisation diagram.
+
+    Parameters
+    ----------
+    poles : dict
+        The poles at each model order, from :func:`lscf`.
+    frequency_tolerance : float
+        The largest relative change in frequency of a stable pole.
+    damping_tolerance : float
+        The largest relative change in damping of a stable pole.
+
+    Returns
+    -------
+    status : dict
+        The status of each pole at each order: :data:`POLE_NEW`,
+        :data:`POLE_STABLE_FREQUENCY` or :data:`POLE_STABLE`.
+    count : dict
+        The number of consecutive lower orders each pole has been stable for.
+    """
+    status = {}
+    count = {}
+    previous = None
+    for order in sorted(poles):
+        wn, zn = pole_frequency_damping(poles[order])
+        status[order] = np.full(wn.size, POLE_NEW)
+        count[order] = np.zeros(wn.size, dtype=int)
+        if previous is not None and previous[0].size and wn.size:
+            wn_prev, zn_prev, count_prev = previous
+            # The closest pole in frequency at the order below
+            closest = np.abs(wn[:, None] - wn_prev[None, :]).argmin(axis=1)
+            frequency_change = np.abs(wn - wn_prev[closest]) / wn
+            damping_change = np.abs(zn - zn_prev[closest]) \
+                / np.where(zn > 0, zn, 1)
+            stable_frequency = frequency_change <= frequency_tolerance
+            stable = stable_frequency & (damping_change <= damping_tolerance)
+            status[order][stable_frequency] = POLE_STABLE_FREQUENCY
+            status[order][stable] = POLE_STABLE
+            count[order][stable] = count_prev[closest][stable] + 1
+        previous = (wn, zn, count[order])
+    return status, count
+
+
+def select_poles(poles, count, min_stable_orders=5, order=None):
+    """
+    Return the poles at *order* (by default the highest) that have been
+    stable for at least *min_stable_orders* orders, sorted by frequency.
+    """
+    if order is None:
+        order = max(poles)
+    selected = poles[order][count[order] >= min_stable_orders]
+    # Keep one pole per mode
+    wn = np.abs(selected)
+    if wn.size > 1:
+        distinct = np.append(True, np.diff(wn) > 1e-6 * wn[1:])
+        selected = selected[distinct]
+    return selected
+
+
+def lsfd(omega, transfer_function, poles,
+         transfer_function_type='displacement', residuals=True):
+    """
+    Fit the modal constants of the *poles* to the transfer functions of all
+    the channels at once, with a linear least squares fit.
+
+    Parameters
+    ----------
+    omega : ndarray
+        The angular frequencies of the frequency lines in the band.
+    transfer_function : ndarray
+        The transfer function of each channel in the band, with dimension
+        (channels x frequency lines).
+    poles : ndarray
+        The poles of the modes, with positive imaginary part.
+    transfer_function_type : str
+        One of ``'displacement'``, ``'velocity'`` or ``'acceleration'``.
+    residuals : bool
+        Whether to fit lower and upper residual terms for the modes outside
+        the band.
+
+    Returns
+    -------
+    wn : ndarray
+        The natural frequency (rad/s) of each mode.
+    zn : ndarray
+        The damping ratio of each mode.
+    an : ndarray
+        The magnitude of the modal constant of each mode in each channel,
+        with dimension (channels x modes).
+    phi : ndarray
+        The phase (rad) of the modal constant of each mode in each channel,
+        with dimension (channels x modes).
+    """
+    omega = np.asarray(omega, dtype=float)
+    transfer_function = np.atleast_2d(transfer_function)
+    poles = np.atleast_1d(poles)
+    jw = 1j*omega[:, np.newaxis]
+
+    # The residue A of each pole gives the real and imaginary parts of
+    # A / (jw - pole) + conj(A) / (jw - conj(pole))
+    mobility = _MOBILITY[transfer_function_type](omega)[:, np.newaxis]
+    real_part = mobility * (1/(jw - poles) + 1/(jw - poles.conj()))
+    imag_part = mobility * (1j/(jw - poles) - 1j/(jw - poles.conj()))
+    columns = [real_part, imag_part]
+    if residuals:
+        # Upper residual (constant) and lower residual (mass line)
+        columns.append(np.column_stack([np.ones_like(jw[:, 0]),
+                                        -1/np.where(omega > 0, omega, 1)**2])
+                       * mobility)
+    basis = np.hstack(columns)
+
+    # Solve the real least squares problem for every channel at once
+    A = np.vstack([basis.real, basis.imag])
+    b = np.vstack([transfer_function.T.real, transfer_function.T.imag])
+    x = np.linalg.lstsq(A, b, rcond=None)[0]
+    residues = (x[:poles.size] + 1j*x[poles.size:2*poles.size]).T
+
+    # Near resonance the pair of poles is the SDOF peak with modal constant
+    # 2 i wd A
+    wn, zn = pole_frequency_damping(poles)
+    modal_constant = 2j * poles.imag * residues
+    return wn, zn, np.abs(modal_constant), np.angle(modal_constant)
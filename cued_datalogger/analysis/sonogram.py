@@ -1,16 +1,32 @@
 import sys,traceback
+import weakref
 
-from cued_datalogger.api.numpy_extensions import to_dB
+from cued_datalogger.api.executor import AnalysisExecutor, AnalysisCancelled
+from cued_datalogger.api.numpy_extensions import to_dB, ArrayCache
 from cued_datalogger.api.pyqt_extensions import BaseNControl, MatplotlibCanvas
 from cued_datalogger.api.pyqtgraph_extensions import ColorMapPlotWidget
 from cued_datalogger.api.toolbox import Toolbox
+from cued_datalogger.analysis.stft import stft
 
-from PyQt5.QtCore import Qt, pyqtSignal
-from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QSlider, QPushButton, QLabel, QSpinBox, QHBoxLayout, QGridLayout
+from PyQt5.QtCore import Qt, QTimer, pyqtSignal
+from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QSlider, QPushButton, QLabel, QSpinBox, QHBoxLayout, QGridLayout, QCheckBox
 
 import numpy as np
 
-import scipy.signal
+SONOGRAM_CACHE_BYTES = 256*2**20
+# Maximum number of FFTs in the overview of a zoom-aware sonogram
+OVERVIEW_FRAMES = 1024
+# Number of FFTs in each tile of a zoom-aware sonogram
+TILE_FRAMES = 256
+
+
+def pooled_stft(time_series, window_width, step, pool, window, sample_rate):
+    """Return :func:`~cued_datalogger.analysis.stft.stft` of *time_series*
+    with FFTs every *step* samples, max-pooling the magnitudes of *pool*
+    consecutive FFTs into each frame. The spectrum is complex if *pool* is 1."""
+    return stft(time_series, window_width, step=step, window=window,
+                sample_rate=sample_rate,
+                output='complex' if pool == 1 else 'magnitude', pool=pool)
 
 
 class MatplotlibSonogramContourWidget(MatplotlibCanvas):
@@ -92,12 +108,42 @@ class SonogramDisplayWidget(ColorMapPlotWidget):
     """
     The SonogramDisplayWidget is the main display widget for everything in
     the sonogram domain.
+
+    The sonograms are kept in a cache, keyed on the channel, its sample rate
+    and the sonogram parameters, so that going back to previous parameters
+    does not recompute them. The least recently used sonograms are evicted
+    when the cache exceeds its memory budget. Changing the contours only
+    changes the colour levels of the plot.
+
+    In zoom-aware mode, only a coarse overview of the whole record is
+    computed, with at most :data:`OVERVIEW_FRAMES` frames. The FFTs are never
+    further apart than the window width, so that no part of the record is
+    skipped, and their magnitudes are max-pooled into the frames, so short
+    events stay visible in the overview. When the view is
+    zoomed in, the visible time range is computed again as tiles of
+    :data:`TILE_FRAMES` FFTs, with a step matched to the screen pixels, and
+    drawn over the overview. The tiles are cached too, so panning back does
+    not recompute them.
+
+    Attributes
+    ----------
+    sonogram_cache : :class:`~cued_datalogger.api.numpy_extensions.ArrayCache`
+        The cache of the computed sonograms and tiles.
+    window : str
+        The window applied to each segment of the time series.
+    zoom_aware : bool
+        Whether to compute the sonogram depending on the view.
+    executor : :class:`~cued_datalogger.api.executor.AnalysisExecutor`
+        Computes the sonograms of the channels in parallel.
     """
     def __init__(self, parent=None,
                  window_width=256,
                  window_overlap_fraction=8,
                  contour_spacing_dB=5,
-                 num_contours=5):
+                 num_contours=5,
+                 window='hann',
+                 cache_bytes=SONOGRAM_CACHE_BYTES,
+                 zoom_aware=False):
 
         super().__init__(parent)
         self.parent = parent
@@ -108,10 +154,21 @@ class SonogramDisplayWidget(ColorMapPlotWidget):
         self.window_overlap_fraction = window_overlap_fraction
         self.contour_spacing_dB = contour_spacing_dB
         self.num_contours = num_contours
+        self.window = window
+        self.sonogram_cache = ArrayCache(cache_bytes)
+        self.zoom_aware = zoom_aware
+        self.executor = AnalysisExecutor('serial', parent=self)
 
         self.PlotWidget.setLabel('bottom', "Frequency", "Hz")
         self.PlotWidget.setLabel('left', "Time", "s")
 
+        # Only update the tiles once the view stops changing
+        self.tile_timer = QTimer(self)
+        self.tile_timer.setSingleShot(True)
+        self.tile_timer.setInterval(100)
+        self.tile_timer.timeout.connect(self.update_tiles)
+        self.ViewBox.sigRangeChanged.connect(self.on_view_changed)
+
         self.show()
 
     def update_window_width(self, value):
@@ -127,52 +184,250 @@ class SonogramDisplayWidget(ColorMapPlotWidget):
     def update_contour_spacing(self, value):
         """Slot for updating the plot when the contour spacing is changed."""
         self.contour_spacing_dB = value
-        self.update_plot()
+        self.set_contours(contour_spacing_dB=value)
 
     def update_num_contours(self, value):
         """Slot for updating the plot when the number of contours is changed."""
         self.num_contours = value
+        self.set_contours(num_contours=value)
+
+    def set_executor(self, executor):
+        """Set the :class:`~cued_datalogger.api.executor.AnalysisExecutor`
+        that computes the sonograms."""
+        self.executor = executor
+
+    def set_zoom_aware(self, zoom_aware):
+        """Slot for switching the zoom-aware mode on or off."""
+        self.zoom_aware = zoom_aware
         self.update_plot()
 
+    def sonogram_step(self):
+        """Return the number of samples between the start of each FFT."""
+        if self.window_overlap_fraction > 1:
+            return self.window_width - self.window_width // self.window_overlap_fraction
+        return self.window_width
+
+    def zoom_step(self, samples_per_frame):
+        """Return the step, a power of two multiple of :meth:`sonogram_step`,
+        giving about *samples_per_frame* samples between each FFT."""
+        step = self.sonogram_step()
+        while step * 2 <= samples_per_frame:
+            step *= 2
+        return step
+
+    def overview_step(self, num_samples):
+        """Return the step of the overview of *num_samples* in zoom-aware
+        mode."""
+        step = self.sonogram_step()
+        while num_samples // step > OVERVIEW_FRAMES:
+            step *= 2
+        return step
+
+    def frame_pooling(self, step):
+        """Return the number of samples between the FFTs of a sonogram with
+        *step* samples between each frame, at most the window width, and the
+        number of FFTs max-pooled into each frame."""
+        hop = step
+        pool = 1
+        while hop > self.window_width and hop % 2 == 0:
+            hop //= 2
+            pool *= 2
+        return hop, pool
+
+    def sonogram_key(self, channel, step=None):
+        """Return the key of the sonogram of *channel* with the current
+        parameters in :attr:`sonogram_cache`."""
+        if step is None:
+            step = self.sonogram_step()
+        return (id(channel), channel.metadata("sample_rate"), self.window_width,
+                step, self.window)
+
+    def get_sonogram(self, channel, step=None):
+        """Return the sonogram of *channel* with the current parameters,
+        computing it only if it is not in :attr:`sonogram_cache`, and store the
+        values in the channel (including autogenerated datasets). The *step*
+        between each FFT defaults to :meth:`sonogram_step`.
+
+        Returns
+        -------
+        dict
+            Contains 'frequency', 'time', 'sonogram' (complex, or the
+            max-pooled magnitude if the *step* is longer than the window) and
+            'sonogram_dB' (the magnitude in dB), in single precision.
+        """
+        if step is None:
+            step = self.sonogram_step()
+        sonogram = self.cached_sonogram(channel, step)
+        if sonogram is None:
+            sonogram = self.cache_sonogram(
+                channel, step, *pooled_stft(channel.data("time_series"),
+                                            self.window_width,
+                                            *self.frame_pooling(step),
+                                            self.window,
+                                            channel.metadata("sample_rate")))
+
+        channel.add_dataset("sonogram_frequency", data=sonogram["frequency"], units="Hz")
+        channel.add_dataset("sonogram_omega", data=sonogram["frequency"]*2*np.pi, units="rad")
+        channel.add_dataset("sonogram_time", data=sonogram["time"], units="s")
+
+        channel.add_dataset("sonogram", data=sonogram["sonogram"], units=None)
+        channel.add_dataset("sonogram_step", data=step, units=None)
+        return sonogram
+
+    def cached_sonogram(self, channel, step):
+        """Return the sonogram of *channel* with *step* samples between each
+        FFT from :attr:`sonogram_cache`, or None if it is not cached."""
+        sonogram = self.sonogram_cache.get(self.sonogram_key(channel, step))
+        # The sonogram is only valid for the time series it was computed from
+        if sonogram is None or \
+                not sonogram["source"]() is channel.data("time_series"):
+            return None
+        return sonogram
+
+    def cache_sonogram(self, channel, step, frequencies, times, spectrum):
+        """Store the sonogram of *channel* with *step* samples between each
+        FFT, as returned by :func:`~cued_datalogger.analysis.stft.stft`, in
+        :attr:`sonogram_cache`, and return it."""
+        sonogram = {"source": weakref.ref(channel.data("time_series")),
+                    "frequency": frequencies,
+                    "time": times,
+                    "sonogram": spectrum,
+                    "sonogram_dB": to_dB(np.abs(spectrum))}
+        self.sonogram_cache.put(self.sonogram_key(channel, step), sonogram)
+        return sonogram
+
+    def calculate_sonograms(self, channels):
+        """Compute the sonograms of the *channels* that are not in
+        :attr:`sonogram_cache`, in parallel with the :attr:`executor`."""
+        missing = []
+        for channel in channels:
+            step = self.plot_step(channel)
+            if self.cached_sonogram(channel, step) is None:
+                missing.append((channel, step))
+        results = self.executor.map(
+            pooled_stft, [(channel.data("time_series"), self.window_width,
+                           *self.frame_pooling(step), self.window,
+                           channel.metadata("sample_rate"))
+                          for channel, step in missing])
+        for (channel, step), result in zip(missing, results):
+            self.cache_sonogram(channel, step, *result)
+
+    def get_tile(self, channel, step, index):
+        """Return the tile *index* of the sonogram of *channel* with *step*
+        samples between each FFT, computing it only if it is not in
+        :attr:`sonogram_cache`.
+
+        Returns
+        -------
+        dict
+            Contains 'frequency', 'time' and 'sonogram_dB' (the magnitude
+            in dB).
+        """
+        time_series = channel.data("time_series")
+        key = self.sonogram_key(channel, step) + ("tile", index)
+        tile = self.sonogram_cache.get(key)
+        if tile is None or not tile["source"]() is time_series:
+            sample_rate = channel.metadata("sample_rate")
+            hop, pool = self.frame_pooling(step)
+            start = index * step * TILE_FRAMES
+            stop = start + step * TILE_FRAMES - hop + self.window_width
+            (frequencies,
+             times,
+             magnitude) = stft(time_series[start:stop],
+                               self.window_width,
+                               step=hop,
+                               window=self.window,
+                               sample_rate=sample_rate,
+                               output='magnitude',
+                               pool=pool)
+            tile = {"source": weakref.ref(time_series),
+                    "frequency": frequencies,
+                    "time": times + start / sample_rate,
+                    "sonogram_dB": to_dB(magnitude)}
+            self.sonogram_cache.put(key, tile)
+        return tile
+
     def calculate_sonogram(self):
         """Calculate the sonogram, and store the values in the channel
-        (including autogenerated datasets). Sonogram data is in complex form."""
-        for channel in self.channels:
+        (including autogenerated datasets). Sonogram data is in complex form.
+        In zoom-aware mode, only the overview is calculated."""
+        channels = [channel for channel in self.channels
+                    if channel.is_dataset("time_series")]
+        try:
+            self.calculate_sonograms(channels)
+        except AnalysisCancelled as error:
+            print(error)
+            return
+        for channel in channels:
+            self.get_sonogram(channel, self.plot_step(channel))
+
+    def plot_step(self, channel):
+        """Return the step of the sonogram of *channel* plotted for the
+        whole record."""
+        if self.zoom_aware:
+            return self.overview_step(channel.data("time_series").size)
+        return self.sonogram_step()
+
+    def on_view_changed(self):
+        """Slot for updating the tiles when the view is zoomed or panned."""
+        if self.zoom_aware:
+            self.tile_timer.start()
+
+    def update_tiles(self):
+        """Draw the tiles of the visible part of the sonogram at a resolution
+        matched to the screen, and remove the tiles that are not needed."""
+        needed = []
+        if self.zoom_aware and self.channels and hasattr(self, 'z_img'):
+            # The channel plotted on top
+            channel = self.channels[-1]
             if channel.is_dataset("time_series"):
-                (frequencies,
-                 times,
-                 spectrum) = scipy.signal.spectrogram(channel.data("time_series"),
-                                                     channel.metadata("sample_rate"),
-                                                     window=scipy.signal.get_window('hann', self.window_width),
-                                                     nperseg=self.window_width,
-                                                     noverlap=self.window_width // self.window_overlap_fraction,
-                                                     return_onesided=False,
-                                                     mode = 'complex')
-                # SciPy's spectrogram gives the FT transposed, so we need to transpose it back
-                spectrum = spectrum.transpose()
-                # Scipy calculates all the conjugate spectra/frequencies as well -
-                # we only want the positive ones
-                frequencies = np.abs(frequencies[:frequencies.size // 2 + 1])
-                spectrum = spectrum[:, :spectrum.shape[1] // 2 + 1]
-
-                channel.add_dataset("sonogram_frequency", data=frequencies, units="Hz")
-                channel.add_dataset("sonogram_omega", data=frequencies*2*np.pi, units="rad")
-                channel.add_dataset("sonogram_time", data=times, units="s")
-
-                channel.add_dataset("sonogram", data=spectrum, units=None)
-                channel.add_dataset("sonogram_phase", data=np.angle(spectrum), units='rad')
-                channel.add_dataset("sonogram_step", data=self.window_width // self.window_overlap_fraction, units=None)
+                num_samples = channel.data("time_series").size
+                sample_rate = channel.metadata("sample_rate")
+                t_min, t_max = self.ViewBox.viewRange()[1]
+                start = max(int(t_min * sample_rate), 0)
+                stop = min(int(np.ceil(t_max * sample_rate)), num_samples)
+                pixels = max(self.ViewBox.height(), 1)
+                step = self.zoom_step((stop - start) / pixels)
+                # The overview is already detailed enough otherwise
+                if stop > start and step < self.overview_step(num_samples):
+                    tile_span = step * TILE_FRAMES
+                    needed = [(step, index) for index in
+                              range(start // tile_span, (stop - 1) // tile_span + 1)]
+
+        for key in list(self.tiles.keys()):
+            if not key in needed:
+                self.remove_tile(key)
+        for key in needed:
+            if not key in self.tiles:
+                tile = self.get_tile(channel, *key)
+                if tile["sonogram_dB"].size:
+                    self.set_tile(key, tile["frequency"], tile["time"],
+                                  tile["sonogram_dB"])
 
     def update_plot(self):
         """Clear the canvas and replot."""
         self.clear()
         if self.channels is not None:
+            try:
+                self.calculate_sonograms([channel for channel in self.channels
+                                          if channel.is_dataset("time_series")])
+            except AnalysisCancelled as error:
+                print(error)
+                return
             for channel in self.channels:
-                if not channel.is_dataset("sonogram"):
-                    self.calculate_sonogram()
+                if channel.is_dataset("time_series"):
+                    sonogram = self.get_sonogram(channel, self.plot_step(channel))
+                    sonogram_dB = sonogram["sonogram_dB"]
+                elif channel.is_dataset("sonogram"):
+                    sonogram_dB = to_dB(np.abs(channel.data("sonogram")))
+                else:
+                    continue
+                # The time series is shorter than one window
+                if not sonogram_dB.size:
+                    continue
                 self.plot_colormap(channel.data("sonogram_frequency"),
                                    channel.data("sonogram_time"),
-                                   to_dB(np.abs(channel.data("sonogram"))),
+                                   sonogram_dB,
                                    num_contours=self.num_contours,
                                    contour_spacing_dB=self.contour_spacing_dB)
 
@@ -193,6 +448,7 @@ class SonogramToolbox(Toolbox):
     sig_window_overlap_fraction_changed = pyqtSignal(int)
     sig_num_contours_changed = pyqtSignal(int)
     sig_contour_spacing_changed = pyqtSignal(int)
+    sig_zoom_aware_changed = pyqtSignal(bool)
 
     def __init__(self, parent=None):
         super().__init__(parent=parent)
@@ -225,6 +481,12 @@ class SonogramToolbox(Toolbox):
         self.window_overlap_fraction_control.set_value(self.window_overlap_fraction)
         self.window_overlap_fraction_control.valueChanged.connect(self.sig_window_overlap_fraction_changed.emit)
 
+        #------------Zoom-aware controls------------
+        self.zoom_aware_checkbox = QCheckBox("Zoom-aware", self)
+        self.zoom_aware_checkbox.setToolTip("Compute a coarse overview, and "
+                                            "recompute the visible part when zooming in")
+        self.zoom_aware_checkbox.toggled.connect(self.sig_zoom_aware_changed.emit)
+
         #------------Contour spacing controls------------
         self.contour_spacing_label = QLabel(self)
         self.contour_spacing_label.setText("Contour spacing")
@@ -282,6 +544,7 @@ class SonogramToolbox(Toolbox):
         sonogram_controls_layout.addWidget(self.window_width_control, 1, 0)
         sonogram_controls_layout.addWidget(self.window_overlap_fraction_label, 0, 1)
         sonogram_controls_layout.addWidget(self.window_overlap_fraction_control, 1, 1)
+        sonogram_controls_layout.addWidget(self.zoom_aware_checkbox, 2, 0, 1, 2)
 
         self.sonogram_controls_tab.setLayout(sonogram_controls_layout)
 
@@ -0,0 +1,497 @@
+"""
+Segment-averaged (Welch) estimation of auto- and cross-spectra, transfer
+functions and coherence.
+
+The time series is split into overlapping, windowed segments. The segments are
+taken as a strided view of the data, so they are never copied as a whole, and
+are transformed in blocks with one 2D rfft per block, for all the channels at
+once. The spectra of the segments are summed as they are computed, so the
+memory used only depends on the segment length and the block size, not on
+the length of the record.
+
+Example:
+    | >>>spectra = welch_spectra(data, input_channel=0, segment_length=4096)
+    | >>>tf = spectra.transfer_function('H1')
+    | >>>coherence = spectra.coherence()
+
+With a *band*, the spectra are only computed at *num_points* frequencies in
+the band, with the chirp-z transform (see
+:mod:`~cued_datalogger.analysis.zoom_fft`), for a fine frequency resolution
+around a resonance.
+
+Example:
+    | >>>spectra = welch_spectra(data, band=(95, 105), num_points=2000,
+    | ...                        sample_rate=44100)
+    | >>>tf = spectra.transfer_function('H1')
+
+The averages of a series of recordings (e.g. repeated impacts) are kept by a
+:class:`SpectralAccumulator`, which only stores the running sums, so adding
+or undoing an average does not depend on how many averages were taken.
+
+Example:
+    | >>>acc = SpectralAccumulator(forgetting_factor=1)
+    | >>>acc.add(autospec_in, autospec_out, crossspec)
+    | >>>tf, cor = acc.transfer_function('H1'), acc.coherence()
+    | >>>acc.save('averages.npz')
+"""
+from collections import deque
+
+import numpy as np
+from numpy.fft import rfft
+
+from cued_datalogger.analysis.zoom_fft import zoom_fft, zoom_frequencies
+
+WINDOW_FUNCTIONS = {'hann': np.hanning,
+                    'hamming': np.hamming,
+                    'blackman': np.blackman,
+                    'rectangular': np.ones}
+
+TRANSFER_FUNCTION_ESTIMATORS = ['H1', 'H2', 'Hv']
+
+
+def get_window(window, length):
+    """Return the window called *window* (any of :data:`WINDOW_FUNCTIONS`)
+    with *length* points."""
+    try:
+        return WINDOW_FUNCTIONS[window.lower()](length)
+    except KeyError:
+        raise ValueError("'window' must be one of "
+                         "{}".format(list(WINDOW_FUNCTIONS.keys())))
+
+
+def segment_signal(data, segment_length, overlap=0.5):
+    """Return a strided, read-only view of *data* split into segments.
+
+    Parameters
+    ----------
+    data : ndarray
+        Data with dimension (samples x channels).
+    segment_length : int
+        The number of samples in each segment.
+    overlap : float
+        The fraction of a segment shared with the next segment, in [0, 1).
+
+    Returns
+    -------
+    ndarray
+        View with dimension (segments x segment_length x channels). Any
+        samples after the last whole segment are left out.
+    """
+    num_samples, num_channels = data.shape
+    step = max(int(segment_length * (1 - overlap)), 1)
+    num_segments = (num_samples - segment_length) // step + 1
+    return np.lib.stride_tricks.as_strided(
+        data,
+        shape=(num_segments, segment_length, num_channels),
+        strides=(step*data.strides[0], data.strides[0], data.strides[1]),
+        writeable=False)
+
+
+def welch_spectra(data, input_channel=0, segment_length=None, overlap=0.5,
+                  window='hann', sample_rate=1, scaling='spectrum',
+                  calibration_factor=1, block_size=64, band=None,
+                  num_points=1024):
+    """Estimate the auto-spectra of all the channels of *data*, and their
+    cross-spectra with *input_channel*, by averaging over segments.
+
+    Parameters
+    ----------
+    data : ndarray
+        Time series with dimension (samples x channels), or a 1d time series.
+        Any numeric type, including integer samples and memory-mapped data.
+    input_channel : int
+        Index of the channel used as the input for the cross-spectra.
+    segment_length : int, optional
+        The number of samples in each segment. Defaults to the whole record,
+        which gives a single-shot estimate.
+    overlap : float
+        The fraction of a segment shared with the next segment, in [0, 1).
+    window : str
+        The window applied to each segment. See :data:`WINDOW_FUNCTIONS`.
+    sample_rate : float
+        The sample rate of the data, used for the ``'density'`` scaling.
+    scaling : str
+        ``'spectrum'`` for the mean squared magnitude of the windowed FFT
+        (the same scale as ``rfft(time_series * window)``), or ``'density'``
+        for one-sided spectral densities.
+    calibration_factor : float
+        Factor to convert the samples to physical values.
+    block_size : int
+        The number of segments transformed at once.
+    band : tuple, optional
+        The first and last frequency (Hz) of a band to compute the spectra
+        in, with the chirp-z transform. Defaults to all the frequencies of
+        the rfft of the segments.
+    num_points : int
+        The number of frequencies in the *band*.
+
+    Returns
+    -------
+    :class:`AveragedSpectra`
+    """
+    data = np.asarray(data)
+    if data.ndim == 1:
+        data = data.reshape((-1, 1))
+    num_samples = data.shape[0]
+    if not segment_length or segment_length > num_samples:
+        segment_length = num_samples
+    segment_length = int(segment_length)
+
+    segments = segment_signal(data, segment_length, overlap)
+    num_segments = segments.shape[0]
+    w = get_window(window, segment_length).reshape((1, -1, 1))
+
+    if band is None:
+        frequencies = None
+        num_freqs = segment_length//2 + 1
+    else:
+        frequencies = zoom_frequencies(band[0], band[1], num_points)
+        num_freqs = frequencies.size
+    auto_spectra = np.zeros((num_freqs, data.shape[1]))
+    cross_spectra = np.zeros((num_freqs, data.shape[1]), dtype=np.complex128)
+
+    for start in range(0, num_segments, block_size):
+        if band is None:
+            block = rfft(segments[start:start+block_size] * w, axis=1)
+        else:
+            block = zoom_fft(segments[start:start+block_size] * w, band[0],
+                             band[1], num_points, sample_rate, axis=1)[1]
+        if calibration_factor != 1:
+            block *= calibration_factor
+        auto_spectra += np.sum(block.real**2 + block.imag**2, axis=0)
+        cross_spectra += np.einsum('sf,sfc->fc',
+                                   block[:, :, input_channel].conj(), block)
+
+    auto_spectra /= num_segments
+    cross_spectra /= num_segments
+    # A single segment keeps its phase
+    spectra = block[0] if num_segments == 1 and scaling == 'spectrum' else None
+
+    if scaling == 'density':
+        scale = 1 / (sample_rate * np.sum(w**2))
+        # Fold the negative frequencies onto the positive ones
+        if frequencies is None:
+            one_sided = np.full(num_freqs, 2.0)
+            one_sided[0] = 1
+            if segment_length % 2 == 0:
+                one_sided[-1] = 1
+        else:
+            one_sided = np.where((frequencies > 0) &
+                                 (frequencies < sample_rate/2), 2.0, 1.0)
+        scale = (scale * one_sided).reshape((-1, 1))
+        auto_spectra *= scale
+        cross_spectra *= scale
+    elif scaling != 'spectrum':
+        raise ValueError("'scaling' must be 'spectrum' or 'density'")
+
+    return AveragedSpectra(auto_spectra, cross_spectra, input_channel,
+                           num_segments, segment_length, sample_rate,
+                           frequencies, spectra)
+
+
+def welch_spectra_columns(data, start, stop, input_channel=0, **kwargs):
+    """Estimate the spectra of the channels *start* to *stop* of *data* with
+    :func:`welch_spectra`, and their cross-spectra with *input_channel*.
+    Used to estimate the spectra of blocks of channels in parallel.
+
+    Returns
+    -------
+    :class:`AveragedSpectra`
+        The spectra of the input channel, followed by those of the channels
+        *start* to *stop*, with input channel 0. If *input_channel* is None,
+        only the spectra of the channels *start* to *stop*.
+    """
+    data = np.asarray(data)
+    if input_channel is None:
+        return welch_spectra(data[:, start:stop], input_channel=0, **kwargs)
+    columns = np.append(input_channel, np.arange(start, stop))
+    return welch_spectra(data[:, columns], input_channel=0, **kwargs)
+
+
+def amplitude_spectrum(time_series, segment_length=None, overlap=0.5,
+                       window='hann', sample_rate=1):
+    """Return the spectrum of the 1d *time_series*: the amplitude spectrum
+    averaged over segments if *segment_length* is shorter than the time
+    series, otherwise the complex spectrum of the whole windowed record."""
+    time_series = np.asarray(time_series)
+    if segment_length and segment_length < time_series.size:
+        spectra = welch_spectra(time_series, segment_length=segment_length,
+                                overlap=overlap, window=window,
+                                sample_rate=sample_rate)
+        return spectra.amplitude_spectra()[:, 0]
+    return rfft(time_series * get_window(window, time_series.size))
+
+
+class AveragedSpectra(object):
+    """The spectra estimated by :func:`welch_spectra`.
+
+    Attributes
+    ----------
+    auto_spectra : ndarray
+        The auto-spectrum of each channel, with dimension
+        (frequencies x channels).
+    cross_spectra : ndarray
+        The cross-spectrum of the input channel with each channel
+        (``conj(X_in) * X``), with dimension (frequencies x channels).
+    input_channel : int
+        Index of the input channel.
+    num_averages : int
+        The number of segments averaged.
+    segment_length : int
+        The number of samples in each segment.
+    sample_rate : float
+        The sample rate of the data.
+    frequencies : ndarray or None
+        The frequency (Hz) of each spectral line, if the spectra were only
+        computed in a band.
+    spectra : ndarray or None
+        The complex spectrum of each channel, with dimension
+        (frequencies x channels), if a single segment was transformed.
+    """
+    def __init__(self, auto_spectra, cross_spectra, input_channel,
+                 num_averages, segment_length, sample_rate, frequencies=None,
+                 spectra=None):
+        self.auto_spectra = auto_spectra
+        self.cross_spectra = cross_spectra
+        self.input_channel = input_channel
+        self.num_averages = num_averages
+        self.segment_length = segment_length
+        self.sample_rate = sample_rate
+        self.frequencies = frequencies
+        self.spectra = spectra
+
+    def frequency(self):
+        """Return the frequency (Hz) of each spectral line."""
+        if self.frequencies is not None:
+            return self.frequencies
+        return np.arange(self.auto_spectra.shape[0]) * \
+            self.sample_rate / self.segment_length
+
+    def amplitude_spectra(self):
+        """Return the averaged amplitude spectrum of each channel."""
+        return np.sqrt(self.auto_spectra)
+
+    def spectrum(self):
+        """Return the complex spectrum of each channel if a single segment
+        was transformed, otherwise the averaged amplitude spectrum."""
+        if self.spectra is not None:
+            return self.spectra
+        return self.amplitude_spectra()
+
+    def transfer_function(self, estimator='H1'):
+        """Return the transfer function from the input channel to each
+        channel, using *estimator* (any of 'H1', 'H2', 'Hv')."""
+        autospec_in = self.auto_spectra[:, [self.input_channel]]
+        return transfer_function(autospec_in, self.auto_spectra,
+                                 self.cross_spectra, estimator)
+
+    def coherence(self):
+        """Return the coherence between the input channel and each channel."""
+        autospec_in = self.auto_spectra[:, [self.input_channel]]
+        return coherence(autospec_in, self.auto_spectra, self.cross_spectra)
+
+
+def transfer_function(autospec_in, autospec_out, crossspec, estimator='H1'):
+    """Return the transfer function estimated from the input and output
+    auto-spectra (Gxx and Gyy) and the cross-spectrum (Gxy = conj(X)Y).
+
+    * ``'H1'`` - Gxy / Gxx, which is unbiased by noise on the output.
+    * ``'H2'`` - Gyy / Gyx, which is unbiased by noise on the input.
+    * ``'Hv'`` - The geometric mean of H1 and H2, with the phase of Gxy.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if estimator == 'H1':
+            return crossspec / autospec_in
+        elif estimator == 'H2':
+            return autospec_out / np.conj(crossspec)
+        elif estimator == 'Hv':
+            return np.exp(1j*np.angle(crossspec)) * \
+                np.sqrt(np.real(autospec_out) / np.real(autospec_in))
+    raise ValueError("'estimator' must be one of "
+                     "{}".format(TRANSFER_FUNCTION_ESTIMATORS))
+
+
+def coherence(autospec_in, autospec_out, crossspec):
+    """Return the coherence |Gxy|^2 / (Gxx Gyy) from the input and output
+    auto-spectra and the cross-spectrum."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.real(crossspec * np.conj(crossspec)) / \
+            np.real(autospec_in * autospec_out)
+
+
+class SpectralAccumulator(object):
+    """Running average of the auto- and cross-spectra of a series of
+    recordings.
+
+    Only the (weighted) sums of the spectra are kept, so adding an average
+    costs O(frequencies) time and memory, however many averages were taken.
+    The last *max_undo* averages are also kept so they can be undone.
+
+    With a *forgetting_factor* below 1 the average is exponential: the sums
+    are multiplied by the factor before each new average is added, so the
+    older averages fade out. A factor of 1 gives the usual linear average.
+
+    Attributes
+    ----------
+    autospec_in_sum : ndarray or None
+        The weighted sum of the input auto-spectra, with dimension
+        (frequencies).
+    autospec_out_sum : ndarray or None
+        The weighted sum of the output auto-spectra, with dimension
+        (frequencies x channels).
+    crossspec_sum : ndarray or None
+        The weighted sum of the cross-spectra, with dimension
+        (frequencies x channels).
+    weight : float
+        The sum of the weights of the averages.
+    count : int
+        The number of averages taken.
+    forgetting_factor : float
+        The factor in (0, 1] applied to the sums before each new average.
+    max_undo : int
+        The number of averages that can be undone.
+    """
+    def __init__(self, forgetting_factor=1.0, max_undo=16):
+        self.max_undo = max_undo
+        self.set_forgetting_factor(forgetting_factor)
+        self.clear()
+
+    def set_forgetting_factor(self, forgetting_factor):
+        """Set the factor applied to the sums before each new average. The
+        averages already taken keep the factor they were added with."""
+        if not 0 < forgetting_factor <= 1:
+            raise ValueError("'forgetting_factor' must be in (0, 1]")
+        self.forgetting_factor = float(forgetting_factor)
+
+    def clear(self):
+        """Remove all the averages."""
+        self.autospec_in_sum = None
+        self.autospec_out_sum = None
+        self.crossspec_sum = None
+        self.weight = 0.0
+        self.count = 0
+        self._history = deque(maxlen=self.max_undo)
+
+    def __len__(self):
+        return self.count
+
+    def add(self, autospec_in, autospec_out, crossspec):
+        """Add the auto-spectrum of the input, and the auto- and cross-spectra
+        of the outputs, of one recording to the average.
+
+        Raises a ValueError if their shapes do not match the averages
+        already taken."""
+        autospec_in = np.asarray(autospec_in, dtype=np.float64)
+        autospec_out = np.asarray(autospec_out, dtype=np.float64)
+        crossspec = np.asarray(crossspec, dtype=np.complex128)
+
+        if self.count == 0:
+            self.autospec_in_sum = np.zeros_like(autospec_in)
+            self.autospec_out_sum = np.zeros_like(autospec_out)
+            self.crossspec_sum = np.zeros_like(crossspec)
+        elif not (autospec_in.shape == self.autospec_in_sum.shape and
+                  autospec_out.shape == self.autospec_out_sum.shape and
+                  crossspec.shape == self.crossspec_sum.shape):
+            raise ValueError("The shape of the spectra does not match the "
+                             "averages already taken")
+
+        factor = self.forgetting_factor
+        for total, new in ((self.autospec_in_sum, autospec_in),
+                           (self.autospec_out_sum, autospec_out),
+                           (self.crossspec_sum, crossspec)):
+            if factor != 1:
+                total *= factor
+            total += new
+        self.weight = factor*self.weight + 1
+        self.count += 1
+        self._history.append((factor, autospec_in, autospec_out, crossspec))
+
+    def undo(self):
+        """Remove the last average added. Returns False if there is no
+        average that can be undone."""
+        if not self._history:
+            return False
+        factor, autospec_in, autospec_out, crossspec = self._history.pop()
+        self.count -= 1
+        if self.count == 0:
+            self.clear()
+            return True
+
+        for total, new in ((self.autospec_in_sum, autospec_in),
+                           (self.autospec_out_sum, autospec_out),
+                           (self.crossspec_sum, crossspec)):
+            total -= new
+            if factor != 1:
+                total /= factor
+        self.weight = (self.weight - 1) / factor
+        return True
+
+    @property
+    def undo_depth(self):
+        """The number of averages that can be undone."""
+        return len(self._history)
+
+    def averages(self):
+        """Return the averaged input auto-spectrum, output auto-spectra and
+        cross-spectra, or None if no average was taken."""
+        if self.count == 0:
+            return None
+        return (self.autospec_in_sum / self.weight,
+                self.autospec_out_sum / self.weight,
+                self.crossspec_sum / self.weight)
+
+    def transfer_function(self, estimator='H1'):
+        """Return the transfer function from the input to each output, using
+        *estimator* (any of 'H1', 'H2', 'Hv')."""
+        autospec_in, autospec_out, crossspec = self.averages()
+        return transfer_function(self._as_column(autospec_in), autospec_out,
+                                 crossspec, estimator)
+
+    def coherence(self):
+        """Return the coherence between the input and each output."""
+        autospec_in, autospec_out, crossspec = self.averages()
+        return coherence(self._as_column(autospec_in), autospec_out,
+                         crossspec)
+
+    def _as_column(self, autospec_in):
+        # Broadcast the input over the output channels
+        if autospec_in.ndim < self.autospec_out_sum.ndim:
+            return autospec_in.reshape((-1, 1))
+        return autospec_in
+
+    def save(self, filename):
+        """Save the state of the average, including the averages that can be
+        undone, to *filename* in the numpy ``.npz`` format."""
+        state = {'forgetting_factor': self.forgetting_factor,
+                 'max_undo': self.max_undo,
+                 'weight': self.weight,
+                 'count': self.count}
+        if self.count:
+            state.update(
+                autospec_in_sum=self.autospec_in_sum,
+                autospec_out_sum=self.autospec_out_sum,
+                crossspec_sum=self.crossspec_sum,
+                history_factors=np.array([h[0] for h in self._history]),
+                history_autospec_in=np.array([h[1] for h in self._history]),
+                history_autospec_out=np.array([h[2] for h in self._history]),
+                history_crossspec=np.array([h[3] for h in self._history]))
+        np.savez(filename, **state)
+
+    @classmethod
+    def load(cls, filename):
+        """Return the average saved to *filename* by :meth:`save`."""
+        with np.load(filename) as state:
+            accumulator = cls(float(state['forgetting_factor']),
+                              int(state['max_undo']))
+            if int(state['count']):
+                accumulator.autospec_in_sum = state['autospec_in_sum']
+                accumulator.autospec_out_sum = state['autospec_out_sum']
+                accumulator.crossspec_sum = state['crossspec_sum']
+                accumulator.weight = float(state['weight'])
+                accumulator.count = int(state['count'])
+                accumulator._history.extend(zip(
+                    state['history_factors'].tolist(),
+                    state['history_autospec_in'],
+                    state['history_autospec_out'],
+                    state['history_crossspec']))
+        return accumulator
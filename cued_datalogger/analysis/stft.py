@@ -0,0 +1,147 @@
+"""
+Short-time Fourier transform of long, real time series.
+
+The time series is split into frames as a strided view, so the frames are
+never copied as a whole, and the frames are transformed in blocks with one
+real FFT per block. Each block is written straight into the output array,
+which can be preallocated by the caller, eg. as a memory-mapped file, so the
+memory used only depends on the output and the block size.
+
+The values are scaled the same way as ``scipy.signal.spectrogram`` with
+``mode='complex'`` and the same window.
+
+With *pool*, the magnitudes of consecutive frames are max-pooled into each
+output frame, for an overview of a long time series that still covers every
+sample, without keeping all the frames.
+
+Example:
+    | >>>frequencies, times, sonogram = stft(time_series, 1024, step=256,
+    | ...                                    sample_rate=44100)
+    | >>>out = np.memmap('sonogram.dat', np.complex64, 'w+',
+    | ...                shape=stft_shape(time_series.size, 1024, 256))
+    | >>>stft(time_series, 1024, step=256, sample_rate=44100, out=out)
+"""
+import numpy as np
+from numpy.fft import rfft
+
+import scipy.signal
+
+STFT_OUTPUTS = ['complex', 'magnitude']
+
+
+def stft_shape(num_samples, window_width, step, pool=1):
+    """Return the shape (frames x frequencies) of the STFT of *num_samples*
+    with frames of *window_width* samples every *step* samples, with *pool*
+    frames max-pooled into each output frame."""
+    num_frames = max((num_samples - window_width) // step + 1, 0)
+    return (-(-num_frames // pool), window_width // 2 + 1)
+
+
+def frame_signal(time_series, window_width, step):
+    """Return a strided, read-only view of the 1d *time_series* split into
+    frames of *window_width* samples every *step* samples, with dimension
+    (frames x window_width). Any samples after the last whole frame are
+    left out."""
+    num_frames = stft_shape(time_series.size, window_width, step)[0]
+    return np.lib.stride_tricks.as_strided(
+        time_series,
+        shape=(num_frames, window_width),
+        strides=(step*time_series.strides[0], time_series.strides[0]),
+        writeable=False)
+
+
+def stft(time_series, window_width=256, step=None, window='hann',
+         sample_rate=1, detrend=True, output='complex', dtype=None, out=None,
+         block_size=None, pool=1):
+    """Compute the one-sided short-time Fourier transform of the real
+    *time_series*.
+
+    Parameters
+    ----------
+    time_series : ndarray
+        The real 1d time series. Any numeric type, including memory-mapped
+        data.
+    window_width : int
+        The number of samples in each frame.
+    step : int, optional
+        The number of samples between the start of each frame. Defaults to
+        *window_width*, ie. no overlap.
+    window : str
+        Any window accepted by ``scipy.signal.get_window``.
+    sample_rate : float
+        The sample rate of the time series.
+    detrend : bool
+        Whether to remove the mean of each frame before transforming it.
+    output : str
+        ``'complex'`` for the complex STFT, or ``'magnitude'`` for its
+        absolute value.
+    dtype : numpy dtype, optional
+        The type of the output. Defaults to complex64 for ``'complex'`` and
+        float32 for ``'magnitude'``.
+    out : ndarray, optional
+        The array to write the output to, with the shape given by
+        :func:`stft_shape`, eg. a memory-mapped array.
+    block_size : int, optional
+        The number of frames transformed at once. Defaults to a block of
+        about 4M samples.
+    pool : int
+        The number of consecutive frames whose magnitudes are max-pooled
+        into each output frame. Requires ``output='magnitude'``.
+
+    Returns
+    -------
+    frequencies : ndarray
+        The frequency (Hz) of each column of the output.
+    times : ndarray
+        The time (s) of the centre of each (pooled) frame.
+    out : ndarray
+        The STFT, with dimension (frames x frequencies).
+    """
+    time_series = np.asarray(time_series)
+    if step is None:
+        step = window_width
+    window_width = int(window_width)
+    step = max(int(step), 1)
+    pool = max(int(pool), 1)
+    if not output in STFT_OUTPUTS:
+        raise ValueError("'output' must be one of {}".format(STFT_OUTPUTS))
+    if pool > 1 and output != 'magnitude':
+        raise ValueError("Pooling requires output='magnitude'")
+
+    shape = stft_shape(time_series.size, window_width, step, pool)
+    if out is None:
+        if dtype is None:
+            dtype = np.complex64 if output == 'complex' else np.float32
+        out = np.empty(shape, dtype=dtype)
+    elif not out.shape == shape:
+        raise ValueError("'out' must have shape {}".format(shape))
+
+    if block_size is None:
+        block_size = max(2**22 // window_width, 1)
+    # Whole groups of pooled frames in each block
+    block_size = -(-block_size // pool) * pool
+
+    w = scipy.signal.get_window(window, window_width)
+    # Same scaling as scipy.signal.spectrogram(mode='complex')
+    w = w * np.sqrt(1 / (sample_rate * np.sum(w**2)))
+    # The transform of the window, to remove the mean of the frames after
+    # transforming them instead of copying them
+    w_transform = rfft(w)
+
+    frames = frame_signal(time_series, window_width, step)
+    for start in range(0, frames.shape[0], block_size):
+        block = frames[start:start+block_size]
+        spectrum = rfft(block * w, axis=1)
+        if detrend:
+            spectrum -= np.outer(block.mean(axis=1), w_transform)
+        if output == 'magnitude':
+            spectrum = np.abs(spectrum)
+        if pool > 1:
+            spectrum = np.maximum.reduceat(
+                spectrum, np.arange(0, block.shape[0], pool), axis=0)
+        out[start//pool:start//pool+spectrum.shape[0]] = spectrum
+
+    frequencies = np.arange(shape[1]) * sample_rate / window_width
+    times = (np.arange(shape[0]) * pool * step + (pool - 1) * step / 2
+             + window_width / 2) / sample_rate
+    return frequencies, times, out
@@ -27,9 +27,11 @@ class TimeDomainWidget(InteractivePlotWidget):
         self.clear()
         for channel in self.channels:
             if channel.is_dataset("time_series"):
-                self.plot(channel.data("time"),
-                          channel.data("time_series"),
-                          pen=channel.colour)
+                time_series = channel.dataset("time_series")
+                self.plot_decimated(channel.data("time"),
+                                    time_series.data,
+                                    pen=channel.colour,
+                                    pyramid=time_series.minmax_pyramid())
 
 
 class TimeToolbox(Toolbox):
@@ -0,0 +1,130 @@
+"""
+Zoom FFT: the spectrum of a time series over a band of frequencies only,
+computed with the chirp-z transform.
+
+The spectrum is evaluated at any number of equally spaced frequencies in the
+band, so fine resolution around a resonance does not need a huge zero-padded
+FFT of the whole record. The chirp-z transform is computed as a convolution
+with Bluestein's algorithm, with one FFT of the data and one inverse FFT of
+about the length of the data plus the number of points. The chirp filters
+only depend on the lengths and the band, so they are cached. All the rows of
+the data (eg. channels or segments) are transformed at once, in blocks.
+
+The values are scaled the same way as ``rfft``, so a band from 0 to half the
+sample rate with ``n//2 + 1`` points gives the same values as ``rfft`` of
+``n`` samples.
+
+Example:
+    | >>>frequencies, spectra = zoom_fft(data, 95, 105, num_points=2000,
+    | ...                                sample_rate=44100, axis=0)
+"""
+import numpy as np
+from numpy.fft import fft, ifft
+
+from cued_datalogger.api.numpy_extensions import ArrayCache
+
+_chirp_cache = ArrayCache(64*2**20)
+
+
+def zoom_frequencies(f_start, f_stop, num_points):
+    """Return the frequencies at which :func:`zoom_fft` evaluates the
+    spectrum: *num_points* from *f_start* to *f_stop* inclusive."""
+    return np.linspace(f_start, f_stop, num_points)
+
+
+def _fast_length(n):
+    """Return the smallest 2^a 3^b 5^c that is at least *n*."""
+    best = 2**int(np.ceil(np.log2(max(n, 1))))
+    power_5 = 1
+    while power_5 < best:
+        power_35 = power_5
+        while power_35 < best:
+            length = power_35
+            while length < n:
+                length *= 2
+            best = min(best, length)
+            power_35 *= 3
+        power_5 *= 5
+    return best
+
+
+def _chirps(num_samples, num_points, f_start, f_step):
+    """Return the pre-multiplier, the transformed chirp filter and the
+    post-multiplier of the chirp-z transform, with *f_start* and *f_step* as
+    fractions of the sample rate."""
+    key = (num_samples, num_points, f_start, f_step)
+    chirps = _chirp_cache.get(key)
+    if chirps is None:
+        length = _fast_length(num_samples + num_points - 1)
+        n = np.arange(num_samples, dtype=float)
+        k = np.arange(num_points, dtype=float)
+
+        # X_k = W^(k^2/2) sum_n x_n A^-n W^(n^2/2) W^-((k-n)^2/2)
+        # with A = exp(2 pi i f_start) and W = exp(-2 pi i f_step)
+        pre = np.exp(-2j*np.pi*f_start*n - 1j*np.pi*f_step*n**2)
+        post = np.exp(-1j*np.pi*f_step*k**2)
+        filter_ = np.zeros(length, dtype=complex)
+        filter_[:num_points] = np.exp(1j*np.pi*f_step*k**2)
+        filter_[length-num_samples+1:] = \
+            np.exp(1j*np.pi*f_step*n[:0:-1]**2)
+
+        chirps = {"pre": pre, "filter": fft(filter_), "post": post}
+        _chirp_cache.put(key, chirps)
+    return chirps["pre"], chirps["filter"], chirps["post"]
+
+
+def zoom_fft(data, f_start, f_stop, num_points=1024, sample_rate=1, axis=-1,
+             block_size=None):
+    """
+    Compute the spectrum of *data* at *num_points* frequencies from
+    *f_start* to *f_stop* inclusive, with the chirp-z transform.
+
+    Parameters
+    ----------
+    data : ndarray
+        The data, real or complex. Windowing, if any, must already have been
+        applied.
+    f_start : float
+        The first frequency of the band.
+    f_stop : float
+        The last frequency of the band.
+    num_points : int
+        The number of frequencies in the band.
+    sample_rate : float
+        The sample rate of the data.
+    axis : int
+        The axis of *data* to transform. All the other axes are transformed
+        at once.
+    block_size : int, optional
+        The number of rows transformed at once. Defaults to blocks of about
+        4M points.
+
+    Returns
+    -------
+    frequencies : ndarray
+        The frequencies (Hz) of the spectrum.
+    spectrum : ndarray
+        The complex spectrum, with *axis* replaced by the frequencies.
+    """
+    data = np.moveaxis(np.asarray(data), axis, -1)
+    num_samples = data.shape[-1]
+    num_points = int(num_points)
+    frequencies = zoom_frequencies(f_start, f_stop, num_points)
+    f_step = (frequencies[1] - frequencies[0]) if num_points > 1 else 0
+
+    pre, filter_, post = _chirps(num_samples, num_points,
+                                 f_start / sample_rate, f_step / sample_rate)
+    length = filter_.size
+
+    rows = data.reshape((-1, num_samples))
+    out = np.empty((rows.shape[0], num_points), dtype=complex)
+    if block_size is None:
+        block_size = max(2**22 // length, 1)
+    for start in range(0, rows.shape[0], block_size):
+        block = fft(rows[start:start+block_size] * pre, n=length, axis=-1)
+        block *= filter_
+        out[start:start+block_size] = \
+            ifft(block, axis=-1)[:, :num_points] * post
+
+    spectrum = out.reshape(data.shape[:-1] + (num_points,))
+    return frequencies, np.moveaxis(spectrum, -1, axis)
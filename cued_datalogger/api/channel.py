@@ -5,13 +5,19 @@ if __name__ == '__main__':
 import numpy as np
 import pyqtgraph as pg
 
-from cued_datalogger.api.numpy_extensions import MatlabList
+from cued_datalogger.api.numpy_extensions import (MatlabList, minmax_pyramid,
+                                                  stack_rows, to_dB)
 
 from PyQt5.QtCore import pyqtSignal, Qt
 from PyQt5.QtWidgets import (QWidget, QPushButton, QVBoxLayout,
                              QLineEdit, QCheckBox, QScrollArea,
                              QTreeWidget, QTreeWidgetItem, QHBoxLayout)
 
+# The quantities that DataSet.derived computes from the data
+DERIVED_QUANTITIES = ['magnitude', 'dB', 'phase', 'unwrapped_phase', 'real',
+                      'imag']
+
+
 class ChannelSet(object):
     """
     A group of channels, with methods for setting and getting data.
@@ -27,6 +33,11 @@ class ChannelSet(object):
     which uses tuple indexing, eg. ``channelset.channels[1, 2, range(5,10)]``,
     so that multiple channels can be selected easily.
 
+    Equal-length DataSets of several channels, eg. the time series of a
+    recording, can be stored as the rows of one contiguous array with
+    :meth:`set_channel_block`, so that each channel's data is a view of the
+    array and :meth:`channel_block` returns all of it without copying.
+
 
     Attributes
     ----------
@@ -95,6 +106,42 @@ class ChannelSet(object):
         else:
             self.channels[channel_index].set_data(id_, data)
 
+    def set_channel_block(self, channel_index, id_, data, units=None,
+                          axis=0):
+        """Set the data of DataSet with *id\_* in the Channels specified by
+        *channel_index* (a tuple, or None for all the Channels) to the rows
+        of the 2D array *data*, creating the DataSets if needed.
+
+        The data is stored as one contiguous array, (channels x samples),
+        with the data of each Channel a view of its row. *axis* is the
+        channel axis of *data*: eg. ``axis=1`` for a (samples x channels)
+        recording, which is transposed in a single copy. A contiguous
+        (channels x samples) array is stored without copying."""
+        if channel_index is None:
+            channels = list(self.channels)
+        elif isinstance(channel_index, tuple):
+            channels = self.channels[channel_index]
+        else:
+            channels = [self.channels[channel_index]]
+        block = np.ascontiguousarray(np.moveaxis(np.asarray(data), axis, 0))
+        if block.ndim != 2 or block.shape[0] != len(channels):
+            raise ValueError("'data' must have one row per channel.")
+
+        for channel, row in zip(channels, block):
+            channel.add_dataset(id_, units, row)
+
+    def channel_block(self, channel_index, id_):
+        """Return the data from the DataSet given by *id\_* in the Channels
+        specified by *channel_index* (a tuple, or None for all the Channels)
+        as a 2D array (channels x samples). If the data was stored with
+        :meth:`set_channel_block`, in the same order, it is a view of the
+        stored array; otherwise the data of the channels is copied."""
+        if channel_index is None:
+            channel_index = tuple(range(len(self)))
+        elif not isinstance(channel_index, tuple):
+            channel_index = (channel_index,)
+        return stack_rows(self.channel_data(channel_index, id_))
+
     def set_channel_units(self, channel_index, id_, units):
         """Set the units of DataSet with *id\_* to *units* in the Channel
         specified by *channel_index*."""
@@ -229,7 +276,8 @@ class Channel(object):
         (eg. ``'Input 0'``, or ``'Left Accelerometer'``).
 
     datasets : list
-        A list of this Channel's DataSets.
+        A list of this Channel's DataSets. DataSets are looked up by id\_
+        through an index, so the list must not be modified directly.
 
     comments : str
         A string for any additional comments.
@@ -271,6 +319,7 @@ class Channel(object):
         self.calibration_factor = calibration_factor
         self.transfer_function_type = transfer_function_type
         self.datasets = []
+        self._dataset_index = {}
         self.colour = colour
 
         # Create the auto-generated datasets
@@ -282,8 +331,6 @@ class Channel(object):
         for ds in datasets:
             self.add_dataset(ds.id_, ds.units, ds.data)
 
-        self.update_autogenerated_datasets()
-
     def info(self):
         """Print this Channel's attributes, including DataSet ids
         and metadata."""
@@ -308,44 +355,46 @@ class Channel(object):
     def is_dataset(self, id_):
         """Return a boolean of whether the dataset given by *id\_*
         exists with data already."""
-        for ds in self.datasets:
-            if ds.id_ == id_:
-                if len(ds.data):
-                    return True
-        return False
+        ds = self._dataset_index.get(id_)
+        return ds is not None and len(ds) > 0
 
     def add_dataset(self, id_, units=None, data=[]):
         """Create a new dataset in this channel with *id\_*, *units*, *data*.
         If a dataset given by *id\_* exists set its units and data."""
         # If it does not already exist, add it
-        if not id_ in self.ids():
-            self.datasets.append(DataSet(id_, units, data))
-            self.update_autogenerated_datasets()
+        if not id_ in self._dataset_index:
+            if id_ in AutogeneratedDataSet.generated_ids:
+                ds = AutogeneratedDataSet(id_, self, units, data)
+            else:
+                ds = DataSet(id_, units, data)
+            self.datasets.append(ds)
+            self._dataset_index[id_] = ds
         else:
             # If a dataset already exist, then set its data
             self.set_data(id_, data)
             if units is not None:
                 self.set_units(id_, units)
-            self.update_autogenerated_datasets()
+
+    def add_lazy_dataset(self, id_, units=None, source=None):
+        """Create a new :class:`LazyDataSet` in this channel with *id\_* and
+        *units*, whose data is only read from *source* (eg. a dataset in an
+        HDF5 file) when it is first accessed. Replaces any dataset given by
+        *id\_*."""
+        ds = LazyDataSet(id_, units, source)
+        if id_ in self._dataset_index:
+            self.datasets.remove(self._dataset_index[id_])
+        self.datasets.append(ds)
+        self._dataset_index[id_] = ds
 
     def set_data(self, id_, data):
         """Set the data in dataset *id\_* to *data*."""
         # Set the data for a pre-existing DataSet
-        for ds in self.datasets:
-            if ds.id_ == id_:
-                ds.set_data(data)
-                self.update_autogenerated_datasets()
-                return
-        raise ValueError("No such DataSet '{}'".format(id_))
+        self._get_dataset(id_).set_data(data)
 
     def set_units(self, id_, units):
         """Set the units of dataset *id\_* to *units*."""
         # Set the units for a pre-existing DataSet
-        for ds in self.datasets:
-            if ds.id_ == id_:
-                ds.set_units(units)
-                return
-        raise ValueError("No such DataSet '{}'".format(id_))
+        self._get_dataset(id_).set_units(units)
 
     def set_metadata(self, metadata_dict):
         """Set the channel metadata to the metadata given in
@@ -357,32 +406,33 @@ class Channel(object):
             else:
                 raise ValueError("No such metadata '{}'".format(metadata_name))
 
+    def _get_dataset(self, id_):
+        try:
+            return self._dataset_index[id_]
+        except KeyError:
+            raise ValueError("No such DataSet '{}'".format(id_))
+
     def dataset(self, id_):
         """Return the DataSet in this channel with *id\_*."""
-        for ds in self.datasets:
-            if ds.id_ == id_:
-                return ds
-        raise ValueError("No such DataSet {}".format(id_))
+        return self._get_dataset(id_)
 
     def ids(self):
         """Return a list of the DataSet ids that this channel has."""
         # Get a list of the datasets that this channel has
-        return [ds.id_ for ds in self.datasets]
+        return list(self._dataset_index.keys())
 
     def data(self, id_):
         """Return the data from the DataSet given by *id\_*."""
-        for ds in self.datasets:
-            if ds.id_ == id_:
-                return ds.data
-        # If no dataset found, return an empty array instead
-        raise ValueError("No such DataSet {}".format(id_))
+        return self._get_dataset(id_).data
+
+    def derived_data(self, id_, quantity):
+        """Return the *quantity* derived from the data of the DataSet given by
+        *id\_* (see :meth:`DataSet.derived`)."""
+        return self._get_dataset(id_).derived(quantity)
 
     def units(self, id_):
         """Return the units from the DataSet given by *id\_*."""
-        for ds in self.datasets:
-            if ds.id_ == id_:
-                return ds.units
-        raise ValueError("No such DataSet {}".format(id_))
+        return self._get_dataset(id_).units
 
     def metadata(self, metadata_id=None):
         """Return the value of this channel's metadata associated with
@@ -402,22 +452,43 @@ class Channel(object):
                         return value
 
     def update_autogenerated_datasets(self):
-        """Regenerate the values in the automatically generated DataSets."""
-        if self.is_dataset("time_series") or self.is_dataset("sonogram"):
-            t = self.dataset("time")
-            t.set_data(np.linspace(0, self.data("time_series").size / self.sample_rate, self.data("time_series").size))
+        """Regenerate the values in the automatically generated DataSets.
+
+        The automatically generated DataSets are computed when they are
+        accessed, and recomputed whenever the length of the data they are
+        derived from or the sample rate change, so this is only needed if
+        their source data is modified in place."""
+        for id_ in AutogeneratedDataSet.generated_ids:
+            if id_ in self._dataset_index:
+                self._dataset_index[id_].clear_cache()
+
+    def autogenerated_key(self, id_):
+        """Return the (number of points, sample rate) that the automatically
+        generated DataSet *id\_* is computed from, or None if the data it is
+        derived from does not exist."""
+        if id_ == "time":
+            if self.is_dataset("time_series") or self.is_dataset("sonogram"):
+                return (self._get_dataset("time_series").size,
+                        self.sample_rate)
         # Both TF and FFT requires frequency bins
-        if self.is_dataset("spectrum") or self.is_dataset("transfer_function") or self.is_dataset("sonogram"):
-            if self.is_dataset("spectrum"):
-                data = self.data("spectrum")
-            elif self.is_dataset("transfer_function"):
-                data = self.data("transfer_function")
-            elif self.is_dataset("sonogram"):
-                data = self.data("sonogram")
-            f = self.dataset("frequency")
-            f.set_data(np.linspace(0, self.sample_rate/2, data.size))
-            w = self.dataset("omega")
-            w.set_data(self.data("frequency") * 2*np.pi)
+        elif id_ in ("frequency", "omega"):
+            for source_id in ("spectrum", "transfer_function", "sonogram"):
+                if self.is_dataset(source_id):
+                    return (self._get_dataset(source_id).size,
+                            self.sample_rate)
+        return None
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # Channels pickled before the DataSets were indexed store the
+        # automatically generated DataSets as plain DataSets
+        if not "_dataset_index" in state:
+            for i, ds in enumerate(self.datasets):
+                if (ds.id_ in AutogeneratedDataSet.generated_ids and
+                        not isinstance(ds, AutogeneratedDataSet)):
+                    self.datasets[i] = AutogeneratedDataSet(ds.id_, self,
+                                                            ds.units, ds.data)
+            self._dataset_index = {ds.id_: ds for ds in self.datasets}
 
 
 class DataSet(object):
@@ -466,6 +537,13 @@ class DataSet(object):
 
     * ``"transfer_function"``
 
+    * ``"zoom_spectrum"``, ``"zoom_transfer_function"``, ``"zoom_coherence"``
+      - The spectrum, transfer function and coherence computed in a band
+      with the zoom FFT
+
+    * ``"zoom_frequency"``, ``"zoom_omega"`` - The frequencies (Hz and rad)
+      of the zoom FFT
+
     (\* indicates that this DataSet is auto-generated by the Channel)
     """
     def __init__(self, id_, units=None, data=np.array([])):
@@ -482,7 +560,9 @@ class DataSet(object):
             permitted_ids = ["time_series", "time", "frequency", "omega", "spectrum",
                              "sonogram", "sonogram_frequency", "sonogram_time",
                              "sonogram_omega", "coherence", "transfer_function",
-                             "sonogram_phase", "sonogram_step"]
+                             "sonogram_phase", "sonogram_step",
+                             "zoom_spectrum", "zoom_transfer_function",
+                             "zoom_coherence", "zoom_frequency", "zoom_omega"]
             if id_ in permitted_ids:
                 self.id_ = id_
             else:
@@ -490,16 +570,242 @@ class DataSet(object):
         else:
             raise TypeError("'id_' must be a string type.")
 
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self.set_data(data)
+
     def set_data(self, data):
         """Set the DataSet's data array to *data*."""
         # Set the dataset data
-        self.data = np.asarray(data)
+        self._data = np.asarray(data)
+        # Any cached pyramid and derived quantities belong to the old data
+        self._pyramid = None
+        self._derived = None
+
+    @property
+    def shape(self):
+        """The shape of the data."""
+        return np.shape(self.data)
+
+    @property
+    def size(self):
+        """The number of elements in the data."""
+        return int(np.prod(self.shape))
+
+    def __len__(self):
+        return len(self.data)
+
+    def read(self, index=()):
+        """Return the part of the data given by *index*, eg. a slice."""
+        return np.asarray(self.data[index])
+
+    def derived(self, quantity):
+        """Return a quantity derived from the data for plotting, computing it
+        the first time it is needed. *quantity* can be any of 'magnitude',
+        'dB' (of the magnitude), 'phase' (deg), 'unwrapped_phase' (deg),
+        'real', 'imag'. The quantities are discarded when the data is set, so
+        the data must not be modified in place."""
+        data = self.data
+        if getattr(self, '_derived', None) is None:
+            self._derived = {}
+        if quantity not in self._derived:
+            if quantity == 'magnitude':
+                result = np.abs(data)
+            elif quantity == 'dB':
+                result = to_dB(self.derived('magnitude'))
+            elif quantity == 'phase':
+                result = np.angle(data, deg=True)
+            elif quantity == 'unwrapped_phase':
+                result = np.rad2deg(np.unwrap(np.angle(data)))
+            elif quantity == 'real':
+                result = np.real(data)
+            elif quantity == 'imag':
+                result = np.imag(data)
+            else:
+                raise ValueError("'quantity' must be one of {}"
+                                 .format(DERIVED_QUANTITIES))
+            self._derived[quantity] = result
+        return self._derived[quantity]
+
+    def minmax_pyramid(self):
+        """Return the min/max pyramid of the data (see
+        :func:`~cued_datalogger.api.numpy_extensions.minmax_pyramid`),
+        computing it the first time it is needed. Used for plotting
+        long real data with
+        :class:`~cued_datalogger.api.pyqtgraph_extensions.DecimatedPlotDataItem`."""
+        if getattr(self, '_pyramid', None) is None:
+            if np.iscomplexobj(self.data):
+                self._pyramid = []
+            else:
+                self._pyramid = minmax_pyramid(self.data)
+        return self._pyramid
+
+    def __getstate__(self):
+        # Do not pickle the cached pyramid and derived quantities, they can
+        # be recomputed
+        state = self.__dict__.copy()
+        state.pop('_pyramid', None)
+        state.pop('_derived', None)
+        return state
+
+    def __setstate__(self, state):
+        # DataSets pickled before data became a property store it as 'data'
+        if 'data' in state:
+            state['_data'] = state.pop('data')
+        self.__dict__.update(state)
 
     def set_units(self, units):
         """Set the DataSet's units to *units*."""
         self.units = units
 
 
+class LazyDataSet(DataSet):
+    """
+    A DataSet whose data is only read from its source, eg. a dataset in an
+    HDF5 file, when it is first accessed, so that opening a large file does
+    not read any data. The shape of the data and parts of it (see
+    :meth:`read`) are available without reading all of it.
+
+    Attributes
+    ----------
+    source : array_like or None
+        Where the data is read from: any object with ``shape``, ``dtype``
+        and numpy-style indexing, eg. an ``h5py.Dataset`` or a memory-mapped
+        array. None once the data has been read or set.
+    """
+    def __init__(self, id_, units=None, source=None):
+        self.set_id(id_)
+        self.set_units(units)
+        self.source = source
+        self._data = None
+        self._pyramid = None
+        self._derived = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            if self.source is None:
+                self._data = np.array([])
+            else:
+                self._data = np.asarray(self.source[()])
+            self.source = None
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self.set_data(data)
+
+    def set_data(self, data):
+        """Set the DataSet's data array to *data*, replacing the source."""
+        super().set_data(data)
+        self.source = None
+
+    def is_loaded(self):
+        """Return whether the data has been read from the source."""
+        return self.source is None
+
+    @property
+    def shape(self):
+        if self.source is not None:
+            return tuple(self.source.shape)
+        return super().shape
+
+    def __len__(self):
+        if self.source is not None:
+            if not self.source.shape:
+                raise TypeError("len() of unsized object")
+            return self.source.shape[0]
+        return super().__len__()
+
+    def read(self, index=()):
+        """Return the part of the data given by *index*, eg. a slice, only
+        reading that part from the source if the data has not been read."""
+        if self.source is not None:
+            return np.asarray(self.source[index])
+        return super().read(index)
+
+    def __getstate__(self):
+        # The source cannot be pickled, so read the data
+        self.data
+        return super().__getstate__()
+
+
+class AutogeneratedDataSet(DataSet):
+    """
+    A DataSet whose data is generated from the other DataSets of its Channel.
+
+    The data is computed when it is first accessed, and cached until the
+    number of points it is derived from or the sample rate of the Channel
+    change. If the data it is derived from does not exist, the data set
+    with :meth:`set_data` is returned instead.
+
+    Attributes
+    ----------
+    channel : Channel
+        The Channel that the data is generated from.
+    generated_ids : tuple
+        The ids of the DataSets that are generated.
+    """
+    generated_ids = ("time", "frequency", "omega")
+
+    def __init__(self, id_, channel, units=None, data=np.array([])):
+        self.channel = channel
+        super().__init__(id_, units, data)
+
+    @property
+    def data(self):
+        key = self.channel.autogenerated_key(self.id_)
+        if key is None:
+            if self._cache_key is not None:
+                self.clear_cache()
+            return self._data
+        if not key == self._cache_key:
+            num_points, sample_rate = key
+            if self.id_ == "time":
+                generated = np.linspace(0, num_points / sample_rate, num_points)
+            else:
+                generated = np.linspace(0, sample_rate/2, num_points)
+                if self.id_ == "omega":
+                    generated *= 2*np.pi
+            self._cache = generated
+            self._cache_key = key
+            self._pyramid = None
+            self._derived = None
+        return self._cache
+
+    @data.setter
+    def data(self, data):
+        self.set_data(data)
+
+    def set_data(self, data):
+        """Set the data returned when the data it is derived from does not
+        exist."""
+        super().set_data(data)
+        self.clear_cache()
+
+    def clear_cache(self):
+        """Discard the generated data, so that it is generated again."""
+        self._cache = None
+        self._cache_key = None
+        self._pyramid = None
+        self._derived = None
+
+    def __getstate__(self):
+        # Do not pickle the generated data, it can be recomputed
+        state = super().__getstate__()
+        state.pop('_cache', None)
+        state.pop('_cache_key', None)
+        return state
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self.clear_cache()
+
+
 class ChannelSelectWidget(QWidget):
     """
     A widget used in the Global Toolbox to select channels.
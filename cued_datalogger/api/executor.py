@@ -0,0 +1,337 @@
+"""
+Parallel execution of analysis tasks, eg. the spectra of each channel, on a
+pool of processes or threads.
+
+The arrays passed to the tasks on a process pool are copied once into shared
+memory, and only their names are sent to the workers, which map them without
+copying, instead of pickling them. An array passed to several tasks (eg. the
+time series of all the channels, split into blocks of channels) is shared
+once for all of them. The return values are pickled back as usual.
+
+While the tasks run, the progress is emitted and the Qt events are
+processed, so that the GUI stays responsive and the tasks can be cancelled.
+
+The FFTs of numpy and scipy release the GIL, so they already run in parallel
+on a thread pool, which shares the arrays for free. A process pool is only
+worth its start-up and copying costs for tasks that hold the GIL.
+
+Example:
+    | >>>executor = AnalysisExecutor('thread')
+    | >>>executor.sig_progress.connect(on_progress)
+    | >>>spectra = executor.map(amplitude_spectrum,
+    | ...                       [(ts,) for ts in time_series],
+    | ...                       segment_length=4096)
+
+Attributes
+----------
+EXECUTOR_MODES : list
+    The kinds of pool the tasks can run on.
+SHARED_MEMORY_THRESHOLD : int
+    The size (bytes) above which arrays are passed to the workers of a
+    process pool in shared memory. Smaller arrays are pickled.
+"""
+import os
+import concurrent.futures
+import multiprocessing
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from PyQt5.QtCore import QObject, QCoreApplication, pyqtSignal
+
+EXECUTOR_MODES = ['serial', 'thread', 'process']
+SHARED_MEMORY_THRESHOLD = 2**16
+# Time (s) between updates of the progress while waiting for the workers
+PROGRESS_INTERVAL = 0.05
+
+
+class AnalysisCancelled(Exception):
+    """Raised by :meth:`AnalysisExecutor.map` if it was cancelled."""
+    def __init__(self, message="Cancelled."):
+        super().__init__(message)
+
+
+class AnalysisBusy(AnalysisCancelled):
+    """Raised by :meth:`AnalysisExecutor.map` instead of running the tasks if
+    it is already running tasks, eg. when a slot called while the progress
+    is shown asks for more. Handled as a cancellation."""
+    def __init__(self, message="Skipped: the executor is already running "
+                               "tasks."):
+        super().__init__(message)
+
+
+# What is sent to the workers in place of a shared array
+SharedArrayDescriptor = namedtuple('SharedArrayDescriptor',
+                                   ['name', 'shape', 'dtype'])
+
+
+class SharedArray(object):
+    """
+    A numpy array in a block of shared memory.
+
+    Attributes
+    ----------
+    shm : :class:`multiprocessing.shared_memory.SharedMemory`
+        The shared memory.
+    array : ndarray
+        The array, using the shared memory as its buffer.
+    """
+    def __init__(self, shape, dtype, name=None):
+        """Create a new array with *shape* and *dtype* in shared memory, or
+        map the existing shared memory called *name*."""
+        dtype = np.dtype(dtype)
+        if name is None:
+            size = max(int(np.prod(shape)) * dtype.itemsize, 1)
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.array = np.ndarray(shape, dtype, buffer=self.shm.buf)
+
+    @classmethod
+    def copy(cls, array):
+        """Return a new SharedArray with a copy of *array*."""
+        array = np.asarray(array)
+        shared = cls(array.shape, array.dtype)
+        shared.array[...] = array
+        return shared
+
+    @classmethod
+    def attach(cls, descriptor):
+        """Return the SharedArray given by *descriptor*, created in another
+        process."""
+        return cls(descriptor.shape, descriptor.dtype, descriptor.name)
+
+    def descriptor(self):
+        """Return the picklable :data:`SharedArrayDescriptor` used to attach
+        to the array from another process."""
+        return SharedArrayDescriptor(self.shm.name, self.array.shape,
+                                     self.array.dtype.str)
+
+    def close(self):
+        """Unmap the shared memory from this process. Raises a BufferError
+        if views of the array still exist."""
+        self.array = None
+        self.shm.close()
+
+    def unlink(self):
+        """Unmap the shared memory, and free it once no process has it
+        mapped."""
+        try:
+            self.close()
+        except BufferError:
+            pass
+        self.shm.unlink()
+
+
+# The shared arrays mapped by this worker process, by name
+_attached = {}
+
+
+def _run_task(function, args, kwargs):
+    """Call *function* in a worker process, with the descriptors of shared
+    arrays in *args* replaced by the arrays."""
+    names = set()
+    resolved = []
+    for arg in args:
+        if isinstance(arg, SharedArrayDescriptor):
+            if not arg.name in _attached:
+                _attached[arg.name] = SharedArray.attach(arg)
+            resolved.append(_attached[arg.name].array)
+            names.add(arg.name)
+        else:
+            resolved.append(arg)
+
+    # Unmap the arrays of earlier tasks, unless they are still in use
+    for name in list(_attached):
+        if not name in names:
+            try:
+                _attached[name].close()
+            except BufferError:
+                continue
+            del _attached[name]
+
+    return function(*resolved, **kwargs)
+
+
+def _process_events():
+    if QCoreApplication.instance() is not None:
+        QCoreApplication.processEvents()
+
+
+class AnalysisExecutor(QObject):
+    """
+    Runs analysis tasks on a pool of processes or threads, with progress and
+    cancellation.
+
+    The pool is created when it is first needed and kept for later tasks.
+    With one worker, or a single task, the tasks run in the calling thread.
+
+    Attributes
+    ----------
+    mode : str
+        Any of :data:`EXECUTOR_MODES`.
+    max_workers : int
+        The number of workers in the pool.
+    busy : bool
+        Whether tasks are running.
+    sig_progress : pyqtSignal(int, int)
+        The signal emitted with the number of tasks done and the total
+        number of tasks.
+    sig_busy_changed : pyqtSignal(bool)
+        The signal emitted when tasks start and stop running.
+    """
+    sig_progress = pyqtSignal(int, int)
+    sig_busy_changed = pyqtSignal(bool)
+
+    def __init__(self, mode='process', max_workers=None, parent=None):
+        super().__init__(parent)
+        self._pool = None
+        self._cancelled = False
+        self.busy = False
+        self.set_mode(mode, max_workers)
+
+    def set_mode(self, mode, max_workers=None):
+        """Set the kind of pool, and the number of workers (by default the
+        number of CPUs)."""
+        if not mode in EXECUTOR_MODES:
+            raise ValueError("'mode' must be one of {}".format(EXECUTOR_MODES))
+        self.shutdown()
+        self.mode = mode
+        self.max_workers = max(int(max_workers or os.cpu_count() or 1), 1)
+
+    def num_workers(self):
+        """Return the number of tasks that can run at once."""
+        if self.mode == 'serial':
+            return 1
+        return self.max_workers
+
+    def chunks(self, num_items):
+        """Return the (start, stop) of blocks of *num_items* items (eg.
+        channels), about two per worker, to be processed as separate
+        tasks."""
+        if self.num_workers() == 1:
+            num_chunks = 1
+        else:
+            num_chunks = min(max(num_items, 1), 2*self.num_workers())
+        bounds = np.linspace(0, num_items, num_chunks + 1).astype(int).tolist()
+        return [(start, stop) for start, stop in zip(bounds[:-1], bounds[1:])
+                if stop > start]
+
+    def shutdown(self):
+        """Stop the workers of the pool."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def cancel(self):
+        """Cancel the tasks that are running. The tasks that have started
+        finish in the background, but their results are discarded."""
+        self._cancelled = True
+
+    def pool(self):
+        """Return the pool, creating it if needed."""
+        if self._pool is None:
+            if self.mode == 'process':
+                # Forking a process with running Qt threads is not safe
+                self._pool = concurrent.futures.ProcessPoolExecutor(
+                    self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn'))
+            else:
+                self._pool = concurrent.futures.ThreadPoolExecutor(
+                    self.max_workers)
+        return self._pool
+
+    def map(self, function, tasks, **kwargs):
+        """
+        Call ``function(*task, **kwargs)`` for each task in *tasks* on the
+        pool, and return the results in the same order.
+
+        On a process pool, *function* must be importable by the workers, ie.
+        defined at the top level of a module, and the arguments and results
+        must be picklable. Arrays larger than
+        :data:`SHARED_MEMORY_THRESHOLD` in the tasks are passed in shared
+        memory.
+
+        The Qt events are processed while the tasks run, so slots may ask
+        for more tasks meanwhile: they are not run, and
+        :class:`AnalysisBusy` is raised instead.
+
+        Raises :class:`AnalysisCancelled` if :meth:`cancel` is called before
+        all the tasks are done, and the first exception raised by a task.
+        """
+        tasks = [tuple(task) for task in tasks]
+        if self.busy:
+            raise AnalysisBusy()
+        self.busy = True
+        self._cancelled = False
+        self.sig_busy_changed.emit(True)
+        self.sig_progress.emit(0, len(tasks))
+        try:
+            if self.num_workers() == 1 or len(tasks) < 2:
+                return self._map_serial(function, tasks, kwargs)
+            elif self.mode == 'thread':
+                return self._map_pool(function, tasks, kwargs)
+            else:
+                return self._map_process(function, tasks, kwargs)
+        except concurrent.futures.BrokenExecutor:
+            # A worker died, start a new pool next time
+            self._pool = None
+            raise
+        finally:
+            self.busy = False
+            self.sig_busy_changed.emit(False)
+
+    def _map_serial(self, function, tasks, kwargs):
+        results = []
+        for task in tasks:
+            _process_events()
+            if self._cancelled:
+                raise AnalysisCancelled()
+            results.append(function(*task, **kwargs))
+            self.sig_progress.emit(len(results), len(tasks))
+        return results
+
+    def _map_pool(self, function, tasks, kwargs):
+        futures = [self.pool().submit(function, *task, **kwargs)
+                   for task in tasks]
+        pending = set(futures)
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending, timeout=PROGRESS_INTERVAL,
+                return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                # Stop at the first error
+                error = future.exception()
+                if error is not None:
+                    for future in pending:
+                        future.cancel()
+                    raise error
+            self.sig_progress.emit(len(futures) - len(pending), len(futures))
+            _process_events()
+            if self._cancelled:
+                for future in pending:
+                    future.cancel()
+                raise AnalysisCancelled()
+        return [future.result() for future in futures]
+
+    def _map_process(self, function, tasks, kwargs):
+        # Share each large array once, however many tasks use it
+        shared = {}
+
+        def share(arg):
+            if (isinstance(arg, np.ndarray) and
+                    arg.nbytes >= SHARED_MEMORY_THRESHOLD):
+                if not id(arg) in shared:
+                    shared[id(arg)] = SharedArray.copy(arg)
+                return shared[id(arg)].descriptor()
+            return arg
+
+        try:
+            process_tasks = [(function, tuple(share(arg) for arg in task),
+                              kwargs)
+                             for task in tasks]
+            return self._map_pool(_run_task, process_tasks, {})
+        finally:
+            for array in shared.values():
+                array.unlink()
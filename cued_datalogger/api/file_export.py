@@ -5,8 +5,10 @@ Created on Fri Sep  1 14:00:14 2017
 @author: eyt21
 """
 
+import json
+
 import scipy.io as sio
-from cued_datalogger.api.channel import ChannelSet
+from cued_datalogger.api.channel import ChannelSet, AutogeneratedDataSet
 import numpy as np
 from PyQt5.QtWidgets import (QWidget, QVBoxLayout,QPushButton,QLabel,QListWidget,
                              QTreeWidgetItem,QHBoxLayout,QFileDialog,QCheckBox)
@@ -14,6 +16,17 @@ from PyQt5.QtCore import  Qt
 from cued_datalogger.api.numpy_extensions import to_dB
 import pickle
 
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+# Identifies the HDF5 files written by export_to_hdf5
+HDF5_FORMAT = 'cued_datalogger'
+HDF5_VERSION = 1
+# The target size (bytes) of each chunk of the HDF5 datasets
+HDF5_CHUNK_BYTES = 2**20
+
 def export_to_mat(file,order, channel_set=None,back_comp = False):
     """
     Export data and metadata from ChannelsSet to a mat file.
@@ -64,7 +77,7 @@ def export_to_mat(file,order, channel_set=None,back_comp = False):
         calibration_factor = channel_set.channel_metadata(0,'calibration_factor')
         # Save Time Series
         if 'time_series' in var_names:
-            time_series_data = np.array(channel_set.channel_data(order,'time_series'))
+            time_series_data = channel_set.channel_block(order,'time_series')
             n_samples = time_series_data[0].shape[0]
             variables = {'indata':np.transpose(time_series_data),'freq':float(sampling_rate),
                          'dt2' :[float(len(order)),0,0],'buflen':float(n_samples),
@@ -73,7 +86,7 @@ def export_to_mat(file,order, channel_set=None,back_comp = False):
             sio.savemat(time_series_fname,variables,appendmat = False)
         # Save FFT
         if 'spectrum' in var_names:
-            fft_data = np.array(channel_set.channel_data(order,'spectrum'))
+            fft_data = channel_set.channel_block(order,'spectrum')
             n_samples = fft_data[0].shape[0]
             variables = {'yspec':np.transpose(fft_data),'freq':float(sampling_rate),
                          'dt2' :[0,float(len(order)),0],'npts':float((n_samples-1)*2),
@@ -94,15 +107,106 @@ def export_to_mat(file,order, channel_set=None,back_comp = False):
         if 'sonogram' in var_names:
             sono_data = channel_set.channel_data(order[0],'sonogram')
             if not sono_data.shape[0] == 0:
-                sono_phase = channel_set.channel_data(order[0],'sonogram_phase')
                 sono_step = channel_set.channel_data(order[0],'sonogram_step')
                 n_samples = sono_data[0].shape[0]
+                window_width = (n_samples-1)*2
+                # 'sonstep' is the overlap of the FFTs, as in the old logger.
+                # The frames of a pooled overview are further apart than the
+                # window, which gives a negative overlap
                 variables = {'yson':to_dB(np.abs(sono_data)),'freq':float(sampling_rate),
-                             'dt2' :[0,0,1],'npts':float((n_samples-1)*2),
-                             'sonstep':float(sono_step),'yphase': sono_phase}
+                             'dt2' :[0,0,1],'npts':float(window_width),
+                             'sonstep':float(window_width - sono_step)}
+                # Pooled sonograms only have the magnitude
+                if np.iscomplexobj(sono_data):
+                    variables['yphase'] = np.angle(sono_data)
                 time_series_fname = file[:-4]+'_sonogram.mat'
                 sio.savemat(time_series_fname,variables,appendmat = False)
             
+def export_to_hdf5(file, order, channel_set, compression='gzip',
+                   compression_level=4):
+    """
+    Export the data and metadata of the channels of a ChannelSet to an HDF5
+    file. Requires h5py.
+
+    Each channel is a group called ``channel_<n>``, with the channel
+    metadata as attributes, containing one dataset per DataSet (except the
+    automatically generated ones), with the units as an attribute. The
+    datasets are chunked and compressed, and written a block of chunks at a
+    time, so recordings larger than the memory can be exported. See
+    :func:`~cued_datalogger.api.file_import.import_from_hdf5`.
+
+    Parameters
+    ----------
+    file : path_to_file
+        The path to the HDF5 file to save the data to.
+    order : tuple
+        The indices of the channels to save, in order.
+    channel_set : ChannelSet
+        The ChannelSet to save the data and metadata from.
+    compression : str or None
+        The compression filter of the datasets: 'gzip', 'lzf' or None.
+    compression_level : int
+        The level of the 'gzip' compression, from 0 to 9.
+    """
+    if h5py is None:
+        raise ImportError("Exporting to HDF5 requires h5py.")
+
+    with h5py.File(file, 'w') as f:
+        f.attrs['format'] = HDF5_FORMAT
+        f.attrs['version'] = HDF5_VERSION
+        for n, channel_index in enumerate(order):
+            channel = channel_set.channels[channel_index]
+            group = f.create_group('channel_{}'.format(n))
+            group.attrs['index'] = n
+            group.attrs['name'] = channel.name
+            group.attrs['comments'] = channel.comments
+            group.attrs['tags'] = json.dumps(list(channel.tags))
+            group.attrs['sample_rate'] = channel.sample_rate
+            group.attrs['calibration_factor'] = channel.calibration_factor
+            # No attribute stands for None
+            if channel.transfer_function_type is not None:
+                group.attrs['transfer_function_type'] = \
+                    str(channel.transfer_function_type)
+
+            for dataset in channel.datasets:
+                # The generated data is generated again on import
+                if (isinstance(dataset, AutogeneratedDataSet) and
+                        channel.autogenerated_key(dataset.id_) is not None):
+                    continue
+                if not dataset.shape:
+                    h5_dataset = group.create_dataset(dataset.id_,
+                                                      data=dataset.data)
+                elif dataset.shape[0]:
+                    h5_dataset = _write_hdf5_dataset(group, dataset,
+                                                     compression,
+                                                     compression_level)
+                else:
+                    continue
+                if dataset.units is not None:
+                    h5_dataset.attrs['units'] = dataset.units
+
+
+def _write_hdf5_dataset(group, dataset, compression, compression_level):
+    """Write the DataSet to a chunked, compressed dataset in *group*, a
+    block of chunks at a time."""
+    shape = dataset.shape
+    dtype = dataset.read(slice(0, 0)).dtype
+    row_bytes = dtype.itemsize * int(np.prod(shape[1:]))
+    chunk_rows = int(min(max(HDF5_CHUNK_BYTES // max(row_bytes, 1), 1),
+                         shape[0]))
+    h5_dataset = group.create_dataset(
+        dataset.id_, shape, dtype,
+        chunks=(chunk_rows,) + tuple(shape[1:]),
+        compression=compression,
+        compression_opts=compression_level if compression == 'gzip' else None,
+        shuffle=compression is not None)
+
+    block_rows = 16*chunk_rows
+    for start in range(0, shape[0], block_rows):
+        stop = min(start + block_rows, shape[0])
+        h5_dataset[start:stop] = dataset.read(slice(start, stop))
+    return h5_dataset
+
 class DataExportWidget(QWidget):
     """
     A proof-of-concept widget to show that exporting data is possible.
@@ -141,6 +245,9 @@ class DataExportWidget(QWidget):
         self.back_comp_btn = QCheckBox('Backward Compatibility?',self)
         self.mat_export_btn = QPushButton('Export as MAT',self)
         self.mat_export_btn.clicked.connect(self.export_files)
+        self.hdf5_export_btn = QPushButton('Export as HDF5',self)
+        self.hdf5_export_btn.clicked.connect(self.export_hdf5)
+        self.hdf5_export_btn.setEnabled(h5py is not None)
         
         # TODO: Have a preview of what is being saved?
         layout.addWidget(QLabel('ChannelSet Saving Order',self))
@@ -149,6 +256,7 @@ class DataExportWidget(QWidget):
         layout.addWidget(self.pickle_export_btn)
         layout.addWidget(self.back_comp_btn)
         layout.addWidget(self.mat_export_btn)
+        layout.addWidget(self.hdf5_export_btn)
         
     def set_channel_set(self, channel_set):
         """
@@ -201,6 +309,15 @@ class DataExportWidget(QWidget):
             else:
                 export_to_mat(url,tuple(self.order), self.cs)
       
+    def export_hdf5(self):
+        """
+        Export the ChannelSet to an HDF5 file at the url selected
+        """
+        url = QFileDialog.getSaveFileName(self, "Export Data", "",
+                                           "HDF5 Files (*.h5 *.hdf5)")[0]
+        if url:
+            export_to_hdf5(url, tuple(self.order), self.cs)
+
     def pickle_file(self):
         '''
         This is probably a temporary solution to saving data.
@@ -1,6 +1,9 @@
 import sys,traceback
+import json
 import scipy.io as sio
-from cued_datalogger.api.channel import Channel, DataSet, ChannelSet
+from cued_datalogger.api.channel import (Channel, DataSet, ChannelSet,
+                                         AutogeneratedDataSet)
+from cued_datalogger.api.file_export import h5py, HDF5_FORMAT
 import numpy as np
 from PyQt5.QtWidgets import (QWidget, QVBoxLayout,QPushButton,QLabel,QTreeWidget,
                              QTreeWidgetItem,QHBoxLayout,QFileDialog)
@@ -118,6 +121,72 @@ def import_from_mat(file, channel_set=None):
     if new_channel_set:
         return channel_set
 
+def import_from_hdf5(file, channel_set=None):
+    """
+    A function for importing data and metadata to a ChannelSet from an HDF5
+    file written by
+    :func:`~cued_datalogger.api.file_export.export_to_hdf5`. Requires h5py.
+
+    The data is not read when importing: each DataSet is a
+    :class:`~cued_datalogger.api.channel.LazyDataSet` that reads its data
+    from the file when it is first accessed, so opening a large file is
+    instant and only the data that is used is read. The file stays open
+    until all the data has been read or the DataSets are deleted. The
+    automatically generated DataSets (eg. 'frequency') are read at once
+    instead, so that they are still generated from the other DataSets.
+
+    Parameters
+    ----------
+    file : path_to_file
+        The path to the HDF5 file to import data from.
+    channel_set : ChannelSet
+        The ChannelSet to save the imported data and metadata to. If ``None``,
+        a new ChannelSet is created and returned.
+    """
+    if h5py is None:
+        raise ImportError("Importing from HDF5 requires h5py.")
+
+    if channel_set is None:
+        new_channel_set = True
+        channel_set = ChannelSet()
+    else:
+        new_channel_set = False
+
+    f = h5py.File(file, 'r')
+    if not f.attrs.get('format') == HDF5_FORMAT:
+        f.close()
+        raise ValueError("{} is not a DataLogger HDF5 file".format(file))
+
+    groups = sorted((group for group in f.values()
+                     if isinstance(group, h5py.Group)),
+                    key=lambda group: group.attrs['index'])
+    for group in groups:
+        transfer_function_type = group.attrs.get('transfer_function_type')
+        # Files written by version 1 stored None as 'None'
+        if transfer_function_type in (None, 'None'):
+            transfer_function_type = None
+        channel_set.add_channels()
+        i = len(channel_set) - 1
+        channel_set.set_channel_metadata(i, {
+            "name": group.attrs['name'],
+            "comments": group.attrs['comments'],
+            "tags": json.loads(group.attrs['tags']),
+            "sample_rate": float(group.attrs['sample_rate']),
+            "calibration_factor": float(group.attrs['calibration_factor']),
+            "transfer_function_type": transfer_function_type})
+
+        channel = channel_set.channels[i]
+        for id_, dataset in group.items():
+            if id_ in AutogeneratedDataSet.generated_ids:
+                channel.add_dataset(id_, dataset.attrs.get('units'),
+                                    dataset[()])
+            else:
+                channel.add_lazy_dataset(id_, dataset.attrs.get('units'),
+                                         dataset)
+
+    if new_channel_set:
+        return channel_set
+
 class DataImportWidget(QWidget):
     sig_replace_channelset = pyqtSignal(object)
     sig_extend_channelset = pyqtSignal(object)
@@ -134,7 +203,11 @@ class DataImportWidget(QWidget):
         self.import_btn.clicked.connect(self.import_files)
         self.pickle_btn = QPushButton('Import Pickle Files',self)
         self.pickle_btn.clicked.connect(self.load_pickle)
+        self.hdf5_btn = QPushButton('Import HDF5 Files',self)
+        self.hdf5_btn.clicked.connect(self.import_hdf5)
+        self.hdf5_btn.setEnabled(h5py is not None)
         layout.addWidget(self.import_btn)
+        layout.addWidget(self.hdf5_btn)
         layout.addWidget(self.pickle_btn)
         layout.addWidget(QLabel('New ChannelSet Preview',self))
 
@@ -199,6 +272,23 @@ class DataImportWidget(QWidget):
 
         self.set_channel_set(self.new_cs)
 
+    def import_hdf5(self):
+        url = QFileDialog.getOpenFileName(self, "Load Channel Set", "",
+                                          "HDF5 Files (*.h5 *.hdf5)")[0]
+        if not url:
+            return
+        try:
+            import_from_hdf5(url, self.new_cs)
+        except:
+            t,v,tb = sys.exc_info()
+            print(t)
+            print(v)
+            print(traceback.format_tb(tb))
+            print('Load failed.')
+            return
+
+        self.set_channel_set(self.new_cs)
+
     def load_pickle(self):
         '''
         This is probably a temporary solution to loading data.
@@ -1,9 +1,14 @@
+from collections import OrderedDict
+
 import numpy as np
 
 
 def to_dB(x):
-    """A simple function that converts x to dB: ``20*np.log10(x)``"""
-    result = np.asarray(20*np.log10(x))
+    """A simple function that converts x to dB: ``20*np.log10(x)``, with
+    0 where x is not positive."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = np.asarray(np.log10(x))
+    result *= 20
     result[~np.isfinite(result)] = 0
     return result
 
@@ -17,6 +22,164 @@ def from_dB(x):
     return result
 
 
+def minmax_pyramid(y, base_level=3, min_length=1024):
+    """Build a min/max pyramid of *y*: the minimum and maximum of *y* in bins
+    of 2^k samples, for k from *base_level* upwards. Each level is computed
+    from the previous one, so the whole pyramid costs one pass over *y*.
+
+    Parameters
+    ----------
+    y : ndarray
+        The 1d data.
+    base_level : int
+        The finest level. Bins of fewer samples are cheap to reduce from the
+        data directly, and would take a lot of memory.
+    min_length : int
+        Stop once a level has fewer bins than this.
+
+    Returns
+    -------
+    list of tuple
+        ``(bin_size, mins, maxs)`` for each level, from the finest to the
+        coarsest. Empty if *y* is too short to need a pyramid.
+    """
+    y = np.asarray(y)
+    bin_size = 2**base_level
+    n = y.shape[0]
+    pyramid = []
+    if y.ndim != 1 or n < 2*bin_size:
+        return pyramid
+
+    # The finest level is reduced from the data, with a partial last bin
+    m = n // bin_size * bin_size
+    mins = y[:m].reshape((-1, bin_size)).min(axis=1)
+    maxs = y[:m].reshape((-1, bin_size)).max(axis=1)
+    if m < n:
+        mins = np.append(mins, y[m:].min())
+        maxs = np.append(maxs, y[m:].max())
+    pyramid.append((bin_size, mins, maxs))
+
+    # Every other level is reduced from the previous one
+    while mins.shape[0] >= 2*min_length:
+        h = mins.shape[0] // 2
+        next_mins = np.minimum(mins[0:2*h:2], mins[1:2*h:2])
+        next_maxs = np.maximum(maxs[0:2*h:2], maxs[1:2*h:2])
+        if mins.shape[0] > 2*h:
+            next_mins = np.append(next_mins, mins[-1])
+            next_maxs = np.append(next_maxs, maxs[-1])
+        mins, maxs = next_mins, next_maxs
+        bin_size *= 2
+        pyramid.append((bin_size, mins, maxs))
+
+    return pyramid
+
+
+def minmax_decimate(x, y, num_bins, x_range=None, pyramid=None):
+    """Reduce *x* and *y* to the minimum and maximum of *y* in each of
+    *num_bins* bins, so that the envelope of the data is kept when plotting.
+
+    Parameters
+    ----------
+    x : ndarray
+        The x values, sorted in ascending order.
+    y : ndarray
+        The y values.
+    num_bins : int
+        The number of bins, e.g. the number of horizontal pixels. At most
+        2 points are returned per bin.
+    x_range : tuple of float, optional
+        Only decimate the data between these x values (plus one sample either
+        side, so lines still reach the edges of the view).
+    pyramid : list, optional
+        The :func:`minmax_pyramid` of *y*. If given, the bins are reduced from
+        the coarsest suitable level, so the cost only depends on *num_bins*.
+
+    Returns
+    -------
+    x_decimated, y_decimated : ndarray
+        The decimated data. If the data already has fewer than 2 points per
+        bin, it is returned as it is (sliced to *x_range*).
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n = y.shape[0]
+    start, stop = 0, n
+    if x_range is not None:
+        start = max(np.searchsorted(x, x_range[0], side='right') - 1, 0)
+        stop = min(np.searchsorted(x, x_range[1], side='left') + 1, stop)
+    num_bins = max(int(num_bins), 1)
+
+    if stop - start <= 2*num_bins:
+        return x[start:stop], y[start:stop]
+
+    bin_size = int(np.ceil((stop - start) / num_bins))
+
+    # Pick the coarsest level of the pyramid with at least 2 of its bins
+    # per bin, so aligning the bins to it changes their number by at most 1/2
+    level_size, mins, maxs = 1, y, y
+    for level in (pyramid or []):
+        if 2*level[0] <= bin_size:
+            level_size, mins, maxs = level
+    if level_size > 1:
+        # Align the bins to the bins of the level
+        bin_size = -(-bin_size // level_size) * level_size
+        start = start // level_size * level_size
+    level_start = start // level_size
+    level_stop = -(-stop // level_size)
+    level_bins = np.arange(0, level_stop - level_start, bin_size // level_size)
+
+    # Interleave the minimum and maximum of each bin
+    y_decimated = np.empty(2*level_bins.shape[0], dtype=y.dtype)
+    y_decimated[0::2] = np.minimum.reduceat(mins[level_start:level_stop],
+                                            level_bins)
+    y_decimated[1::2] = np.maximum.reduceat(maxs[level_start:level_stop],
+                                            level_bins)
+
+    # Place the minimum at the start and the maximum at the middle of the bin
+    bin_starts = start + level_bins*level_size
+    bin_middles = np.minimum(bin_starts + bin_size//2, n - 1)
+    x_decimated = np.empty(y_decimated.shape[0], dtype=x.dtype)
+    x_decimated[0::2] = x[bin_starts]
+    x_decimated[1::2] = x[bin_middles]
+
+    return x_decimated, y_decimated
+
+
+def _memory_owner(array):
+    """Return the array at the root of the chain of views of *array*."""
+    while isinstance(array.base, np.ndarray):
+        array = array.base
+    return array
+
+
+def stack_rows(arrays):
+    """Return the equal-shape arrays in *arrays* stacked as the rows of one
+    array. If they are evenly spaced views of the same memory, eg. the rows
+    of one 2D array, the result is a view of that memory, without copying;
+    otherwise the arrays are copied into a new array."""
+    arrays = [np.asarray(array) for array in arrays]
+    if not arrays:
+        return np.array([])
+    first = arrays[0]
+    owner = _memory_owner(first)
+    if len(arrays) > 1 and all(array.shape == first.shape and
+                               array.dtype == first.dtype and
+                               array.strides == first.strides and
+                               _memory_owner(array) is owner
+                               for array in arrays):
+        addresses = [array.__array_interface__['data'][0] for array in arrays]
+        step = addresses[1] - addresses[0]
+        if step > 0 and all(b - a == step for a, b in zip(addresses[:-1],
+                                                            addresses[1:])):
+            return np.lib.stride_tricks.as_strided(
+                first, shape=(len(arrays),) + first.shape,
+                strides=(step,) + first.strides,
+                writeable=first.flags.writeable)
+    elif len(arrays) == 1:
+        return first[np.newaxis]
+    return np.array(arrays)
+
+
 class MatlabList(list):
     """A list that allows slicing like Matlab.
 
@@ -39,6 +202,84 @@ class MatlabList(list):
             return super().__getitem__(index)
 
 
+class ArrayCache(object):
+    """A least-recently-used cache of arrays, limited by the memory they use.
+
+    The values can be arrays, or tuples/lists/dicts of arrays. When the total
+    size of the values exceeds *max_bytes*, the least recently used values
+    are evicted. A value bigger than *max_bytes* on its own is not cached.
+
+    Attributes
+    ----------
+    max_bytes : int
+        The memory budget of the cache.
+    nbytes : int
+        The memory used by the values in the cache.
+    """
+    def __init__(self, max_bytes=256*2**20):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        """Return the value stored under *key*, marking it as the most
+        recently used, or *default* if there is none."""
+        try:
+            self._items.move_to_end(key)
+        except KeyError:
+            return default
+        return self._items[key][0]
+
+    def put(self, key, value):
+        """Store *value* under *key*, evicting the least recently used values
+        if the memory budget is exceeded."""
+        self.pop(key)
+        size = ArrayCache.size_of(value)
+        if size > self.max_bytes:
+            return
+        self._items[key] = (value, size)
+        self.nbytes += size
+        self.set_max_bytes(self.max_bytes)
+
+    def pop(self, key, default=None):
+        """Remove and return the value stored under *key*."""
+        try:
+            value, size = self._items.pop(key)
+        except KeyError:
+            return default
+        self.nbytes -= size
+        return value
+
+    def set_max_bytes(self, max_bytes):
+        """Change the memory budget, evicting values if needed."""
+        self.max_bytes = max_bytes
+        while self.nbytes > self.max_bytes and self._items:
+            value, size = self._items.popitem(last=False)[1]
+            self.nbytes -= size
+
+    def clear(self):
+        """Remove all the values."""
+        self._items.clear()
+        self.nbytes = 0
+
+    @staticmethod
+    def size_of(value):
+        """Return the number of bytes used by the arrays in *value*."""
+        if isinstance(value, np.ndarray):
+            return value.nbytes
+        elif isinstance(value, dict):
+            return sum(ArrayCache.size_of(v) for v in value.values())
+        elif isinstance(value, (tuple, list)):
+            return sum(ArrayCache.size_of(v) for v in value)
+        return 0
+
+
 def sdof_modal_peak(w, wn, zn, an, phi):
     """Return a modal peak generated from the given parameters.
 
@@ -51,7 +292,9 @@ def sdof_modal_peak(w, wn, zn, an, phi):
     zn : float
         The damping factor.
     an : float
-        The complex modal constant.
+        The magnitude of the modal constant.
+    phi : float
+        The phase (rad) of the modal constant.
 
     Returns
     -------
@@ -62,8 +305,8 @@ def sdof_modal_peak(w, wn, zn, an, phi):
     -----
     The modal peak is generated by:
 
-    .. math:: \frac{a_n}{\omega_n^2 - \omega^2 + 2i\zeta_n\omega_n\omega}
+    .. math:: \frac{a_n e^{i\phi}}{\omega_n^2 - \omega^2 + 2i\zeta_n\omega_n\omega}
 
     """
 #    return an*np.exp(phi) / (wn**2 - w**2 + 2j*zn*wn**2)
-    return an*np.exp(phi) / (wn**2 - w**2 + 2j*zn*wn*w)
+    return an*np.exp(1j*phi) / (wn**2 - w**2 + 2j*zn*wn*w)
@@ -6,11 +6,12 @@ import numpy as np
 import pyqtgraph as pg
 from pyqtgraph import ImageItem
 from cued_datalogger.api.pyqt_extensions import matplotlib_lookup_table
+from cued_datalogger.api.numpy_extensions import minmax_decimate
 from PyQt5.QtWidgets import(QWidget,QMenu,QAction,QActionGroup,QWidgetAction,QGridLayout,
                             QCheckBox,QRadioButton,QLineEdit,QSpinBox,QComboBox,
                             QLabel, QApplication, QVBoxLayout, QHBoxLayout, QPushButton)
 from PyQt5.QtGui import QDoubleValidator
-from PyQt5.QtCore import QMetaObject,QSize,QCoreApplication, QTimer, pyqtSignal
+from PyQt5.QtCore import QMetaObject,QSize,QCoreApplication, QTimer, QRectF, pyqtSignal
 
 
 class InteractivePlotWidget(QWidget):
@@ -144,6 +145,11 @@ class InteractivePlotWidget(QWidget):
         the data on the plotWidget."""
         self.PlotWidget.plot(x, y, *args, **kwargs)
 
+    def plot_decimated(self, x=None, y=None, *args, **kwargs):
+        """Plot the data on the plotWidget as a
+        :class:`DecimatedPlotDataItem`. Use for long data."""
+        return self.PlotWidget.plot_decimated(x, y, *args, **kwargs)
+
     def update_limits(self, x, y):
         """Set the increment of the spinboxes, the limits of zooming and
         scrolling the PlotItem, and move the region to x=0"""
@@ -334,6 +340,15 @@ class CustomPlotWidget(pg.PlotWidget):
         self.PlotItem.plot(*args, **kwargs)
         self.autoRange(padding=0)
 
+    def plot_decimated(self, x=None, y=None, *args, **kwargs):
+        """Plot data on the widget as a :class:`DecimatedPlotDataItem`,
+        so only its min/max envelope in the current view is drawn,
+        and autoRange."""
+        item = DecimatedPlotDataItem(x, y, *args, **kwargs)
+        self.PlotItem.addItem(item)
+        self.autoRange(padding=0)
+        return item
+
     def clear_override(self, *args, **kwargs):
         """Clear the PlotItem and add the default items back in.
         Accessed as :func:`clear`, not as :func:`clear_override`."""
@@ -342,10 +357,129 @@ class CustomPlotWidget(pg.PlotWidget):
         self.set_show_region(self.show_region)
 
 
+class DecimatedPlotDataItem(pg.PlotDataItem):
+    """A PlotDataItem that keeps the full data, but only draws its min/max
+    envelope (see :func:`minmax_decimate`) over the current view range, at
+    :attr:`points_per_pixel` points per horizontal pixel. The envelope is
+    recomputed whenever the view is panned, zoomed or resized, so the cost of
+    a redraw does not depend on the length of the data.
+    The x data must be sorted in ascending order.
+
+    Attributes
+    ----------
+    full_x : ndarray
+        The full x data.
+    full_y : ndarray
+        The full y data.
+    points_per_pixel : int
+        The number of points drawn per horizontal pixel.
+    pyramid : list
+        The :func:`minmax_pyramid` of the full y data, if given to
+        :meth:`setData` with the *pyramid* keyword. Makes the cost of
+        recomputing the envelope independent of the length of the data.
+    """
+    def __init__(self, *args, points_per_pixel=2, **kwargs):
+        self.full_x = None
+        self.full_y = None
+        self.pyramid = None
+        self.points_per_pixel = points_per_pixel
+        self._y_bounds = [None, None]
+        self._decimation_key = None
+        super().__init__(*args, **kwargs)
+
+    def setData(self, *args, **kwargs):
+        """Store the full data and draw its envelope. Takes the same
+        arguments as :meth:`PlotDataItem.setData`, with the data given as
+        *y*, *x, y* or the *x* and *y* keywords, and optionally the
+        *pyramid* of *y*."""
+        x = kwargs.pop('x', None)
+        y = kwargs.pop('y', None)
+        pyramid = kwargs.pop('pyramid', None)
+        if len(args) == 1:
+            y = args[0]
+        elif len(args) == 2:
+            x, y = args
+        elif args:
+            raise TypeError("DecimatedPlotDataItem only takes x and y data")
+
+        if y is None:
+            self.full_x = None
+            self.full_y = None
+            self.pyramid = None
+            self._y_bounds = [None, None]
+            super().setData(**kwargs)
+            return
+
+        self.full_y = np.asarray(y)
+        self.pyramid = pyramid
+        if x is None:
+            self.full_x = np.arange(self.full_y.shape[0])
+        else:
+            self.full_x = np.asarray(x)
+
+        if self.pyramid:
+            # The coarsest level has the same extremes, and is much shorter
+            bin_size, mins, maxs = self.pyramid[-1]
+            self._y_bounds = [np.nanmin(mins), np.nanmax(maxs)]
+        elif self.full_y.shape[0]:
+            self._y_bounds = [np.nanmin(self.full_y), np.nanmax(self.full_y)]
+        else:
+            self._y_bounds = [None, None]
+
+        self._decimation_key = None
+        self.update_decimation(**kwargs)
+
+    def update_decimation(self, **kwargs):
+        """Draw the envelope of the full data for the current view range.
+        Any keyword arguments are passed to :meth:`PlotDataItem.setData`."""
+        if self.full_y is None:
+            return
+
+        view_box = self.getViewBox()
+        if view_box is None or view_box.width() <= 0:
+            x_range = None
+            num_bins = 1000
+        else:
+            x_range = tuple(view_box.viewRange()[0])
+            num_bins = int(view_box.width())
+        num_bins *= max(self.points_per_pixel // 2, 1)
+
+        # Nothing to do if neither the view nor the data has changed
+        key = (x_range, num_bins)
+        if key == self._decimation_key and not kwargs:
+            return
+        self._decimation_key = key
+
+        x, y = minmax_decimate(self.full_x, self.full_y, num_bins, x_range,
+                               self.pyramid)
+        super().setData(x=x, y=y, **kwargs)
+
+    def viewRangeChanged(self, vb=None, ranges=None, changed=None):
+        """Recompute the envelope when the x range of the view changes."""
+        super().viewRangeChanged(vb, ranges, changed)
+        if changed is None or changed[0]:
+            self.update_decimation()
+
+    def dataBounds(self, ax, frac=1.0, orthoRange=None):
+        """Return the range of the full data, rather than of the drawn
+        envelope, so that autoranging shows all of the data."""
+        if self.full_y is None or not self.full_y.shape[0]:
+            return [None, None]
+        if not (self.curve.isVisible() or self.scatter.isVisible()):
+            return [None, None]
+        if ax == 0:
+            return [self.full_x[0], self.full_x[-1]]
+        return list(self._y_bounds)
+
+
 class ColorMapPlotWidget(InteractivePlotWidget):
     """An InteractivePlotWidget optimised for plotting color(heat) maps.
     Uses the Matplotlib colormap given by *cmap* to color the map.
 
+    The map is placed in data coordinates, so the axes show the values of
+    *x* and *y*. Higher-resolution tiles of parts of the map can be drawn on
+    top of it with :meth:`set_tile`.
+
     Attributes
     ----------
     lookup_table : ndarray
@@ -354,14 +488,22 @@ class ColorMapPlotWidget(InteractivePlotWidget):
         The number of different colour levels to plot
     contour_spacing : int
         How closely spaced the colour levels are
+    tiles : dict
+        The ImageItems of the tiles currently drawn, by key
     """
     def __init__(self, parent=None, cmap="jet"):
         self.lookup_table = matplotlib_lookup_table(cmap)
         self.num_contours = 5
         self.contour_spacing_dB = 5
+        self.tiles = {}
         self.parent = parent
         super().__init__(parent=self.parent)
 
+    def clear(self):
+        """Clear the PlotWidget, including the tiles."""
+        super().clear()
+        self.tiles = {}
+
     def plot_colormap(self, x, y, z, num_contours=5, contour_spacing_dB=5):
         """Plot *x*, *y* and *z* on a colourmap, with colour intervals defined
         by *num_contours* at *contour_spacing_dB* intervals."""
@@ -372,39 +514,74 @@ class ColorMapPlotWidget(InteractivePlotWidget):
         self.y = y
         self.z = z
 
+        self.z_max = z.max()
         self.num_contours = num_contours
         self.contour_spacing_dB = contour_spacing_dB
         self.update_lowest_contour()
 
-        # Set up axes:
-        x_axis = self.PlotWidget.getAxis('bottom')
-        y_axis = self.PlotWidget.getAxis('left')
-
-        self.x_scale_fact = self.get_scale_fact(x)
-        self.y_scale_fact = self.get_scale_fact(y)
-
-        x_axis.setScale(self.x_scale_fact)
-        y_axis.setScale(self.y_scale_fact)
-
-        #self.autoRange()
-
-        self.z_img = ImageItem(z.transpose())
-        self.z_img.setLookupTable(self.lookup_table)
-        self.z_img.setLevels([self.lowest_contour, self.highest_contour])
-
+        self.z_img = self.make_image(x, y, z)
         self.PlotWidget.addItem(self.z_img)
 
         self.PlotWidget.autoRange()
         #self.PlotWidget.ViewBox.autoRange()
 
+    def make_image(self, x, y, z):
+        """Return an ImageItem of *z*, coloured with the current levels and
+        covering the cells centred on *x* and *y*."""
+        img = ImageItem(z.transpose())
+        img.setLookupTable(self.lookup_table)
+        img.setLevels([self.lowest_contour, self.highest_contour])
+        x_start, width = image_extent(x)
+        y_start, height = image_extent(y)
+        img.setRect(QRectF(x_start, y_start, width, height))
+        return img
+
+    def set_tile(self, key, x, y, z):
+        """Draw *z* over the map, covering *x* and *y*, as the tile *key*.
+        The colour levels of the map are used."""
+        self.remove_tile(key)
+        img = self.make_image(x, y, z)
+        # Above the map
+        img.setZValue(1)
+        self.tiles[key] = img
+        self.PlotWidget.addItem(img)
+
+    def remove_tile(self, key):
+        """Remove the tile *key*, if it is drawn."""
+        img = self.tiles.pop(key, None)
+        if img is not None:
+            self.PlotWidget.removeItem(img)
+
+    def set_contours(self, num_contours=None, contour_spacing_dB=None):
+        """Change the colour intervals to *num_contours* at
+        *contour_spacing_dB* intervals, without replotting the map."""
+        if num_contours is not None:
+            self.num_contours = num_contours
+        if contour_spacing_dB is not None:
+            self.contour_spacing_dB = contour_spacing_dB
+        if hasattr(self, 'z_img'):
+            self.update_lowest_contour()
+            for img in [self.z_img] + list(self.tiles.values()):
+                img.setLevels([self.lowest_contour, self.highest_contour])
+
     def get_scale_fact(self, var):
         return var.max() / var.size
 
     def update_lowest_contour(self):
         """Find the lowest contour to plot, as determined by the number of
         contours and the contour spacing."""
-        self.lowest_contour = self.z.max() - (self.num_contours * self.contour_spacing_dB)
-        self.highest_contour = self.z.max()
+        self.lowest_contour = self.z_max - (self.num_contours * self.contour_spacing_dB)
+        self.highest_contour = self.z_max
+
+
+def image_extent(centres):
+    """Return the (start, width) of the cells of an image that are centred
+    on the evenly spaced *centres*."""
+    if centres.size > 1:
+        spacing = (centres[-1] - centres[0]) / (centres.size - 1)
+    else:
+        spacing = 1
+    return (centres[0] - spacing/2, spacing*centres.size)
 
 
 if __name__ == '__main__':
@@ -135,6 +135,7 @@ print("Configuring dependency list...")
 if use_anaconda:
     conda_dependency_list = ['numpy', 'scipy']
     dependency_list = ['matplotlib',
+                       'h5py',
                        'pyaudio',
                        'pydaqmx',
                        'pyqt5',
@@ -143,6 +144,7 @@ else:
     dependency_list = ['numpy',
                        'scipy',
                        'matplotlib',
+                       'h5py',
                        'pyaudio',
                        'pydaqmx',
                        'pyqt5',
@@ -0,0 +1,4 @@
+import os
+
+# The package imports the Qt widgets, so the tests run without a display
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
@@ -0,0 +1,26 @@
+import numpy as np
+
+from cued_datalogger.acquisition.ChunkQueue import ChunkQueue
+
+
+def test_put_get_in_order():
+    q = ChunkQueue(4, 8, dtype=np.int16)
+    assert q.put(np.arange(8, dtype=np.int16).tobytes())
+    assert q.put(np.arange(3, dtype=np.int16))
+    assert len(q) == 2
+    np.testing.assert_array_equal(q.get(timeout=0), np.arange(8))
+    np.testing.assert_array_equal(q.get(timeout=0), np.arange(3))
+    assert q.get(timeout=0) is None
+
+
+def test_full_queue_counts_overruns():
+    q = ChunkQueue(2, 4, dtype=np.int16)
+    chunk = np.ones(4, dtype=np.int16)
+    assert q.put(chunk)
+    assert q.put(chunk)
+    assert not q.put(chunk)
+    # Chunks larger than a slot are dropped as well
+    q.get(timeout=0)
+    assert not q.put(np.ones(5, dtype=np.int16))
+    assert q.overruns == 2
+    assert len(q) == 1
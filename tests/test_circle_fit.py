@@ -0,0 +1,44 @@
+import numpy as np
+
+from cued_datalogger.analysis.circle_fit import (fit_circle_to_data, sdof_fit,
+                                                 sdof_modal_parameters)
+from cued_datalogger.api.numpy_extensions import sdof_modal_peak
+
+
+def test_sdof_fit_recovers_peak():
+    wn, zn = 2*np.pi*100, 0.02
+    omega = np.linspace(0.9*wn, 1.1*wn, 200)
+    channels = [(1e4, 0.0), (3e4, 1.0), (2e3, -2.5)]
+    # The mobility of a viscously damped peak is exactly a circle
+    transfer_function = np.array([1j*omega*sdof_modal_peak(omega, wn, zn,
+                                                           an, phi)
+                                  for an, phi in channels])
+
+    circle = fit_circle_to_data(transfer_function.real,
+                                transfer_function.imag)
+    parameters, cost = sdof_fit(omega, transfer_function, circle,
+                                transfer_function_type='velocity')
+    fitted_wn, fitted_zn, an, phi = sdof_modal_parameters(parameters)
+
+    np.testing.assert_allclose(fitted_wn, wn, rtol=1e-6)
+    np.testing.assert_allclose(fitted_zn, zn, rtol=1e-3)
+    np.testing.assert_allclose(an, [c[0] for c in channels], rtol=1e-3)
+    np.testing.assert_allclose(np.exp(1j*phi),
+                               np.exp(1j*np.array([c[1] for c in channels])),
+                               atol=1e-3)
+
+
+def test_sdof_fit_receptance_peak():
+    wn, zn = 2*np.pi*100, 0.02
+    omega = np.linspace(0.9*wn, 1.1*wn, 200)
+    transfer_function = sdof_modal_peak(omega, wn, zn, 1e4, 0.5)[np.newaxis]
+
+    circle = fit_circle_to_data(transfer_function.real,
+                                transfer_function.imag)
+    parameters, cost = sdof_fit(omega, transfer_function, circle)
+    fitted_wn, fitted_zn, an, phi = sdof_modal_parameters(parameters)
+
+    # The receptance is only nearly a circle, so the fixed offset biases
+    # the fit slightly
+    np.testing.assert_allclose(fitted_wn, wn, rtol=1e-3)
+    np.testing.assert_allclose(fitted_zn, zn, rtol=5e-2)
@@ -0,0 +1,29 @@
+import numpy as np
+
+from cued_datalogger.analysis.cwt import cwt
+
+
+def ricker(points, a):
+    x = np.arange(points) - (points - 1) / 2
+    amplitude = 2 / (np.sqrt(3*a) * np.pi**0.25)
+    return amplitude * (1 - (x/a)**2) * np.exp(-x**2 / (2*a**2))
+
+
+def test_ricker_cwt_matches_convolution():
+    x = np.random.default_rng(0).normal(size=2000)
+    scales = [2.0, 5.0, 10.0]
+    result = cwt(x, scales, wavelet='ricker')
+    for row, a in zip(result, scales):
+        expected = np.convolve(x, ricker(int(10*a) + 1, a), mode='same')
+        # Away from the edges, where the wavelet runs off the record
+        np.testing.assert_allclose(row[100:-100], expected[100:-100],
+                                   rtol=1e-3, atol=1e-3)
+
+
+def test_blocked_cwt_matches_whole_record():
+    x = np.random.default_rng(1).normal(size=5000)
+    # Smaller scales would put the Morlet wavelet above the Nyquist frequency
+    scales = np.geomspace(4, 50, 10)
+    whole = cwt(x, scales)
+    blocked = cwt(x, scales, block_size=700, scale_block_size=3)
+    np.testing.assert_allclose(blocked, whole, rtol=1e-3, atol=1e-3)
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from cued_datalogger.api.executor import (AnalysisExecutor, AnalysisBusy,
+                                          AnalysisCancelled)
+
+
+def column_sums(array, start, stop, scale=1):
+    return array[:, start:stop].sum(axis=0) * scale
+
+
+@pytest.mark.parametrize('mode', ['serial', 'thread', 'process'])
+def test_map_gives_results_in_order(mode):
+    executor = AnalysisExecutor(mode, max_workers=2)
+    try:
+        # Large enough to be passed in shared memory to a process pool
+        array = np.random.default_rng(0).normal(size=(1000, 40))
+        tasks = [(array, start, stop) for start, stop in executor.chunks(40)]
+        progress = []
+        executor.sig_progress.connect(lambda done, total:
+                                      progress.append((done, total)))
+        results = executor.map(column_sums, tasks, scale=2)
+        np.testing.assert_allclose(np.concatenate(results),
+                                   2*array.sum(axis=0))
+        assert progress[-1] == (len(tasks), len(tasks))
+        assert not executor.busy
+    finally:
+        executor.shutdown()
+
+
+def test_reentrant_map_is_skipped():
+    executor = AnalysisExecutor('serial')
+
+    def nested(x):
+        return executor.map(abs, [(x,)])
+
+    with pytest.raises(AnalysisBusy):
+        executor.map(nested, [(-1,)])
+    assert not executor.busy
+    assert executor.map(abs, [(-1,), (-2,)]) == [1, 2]
+    assert issubclass(AnalysisBusy, AnalysisCancelled)
+
+
+def test_task_errors_are_raised():
+    executor = AnalysisExecutor('thread', max_workers=2)
+    try:
+        with pytest.raises(ZeroDivisionError):
+            executor.map(divmod, [(1, 1), (1, 0)])
+    finally:
+        executor.shutdown()
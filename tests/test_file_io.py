@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from cued_datalogger.api.channel import ChannelSet
+from cued_datalogger.api.file_export import export_to_hdf5
+from cued_datalogger.api.file_import import import_from_hdf5
+
+h5py = pytest.importorskip("h5py")
+
+
+def make_channel_set():
+    cs = ChannelSet(2)
+    rng = np.random.default_rng(0)
+    for i in range(2):
+        cs.set_channel_metadata(i, {"name": "Channel {}".format(i),
+                                    "comments": "test",
+                                    "tags": ["a", "b"],
+                                    "sample_rate": 1000,
+                                    "calibration_factor": 2.0})
+        cs.add_channel_dataset(i, "time_series", rng.normal(size=5000), "V")
+        cs.add_channel_dataset(i, "spectrum",
+                               np.fft.rfft(rng.normal(size=200)))
+    cs.set_channel_metadata(0, {"transfer_function_type": None})
+    cs.set_channel_metadata(1, {"transfer_function_type": "velocity"})
+    return cs
+
+
+def test_hdf5_round_trip(tmp_path):
+    filename = str(tmp_path / 'data.h5')
+    cs = make_channel_set()
+    export_to_hdf5(filename, (1, 0), cs)
+    imported = import_from_hdf5(filename)
+
+    assert len(imported) == 2
+    for new_index, old_index in enumerate((1, 0)):
+        new = imported.channels[new_index]
+        old = cs.channels[old_index]
+        assert new.metadata() == old.metadata()
+        for id_ in ("time_series", "spectrum"):
+            np.testing.assert_array_equal(new.data(id_), old.data(id_))
+        assert new.units("time_series") == "V"
+    assert imported.channels[0].transfer_function_type == "velocity"
+    assert imported.channels[1].transfer_function_type is None
+
+
+def test_hdf5_generated_datasets_are_generated_again(tmp_path):
+    filename = str(tmp_path / 'data.h5')
+    cs = make_channel_set()
+    export_to_hdf5(filename, (0,), cs)
+    channel = import_from_hdf5(filename).channels[0]
+
+    np.testing.assert_allclose(channel.data("frequency"),
+                               np.linspace(0, 500, 101))
+    np.testing.assert_allclose(channel.data("time")[-1], 5)
+    # They still follow the sample rate
+    channel.set_metadata({"sample_rate": 2000})
+    np.testing.assert_allclose(channel.data("frequency")[-1], 1000)
+
+
+def test_not_a_datalogger_file(tmp_path):
+    filename = str(tmp_path / 'other.h5')
+    with h5py.File(filename, 'w') as f:
+        f.create_dataset('x', data=np.arange(3))
+    with pytest.raises(ValueError):
+        import_from_hdf5(filename)
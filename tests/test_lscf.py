@@ -0,0 +1,37 @@
+import numpy as np
+
+from cued_datalogger.analysis.lscf import lscf, stabilisation, select_poles, lsfd
+from cued_datalogger.api.numpy_extensions import sdof_modal_peak
+
+MODES = [(2*np.pi*50, 0.01), (2*np.pi*80, 0.02)]
+# Modal constant (magnitude, phase) of each mode in each channel. Real modal
+# constants make the sum of SDOF peaks exactly a sum of pairs of poles.
+CONSTANTS = [[(1e4, 0.0), (5e3, np.pi)],
+             [(2e4, np.pi), (1e4, 0.0)],
+             [(5e3, 0.0), (3e4, np.pi)]]
+
+
+def synthetic_transfer_functions():
+    omega = 2*np.pi*np.linspace(30, 100, 701)
+    transfer_function = np.array(
+        [sum(sdof_modal_peak(omega, wn, zn, an, phi)
+             for (wn, zn), (an, phi) in zip(MODES, channel))
+         for channel in CONSTANTS])
+    return omega, transfer_function
+
+
+def test_lscf_lsfd_recover_modes():
+    omega, transfer_function = synthetic_transfer_functions()
+
+    poles = lscf(omega, transfer_function, max_order=20)
+    status, count = stabilisation(poles)
+    modes = select_poles(poles, count, min_stable_orders=5)
+    assert modes.size == len(MODES)
+
+    wn, zn, an, phi = lsfd(omega, transfer_function, modes)
+    np.testing.assert_allclose(wn, [mode[0] for mode in MODES], rtol=1e-4)
+    np.testing.assert_allclose(zn, [mode[1] for mode in MODES], rtol=1e-2)
+    expected = np.array(CONSTANTS)
+    np.testing.assert_allclose(an, expected[:, :, 0], rtol=1e-3)
+    np.testing.assert_allclose(np.exp(1j*phi), np.exp(1j*expected[:, :, 1]),
+                               atol=1e-3)
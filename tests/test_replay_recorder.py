@@ -0,0 +1,45 @@
+import time
+
+import numpy as np
+
+from cued_datalogger.acquisition import ReplayRecorder
+from cued_datalogger.acquisition.StreamFile import StreamWriter
+
+
+def test_measure_throughput_on_synthetic_signals():
+    assert ReplayRecorder.measure_throughput(2, chunk_size=256,
+                                             duration=0.5) > 0
+
+
+def test_default_device_is_synthetic():
+    recorder = ReplayRecorder.Recorder(device_name=None)
+    try:
+        assert recorder.device_name == ReplayRecorder.SYNTHETIC
+        assert recorder.file_data is None
+    finally:
+        recorder.close()
+
+
+def test_replayed_stream_file_is_streamed_at_its_rate(tmp_path):
+    filename = str(tmp_path / 'rec.dat')
+    samples = (np.arange(2048*2).reshape((-1, 2)) % 1000).astype(np.int16)
+    writer = StreamWriter(filename, samples.shape[0], channels=2, rate=8000,
+                          dtype=np.int16)
+    writer.write(samples)
+    writer.close()
+
+    recorder = ReplayRecorder.Recorder(channels=2, rate=44100,
+                                       chunk_size=256, device_name=filename,
+                                       speed=0)
+    try:
+        assert recorder.device_name == filename
+        np.testing.assert_array_equal(recorder.file_data, samples)
+        assert recorder.stream_init()
+        assert recorder.rate == 8000
+        deadline = time.time() + 5
+        while recorder.ring_buffer.sequence < 256 and time.time() < deadline:
+            time.sleep(0.01)
+        recorder.stream_stop()
+        assert recorder.ring_buffer.sequence >= 256
+    finally:
+        recorder.close()
@@ -0,0 +1,73 @@
+import numpy as np
+
+from cued_datalogger.acquisition.RingBuffer import RingBuffer, SharedRingBuffer
+
+
+def ramp(start, stop, channels=2):
+    return np.column_stack([np.arange(start, stop)]*channels).astype(float)
+
+
+def test_latest_across_the_wrap():
+    rb = RingBuffer(100, channels=2)
+    for start in range(0, 250, 30):
+        rb.write(ramp(start, start + 30))
+    assert rb.sequence == 270
+    assert len(rb) == 100
+    np.testing.assert_array_equal(rb.latest(), ramp(170, 270))
+    np.testing.assert_array_equal(rb.latest(10), ramp(260, 270))
+    assert not rb.latest().flags.writeable
+
+
+def test_write_longer_than_capacity_keeps_newest():
+    rb = RingBuffer(100, channels=2)
+    rb.write(ramp(0, 250))
+    assert rb.sequence == 250
+    np.testing.assert_array_equal(rb.latest(), ramp(150, 250))
+
+
+def test_read_since():
+    rb = RingBuffer(100, channels=2)
+    rb.write(ramp(0, 40))
+    data, seq = rb.read_since(0)
+    np.testing.assert_array_equal(data, ramp(0, 40))
+    rb.write(ramp(40, 70))
+    data, seq = rb.read_since(seq, copy=True)
+    assert seq == 70
+    np.testing.assert_array_equal(data, ramp(40, 70))
+    data, seq = rb.read_since(seq)
+    assert data.shape == (0, 2)
+
+
+def test_read_since_lapped_reader_gets_newest():
+    rb = RingBuffer(100, channels=2)
+    rb.write(ramp(0, 10))
+    seq = rb.sequence
+    for start in range(10, 310, 50):
+        rb.write(ramp(start, start + 50))
+    data, seq = rb.read_since(seq)
+    assert seq == 310
+    np.testing.assert_array_equal(data, ramp(210, 310))
+
+
+def test_copy_drops_samples_overwritten_during_the_copy():
+    rb = RingBuffer(100, channels=2)
+    rb.write(ramp(0, 100))
+    # As if the writer had started overwriting the 30 oldest samples
+    rb._writing = rb.sequence + 30
+    data = rb._copy_valid(rb.latest(), rb.sequence - 100)
+    np.testing.assert_array_equal(data, ramp(30, 100))
+
+
+def test_shared_ring_buffer_attach():
+    rb = SharedRingBuffer(64, channels=2, dtype=np.float32)
+    try:
+        reader = SharedRingBuffer.attach(rb.descriptor())
+        try:
+            rb.write(ramp(0, 80).astype(np.float32))
+            assert reader.sequence == 80
+            np.testing.assert_array_equal(reader.latest(copy=True),
+                                          ramp(16, 80))
+        finally:
+            reader.close()
+    finally:
+        rb.close()
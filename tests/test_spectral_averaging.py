@@ -0,0 +1,51 @@
+import numpy as np
+import scipy.signal
+
+from cued_datalogger.analysis.spectral_averaging import (welch_spectra,
+                                                         welch_spectra_columns)
+
+
+def test_welch_spectra_match_scipy():
+    x = np.random.default_rng(0).normal(size=(8192, 3))
+    window = np.hanning(512)
+    spectra = welch_spectra(x, input_channel=0, segment_length=512,
+                            overlap=0.5, sample_rate=1000, scaling='density')
+
+    frequencies, psd = scipy.signal.welch(x, fs=1000, window=window,
+                                          detrend=False, axis=0)
+    np.testing.assert_allclose(spectra.auto_spectra, psd, rtol=1e-10)
+    frequencies, csd = scipy.signal.csd(x[:, [0]], x, fs=1000, window=window,
+                                        detrend=False, axis=0)
+    np.testing.assert_allclose(spectra.cross_spectra, csd, rtol=1e-10,
+                               atol=1e-15)
+
+
+def test_calibration_factor_scales_density():
+    x = np.random.default_rng(1).normal(size=(4096, 2))
+    kwargs = dict(segment_length=256, sample_rate=1000, scaling='density')
+    spectra = welch_spectra(x, **kwargs)
+    calibrated = welch_spectra(x, calibration_factor=3, **kwargs)
+    np.testing.assert_allclose(calibrated.auto_spectra,
+                               9*spectra.auto_spectra)
+
+
+def test_whole_record_spectrum_keeps_phase():
+    x = np.random.default_rng(2).normal(size=(1000, 2))
+    spectra = welch_spectra(x)
+    np.testing.assert_allclose(spectra.spectrum(),
+                               np.fft.rfft(x*np.hanning(1000)[:, None], axis=0))
+
+
+def test_transfer_function_of_known_system():
+    rng = np.random.default_rng(3)
+    x = rng.normal(size=2**16)
+    b, a = scipy.signal.butter(2, 0.2)
+    y = scipy.signal.lfilter(b, a, x)
+    spectra = welch_spectra_columns(np.column_stack([x, y]), 1, 2,
+                                    input_channel=0, segment_length=1024)
+    frequencies, response = scipy.signal.freqz(b, a, worN=513)
+    transfer_function = spectra.transfer_function('H1')[:, 1]
+    # Away from the stop band, where the transient of each segment matters
+    np.testing.assert_allclose(transfer_function[:150], response[:150],
+                               rtol=0.05, atol=0.02)
+    assert np.all(spectra.coherence()[:150, 1] > 0.98)
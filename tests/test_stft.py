@@ -0,0 +1,27 @@
+import numpy as np
+import scipy.signal
+
+from cued_datalogger.analysis.stft import stft
+
+
+def test_stft_matches_scipy_spectrogram():
+    x = np.random.default_rng(0).normal(size=5000)
+    frequencies, times, spectrum = stft(x, 256, step=64, sample_rate=1000,
+                                        dtype=np.complex128, block_size=7)
+    f, t, expected = scipy.signal.spectrogram(x, fs=1000, window='hann',
+                                              nperseg=256, noverlap=192,
+                                              mode='complex')
+    np.testing.assert_allclose(frequencies, f)
+    np.testing.assert_allclose(times, t)
+    np.testing.assert_allclose(spectrum, expected.T, atol=1e-12)
+
+
+def test_pooled_stft_is_max_of_frames():
+    x = np.random.default_rng(1).normal(size=10000)
+    f, times, magnitude = stft(x, 128, step=100, output='magnitude')
+    f, pooled_times, pooled = stft(x, 128, step=100, output='magnitude',
+                                   pool=4, block_size=10)
+    expected = np.maximum.reduceat(magnitude, np.arange(0, len(times), 4))
+    np.testing.assert_allclose(pooled, expected)
+    np.testing.assert_allclose(pooled_times[:-1],
+                               times[:len(times)//4*4].reshape(-1, 4).mean(1))
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from cued_datalogger.acquisition.StreamFile import (StreamWriter,
+                                                    read_stream_file)
+
+
+def test_stream_file_round_trip(tmp_path):
+    filename = str(tmp_path / 'rec.dat')
+    writer = StreamWriter(filename, 1000, channels=2, rate=8000,
+                          dtype=np.int16, calibration_factor=0.5)
+    chunks = [np.full((100, 2), i, dtype=np.int16) for i in range(5)]
+    for chunk in chunks:
+        writer.write(chunk)
+    data = writer.close()
+    np.testing.assert_array_equal(data, np.vstack(chunks))
+
+    data, header = read_stream_file(filename)
+    np.testing.assert_array_equal(data, np.vstack(chunks))
+    assert header['channels'] == 2
+    assert header['rate'] == 8000
+    assert header['dtype'] == np.int16
+    assert header['calibration_factor'] == 0.5
+    assert header['num_samples'] == 500
+
+
+def test_full_stream_file_discards_the_rest(tmp_path):
+    filename = str(tmp_path / 'rec.dat')
+    writer = StreamWriter(filename, 150, channels=1)
+    writer.write(np.arange(100.0).reshape((-1, 1)))
+    writer.write(np.arange(100.0, 200.0).reshape((-1, 1)))
+    data = writer.close()
+    np.testing.assert_array_equal(data[:, 0], np.arange(150.0))
+
+
+def test_not_a_stream_file(tmp_path):
+    filename = tmp_path / 'other.dat'
+    filename.write_bytes(b'\0'*64)
+    with pytest.raises(ValueError):
+        read_stream_file(str(filename))
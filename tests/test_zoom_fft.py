@@ -0,0 +1,21 @@
+import numpy as np
+
+from cued_datalogger.analysis.zoom_fft import zoom_fft, zoom_frequencies
+
+
+def test_zoom_fft_matches_rfft_bins():
+    x = np.random.default_rng(0).normal(size=(3, 1000))
+    # The rfft bins 100 to 200 of a 1000 sample record at 1000 Hz
+    frequencies, spectrum = zoom_fft(x, 100, 200, 101, sample_rate=1000)
+    np.testing.assert_allclose(frequencies, np.arange(100, 201))
+    np.testing.assert_allclose(spectrum, np.fft.rfft(x)[:, 100:201],
+                               atol=1e-8)
+
+
+def test_zoom_fft_matches_direct_dft():
+    x = np.random.default_rng(1).normal(size=500)
+    frequencies, spectrum = zoom_fft(x, 95.5, 105.25, 40, sample_rate=1000)
+    np.testing.assert_allclose(frequencies, zoom_frequencies(95.5, 105.25, 40))
+    n = np.arange(x.size)
+    direct = np.exp(-2j*np.pi*np.outer(frequencies, n)/1000) @ x
+    np.testing.assert_allclose(spectrum, direct, atol=1e-8)